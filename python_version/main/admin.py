@@ -2,17 +2,51 @@
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from django.db.models import Count
+from django.db.models import Count, Q
 from django.contrib.auth import get_user_model
 from django.utils.html import format_html
 from .models import (
-    MiniGame, GameSession, VoiceChannel, Server, ServerRole, 
+    MiniGame, GameSession, GameArchive, VoiceChannel, Server, ServerRole,
     ServerMember, TextChannel, ChatMessage
 )
+from . import channel_access, chat_search
 
 User = get_user_model()
 
 
+class PendingDeletionAdminMixin:
+    """
+    Admin delete only marks the object (request_deletion); the
+    process_deletions command removes it and its dependents in batches.
+    Marked objects disappear from the changelist right away.
+    """
+
+    def get_deleted_objects(self, objs, request):
+        # Kaskadı toplamak milyonlarca satırı gezmek demek; sadece seçilenleri listele
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        obj.request_deletion()
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.request_deletion()
+
+
+class ChannelAccessAdminMixin:
+    """Deleting members or voice channels sends no signal channel_access listens to."""
+
+    def delete_model(self, request, obj):
+        server_slug = obj.server.slug
+        super().delete_model(request, obj)
+        channel_access.invalidate(server_slug)
+
+    def delete_queryset(self, request, queryset):
+        server_slugs = set(queryset.values_list('server__slug', flat=True))
+        super().delete_queryset(request, queryset)
+        channel_access.invalidate(*server_slugs)
+
+
 @admin.register(MiniGame)
 class MiniGameAdmin(admin.ModelAdmin):
     """
@@ -56,7 +90,7 @@ class MiniGameAdmin(admin.ModelAdmin):
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(PendingDeletionAdminMixin, BaseUserAdmin):
     """
     CustomUser modeli için özel admin ayarları.
     """
@@ -77,13 +111,13 @@ class GameSessionAdmin(admin.ModelAdmin):
     """
     list_display = (
         '__str__', 'game_type', 'host', 'status',
-        'player_count_display', 'board_size', 'created_at'
+        'player_count_display', 'board_size', 'created_at', 'last_activity_at'
     )
     list_filter = ('status', 'game_type', 'created_at')
     search_fields = ('game_id', 'host__username')
 
     readonly_fields = (
-        'game_id', 'created_at', 'player_count_display', 'players_list'
+        'game_id', 'created_at', 'last_activity_at', 'player_count_display', 'players_list'
     )
 
     fields = (
@@ -106,8 +140,35 @@ class GameSessionAdmin(admin.ModelAdmin):
 
     players_list.short_description = "Katılan Oyuncular"
 
+
+@admin.register(GameArchive)
+class GameArchiveAdmin(admin.ModelAdmin):
+    """
+    Arşivlenmiş (bitmiş) oyunlar için salt okunur admin.
+    """
+    list_display = ('__str__', 'game_type', 'host', 'winner', 'move_count', 'duration', 'finished_at')
+    list_filter = ('game_type', 'finished_at')
+    search_fields = ('game_id', 'host__username', 'winner__username')
+    date_hierarchy = 'finished_at'
+    readonly_fields = (
+        'game_id', 'game_type', 'host', 'winner', 'players_list', 'board_size',
+        'move_count', 'created_at', 'finished_at', 'duration', 'archived_at'
+    )
+    exclude = ('players', 'final_board', 'moves')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('game_type', 'host', 'winner')
+
+    def has_add_permission(self, request):
+        return False
+
+    def players_list(self, obj):
+        return ", ".join(obj.player_usernames)
+
+    players_list.short_description = "Katılan Oyuncular"
+
 @admin.register(Server)
-class ServerAdmin(admin.ModelAdmin):
+class ServerAdmin(PendingDeletionAdminMixin, admin.ModelAdmin):
     """Admin interface for Server model"""
     list_display = ('icon_display', 'name', 'owner', 'member_count', 'channel_count', 'is_private', 'created_at')
     list_filter = ('is_private', 'created_at')
@@ -121,7 +182,7 @@ class ServerAdmin(admin.ModelAdmin):
             'fields': ('name', 'slug', 'icon', 'description', 'owner')
         }),
         ('Settings', {
-            'fields': ('is_private',)
+            'fields': ('is_private', 'message_retention_days')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -186,7 +247,7 @@ class ServerRoleAdmin(admin.ModelAdmin):
 
 
 @admin.register(ServerMember)
-class ServerMemberAdmin(admin.ModelAdmin):
+class ServerMemberAdmin(ChannelAccessAdminMixin, admin.ModelAdmin):
     """Admin interface for ServerMember model"""
     list_display = ('user', 'server', 'nickname', 'role_list', 'is_online', 'joined_at')
     list_filter = ('is_online', 'server', 'joined_at')
@@ -220,7 +281,7 @@ class ServerMemberAdmin(admin.ModelAdmin):
 
 
 @admin.register(TextChannel)
-class TextChannelAdmin(admin.ModelAdmin):
+class TextChannelAdmin(PendingDeletionAdminMixin, admin.ModelAdmin):
     """Admin interface for TextChannel model"""
     list_display = ('name', 'server', 'position', 'message_count', 'is_private', 'created_at')
     list_filter = ('is_private', 'server', 'created_at')
@@ -249,7 +310,7 @@ class TextChannelAdmin(admin.ModelAdmin):
 
 
 @admin.register(VoiceChannel)
-class VoiceChannelAdmin(admin.ModelAdmin):
+class VoiceChannelAdmin(ChannelAccessAdminMixin, admin.ModelAdmin):
     """Admin interface for VoiceChannel model"""
     list_display = ('name', 'server', 'position', 'user_limit_display', 'is_private', 'created_at')
     list_filter = ('is_private', 'server', 'created_at')
@@ -262,7 +323,7 @@ class VoiceChannelAdmin(admin.ModelAdmin):
             'fields': ('server', 'name', 'slug', 'description', 'position')
         }),
         ('Settings', {
-            'fields': ('user_limit', 'is_private')
+            'fields': ('user_limit', 'is_private', 'sfu_enabled', 'sfu_threshold')
         }),
         ('Timestamps', {
             'fields': ('created_at',),
@@ -283,13 +344,15 @@ class ChatMessageAdmin(admin.ModelAdmin):
     """Admin interface for ChatMessage model"""
     list_display = ('user', 'channel', 'content_preview', 'created_at', 'edited_at')
     list_filter = ('channel__server', 'created_at', 'edited_at')
+    # İçerik araması full-text index'ten yapılır (bkz. get_search_results)
     search_fields = ('content', 'user__username', 'channel__name')
+    search_help_text = 'Full-text search in message content, or an exact username / channel name.'
     readonly_fields = ('created_at', 'edited_at')
     date_hierarchy = 'created_at'
     
     fieldsets = (
         ('Message Information', {
-            'fields': ('channel', 'user', 'content')
+            'fields': ('channel', 'user', 'content', 'language')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'edited_at'),
@@ -304,4 +367,20 @@ class ChatMessageAdmin(admin.ModelAdmin):
     content_preview.short_description = 'Content'
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('user', 'channel', 'channel__server')
\ No newline at end of file
+        return super().get_queryset(request).select_related('user', 'channel', 'channel__server')
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Uses the search_vector GIN index instead of icontains scans. Username
+        and channel name matches are resolved to ids first so the planner can
+        still combine indexes.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        queryset = queryset.filter(
+            Q(search_vector=chat_search.build_query(search_term, request.LANGUAGE_CODE))
+            | Q(user__in=User.objects.filter(username__iexact=search_term).values('id'))
+            | Q(channel__in=TextChannel.objects.filter(name__iexact=search_term).values('id'))
+        )
+        return queryset, False
\ No newline at end of file
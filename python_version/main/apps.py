@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # channel_access ve read_state'in sinyal alıcılarını bağlar
+        from . import channel_access, read_state  # noqa: F401
+        channel_access.check_cache_is_shared()
@@ -0,0 +1,206 @@
+"""
+Connect-time channel lookup and join check for the WebSocket consumers, served
+from the Django cache so that a reconnect storm after a deploy costs almost no
+queries.
+
+Two entries per server, keyed by the server slug:
+- directory: the Server and its text/voice channels by (type, slug); a slug
+  with no server is cached too, as a directory without one;
+- members: the ids of the server's members (only read when the server or
+  the channel is private).
+
+Saving a Server, TextChannel, VoiceChannel or ServerMember, deleting a
+Server, and request_deletion drop the server's entries once the transaction
+commits. Deleting channels or members listens to no signal (a post_delete
+receiver would turn off Django's fast delete, one query per row when a server
+is purged); the code that deletes them calls invalidate() itself, once per
+server. QuerySet.update() and bulk_create() send no signals; 'timeout' bounds
+how stale those can get.
+
+Invalidation only reaches the configured cache, so with a multi-process
+channel layer the cache must be shared by the processes too:
+check_cache_is_shared() (run at start-up) refuses a per-process one.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Server, ServerMember, TextChannel, VoiceChannel, deletion_requested
+
+logger = logging.getLogger('main')
+
+CHANNEL_ACCESS_DEFAULTS = {
+    'cache': 'default',
+    'timeout': 300,
+}
+
+KEY_PREFIX = 'channel_access'
+CHANNEL_TYPES = ('text', 'voice')
+# Her süreçte ayrı kopya tutan önbellekler
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+# Tek süreçte çalışan kanal katmanları
+SINGLE_PROCESS_LAYERS = ('channels.layers.InMemoryChannelLayer',)
+
+
+def get_channel_access_config():
+    config = dict(CHANNEL_ACCESS_DEFAULTS)
+    config.update(getattr(settings, 'CHANNEL_ACCESS', {}))
+    return config
+
+
+def check_cache_is_shared():
+    """
+    Raises ImproperlyConfigured when the channel layer spans processes but
+    the cache does not: a member removed on one worker would keep access on
+    the others until the entry expires.
+    """
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {}).get('BACKEND')
+    alias = get_channel_access_config()['cache']
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if layer not in SINGLE_PROCESS_LAYERS and backend in PER_PROCESS_CACHES:
+        raise ImproperlyConfigured(
+            f"CHANNEL_ACCESS['cache'] ({alias!r}, {backend}) is per process but the channel layer {layer} "
+            f"serves several processes; point it at a shared cache (see CACHES['shared'] in settings)."
+        )
+
+
+def _keys(server_slug):
+    return f'{KEY_PREFIX}:dir:{server_slug}', f'{KEY_PREFIX}:members:{server_slug}'
+
+
+def _load_directory(server_slug):
+    server = Server.objects.filter(slug=server_slug).first()
+    channels = {}
+    if server is not None:
+        for channel_type, model in (('text', TextChannel), ('voice', VoiceChannel)):
+            for channel in model.objects.filter(server=server):
+                # Sunucu içinde slug tekil değil; sıralamada ilk gelen kazanır
+                channels.setdefault((channel_type, channel.slug), channel)
+    return {'server': server, 'channels': channels}
+
+
+def _cached(key, load, config):
+    cache = caches[config['cache']]
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, config['timeout'])
+    return value
+
+
+def is_member(server, user_id):
+    """The owner or a ServerMember of server (member ids come from the cache)."""
+    if user_id == server.owner_id:
+        return True
+    members = _cached(
+        _keys(server.slug)[1],
+        lambda: set(ServerMember.objects.filter(server=server).values_list('user_id', flat=True)),
+        get_channel_access_config(),
+    )
+    return user_id in members
+
+
+def may_join(server, channel, user_id):
+    """server_view's rule: the owner and members always; others only public channels of public servers."""
+    if not (server.is_private or channel.is_private):
+        return True
+    return is_member(server, user_id)
+
+
+def visible_channels(model, server, user_id):
+    """Queryset of the server's live channels of model that may_join lets user_id into."""
+    channels = model.objects.filter(server=server)
+    if is_member(server, user_id):
+        return channels
+    if server.is_private:
+        return channels.none()
+    return channels.filter(is_private=False)
+
+
+def resolve(server_slug, channel_type, slug, user_id):
+    """
+    Returns (channel, allowed) for the channel `slug` of type 'text' or
+    'voice' (None: text first, then voice) in server `server_slug`;
+    channel is None if there is no such channel.
+    """
+    config = get_channel_access_config()
+    directory = _cached(_keys(server_slug)[0], lambda: _load_directory(server_slug), config)
+    server = directory['server']
+    if server is None:
+        return None, False
+    types = [channel_type] if channel_type in CHANNEL_TYPES else CHANNEL_TYPES
+    for kind in types:
+        channel = directory['channels'].get((kind, slug))
+        if channel is not None:
+            return channel, may_join(server, channel, user_id)
+    return None, False
+
+
+def lookup(server_slug, channel_type, slug, user_id):
+    """
+    resolve() when server_slug is given. Without it (oda.html, old clients)
+    the slug is looked up across all servers, uncached; a slug used in
+    several servers is rejected as not found.
+    """
+    if server_slug:
+        return resolve(server_slug, channel_type, slug, user_id)
+
+    if channel_type == 'text':
+        models = [TextChannel]
+    elif channel_type == 'voice':
+        models = [VoiceChannel]
+    else:
+        logger.warning(f"No channel_type specified for slug '{slug}'. Auto-detecting (may cause conflicts).")
+        models = [TextChannel, VoiceChannel]
+    for model in models:
+        found = list(model.objects.filter(slug=slug).select_related('server')[:2])
+        if len(found) > 1:
+            logger.warning(f"{model.__name__} slug '{slug}' exists in several servers; server_slug is required")
+            return None, False
+        if found:
+            channel = found[0]
+            # Sunucusuz eski kanallar herkese açık
+            return channel, channel.server is None or may_join(channel.server, channel, user_id)
+    return None, False
+
+
+def invalidate(*server_slugs):
+    keys = [key for server_slug in server_slugs if server_slug for key in _keys(server_slug)]
+    if keys:
+        cache = caches[get_channel_access_config()['cache']]
+        # Commit'ten önce silinirse başka bir bağlantı eski satırları tekrar önbelleğe alabilir
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _server_slug(instance):
+    """Slug of the server of a channel or member, without a query when the server is loaded."""
+    if not instance.server_id:
+        return None
+    if type(instance).server.is_cached(instance):
+        return instance.server.slug
+    return Server.all_objects.filter(pk=instance.server_id).values_list('slug', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Server)
+def _server_changed(sender, instance, **kwargs):
+    invalidate(instance.slug)
+
+
+@receiver(post_save, sender=TextChannel)
+@receiver(post_save, sender=VoiceChannel)
+@receiver(post_save, sender=ServerMember)
+def _server_part_changed(sender, instance, **kwargs):
+    invalidate(_server_slug(instance))
+
+
+@receiver(deletion_requested)
+def _deletion_requested(sender, instance, **kwargs):
+    if sender is Server:
+        invalidate(instance.slug)
+    elif sender is TextChannel:
+        invalidate(_server_slug(instance))
@@ -0,0 +1,113 @@
+"""
+Bulk export of chat history (moderation and data requests).
+
+Rows are read with a server-side cursor in (created_at, id) order, a chunk
+at a time, so memory stays flat no matter how many messages match. The same
+generators back the export_chat command and the staff endpoint.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ChatMessage, CustomUser, Server, TextChannel
+from .streaming import csv_lines, gzip_chunks, ndjson_lines
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = {
+    # çıktı adı -> ChatMessage.values() yolu
+    'id': 'id',
+    'server': 'channel__server__slug',
+    'channel': 'channel__slug',
+    'user_id': 'user_id',
+    'username': 'user__username',
+    'content': 'content',
+    'language': 'language',
+    'created_at': 'created_at',
+    'edited_at': 'edited_at',
+}
+
+
+def parse_moment(value, end_of_day=False):
+    """ISO datetime or date -> aware datetime (a bare date is midnight, or the next midnight for end_of_day)."""
+    try:
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.combine(day, time.min)
+        if end_of_day:
+            moment += timedelta(days=1)
+    elif moment is None:
+        raise ValueError(f"Invalid date: {value!r}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(server=None, channel=None, user=None, since=None, until=None):
+    """Matching messages oldest first; since is inclusive, until exclusive."""
+    messages = ChatMessage.objects.all()
+    if channel is not None:
+        messages = messages.filter(channel=channel)
+    elif server is not None:
+        # Silinmeyi bekleyen kanallar da dahil (all_objects)
+        messages = messages.filter(channel_id__in=TextChannel.all_objects.filter(server=server).values('id'))
+    if user is not None:
+        messages = messages.filter(user=user)
+    if since is not None:
+        messages = messages.filter(created_at__gte=since)
+    if until is not None:
+        messages = messages.filter(created_at__lt=until)
+    return messages.order_by('created_at', 'id')
+
+
+def export_queryset_from_params(server=None, channel=None, user=None, since=None, until=None):
+    """
+    Same as export_queryset but from slugs/username/date strings (query string
+    or command line). Raises ValueError with a readable message.
+    Objects waiting for deletion can still be exported.
+    """
+    filters = {}
+    if server:
+        filters['server'] = Server.all_objects.filter(slug=server).first()
+        if filters['server'] is None:
+            raise ValueError(f"Unknown server: {server}")
+    if channel:
+        if not server:
+            raise ValueError("A channel export needs the server as well")
+        filters['channel'] = TextChannel.all_objects.filter(server=filters['server'], slug=channel).first()
+        if filters['channel'] is None:
+            raise ValueError(f"Unknown channel: {channel}")
+    if user:
+        filters['user'] = CustomUser.all_objects.filter(username=user).first()
+        if filters['user'] is None:
+            raise ValueError(f"Unknown user: {user}")
+    if since:
+        filters['since'] = parse_moment(since)
+    if until:
+        filters['until'] = parse_moment(until, end_of_day=True)
+    return export_queryset(**filters)
+
+
+def export_records(queryset, chunk_size=CHUNK_SIZE):
+    """Yields one dict per message; iterator() keeps a named cursor open on Postgres."""
+    paths = list(EXPORT_FIELDS.values())
+    names = list(EXPORT_FIELDS)
+    for row in queryset.values_list(*paths).iterator(chunk_size=chunk_size):
+        yield dict(zip(names, row))
+
+
+def export_chunks(queryset, export_format='ndjson', compress=False, chunk_size=CHUNK_SIZE):
+    """Bytes chunks of the whole export in the requested format."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format!r}")
+    records = export_records(queryset, chunk_size=chunk_size)
+    if export_format == 'csv':
+        chunks = csv_lines(records, list(EXPORT_FIELDS))
+    else:
+        chunks = ndjson_lines(records)
+    return gzip_chunks(chunks) if compress else chunks
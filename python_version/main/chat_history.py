@@ -0,0 +1,151 @@
+"""
+Chat history reads.
+
+Pages are cut with keyset pagination on (created_at, id), which is served
+by the (channel, created_at, id) index: every page costs one index range
+scan no matter how far back the user has scrolled.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Subquery
+
+from .chat_render import RENDER_VERSION, render_message
+from .models import ChatMessage
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def serialize_message(message):
+    if message.render_version != RENDER_VERSION:
+        # Render kuralları değişmeden önce yazılmış mesaj: okurken render et (kaydetmeden)
+        rendered = render_message(message.content)
+    else:
+        rendered = {'html': message.rendered_content, 'mentions': message.mentions, 'links': message.links}
+    return {
+        'id': message.id,
+        'channel_id': message.channel_id,
+        'author': message.user.username,
+        'content': message.content,
+        'html': rendered['html'],
+        'mentions': rendered['mentions'],
+        'links': rendered['links'],
+        'timestamp': message.created_at.isoformat(),
+        'created_at': message.created_at.strftime('%I:%M %p'),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+    }
+
+
+def encode_cursor(created_at, message_id):
+    """created_at may be a datetime or its isoformat() string."""
+    if not isinstance(created_at, str):
+        created_at = created_at.isoformat()
+    raw = f"{created_at}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id); raises ValueError for anything malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, message_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _older_than(queryset, created_at, message_id):
+    # created_at__lte tutarak index aralık taramasını koruyoruz; eşitlikte id ayırır
+    return queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=message_id)
+
+
+def _newer_than(queryset, created_at, message_id):
+    return queryset.filter(created_at__gte=created_at).exclude(created_at=created_at, id__lte=message_id)
+
+
+def _older_page(queryset, created_at, message_id, limit):
+    rows = list(_older_than(queryset, created_at, message_id).order_by('-created_at', '-id')[:limit + 1])
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
+
+
+def _newer_page(queryset, created_at, message_id, limit):
+    rows = list(_newer_than(queryset, created_at, message_id).order_by('created_at', 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    return rows[:limit], has_more
+
+
+def fetch_page(channel, limit=DEFAULT_PAGE_SIZE, before=None, after=None, around=None):
+    """
+    One page of a channel's history, oldest first.
+    before/after are cursors from a previous page; around is a message id to
+    centre the page on (jump to message). Without any of them the latest
+    messages are returned.
+    Returns a dict with 'messages' (ChatMessage objects), 'has_more_before'
+    and 'has_more_after'.
+    Raises ValueError for malformed cursors and ChatMessage.DoesNotExist when
+    the `around` message is not in this channel.
+    """
+    queryset = ChatMessage.objects.filter(channel=channel).select_related('user')
+
+    if before:
+        created_at, message_id = decode_cursor(before)
+        messages, has_more_before = _older_page(queryset, created_at, message_id, limit)
+        return {'messages': messages, 'has_more_before': has_more_before, 'has_more_after': True}
+
+    if after:
+        created_at, message_id = decode_cursor(after)
+        messages, has_more_after = _newer_page(queryset, created_at, message_id, limit)
+        return {'messages': messages, 'has_more_before': True, 'has_more_after': has_more_after}
+
+    if around:
+        anchor = queryset.get(id=int(around))
+        older, has_more_before = _older_page(queryset, anchor.created_at, anchor.id, limit // 2)
+        newer, has_more_after = _newer_page(queryset, anchor.created_at, anchor.id, limit - len(older) - 1)
+        return {
+            'messages': older + [anchor] + newer,
+            'has_more_before': has_more_before,
+            'has_more_after': has_more_after,
+        }
+
+    rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    return {
+        'messages': list(reversed(rows[:limit])),
+        'has_more_before': len(rows) > limit,
+        'has_more_after': False,
+    }
+
+
+def fetch_after_id(channel, message_id, limit=MAX_PAGE_SIZE):
+    """
+    Messages newer than message_id (reconnect catch-up), oldest first, as
+    one statement: the anchor's created_at is a subquery, so no extra round
+    trip. Returns (messages, has_more), or None if message_id is not in
+    this channel.
+    """
+    anchor = ChatMessage.objects.filter(channel=channel, id=message_id).values('created_at')[:1]
+    queryset = ChatMessage.objects.filter(channel=channel).select_related('user')
+    rows = list(
+        _newer_than(queryset, Subquery(anchor), message_id)
+        .order_by('created_at', 'id')[:limit + 1]
+    )
+    if not rows and not ChatMessage.objects.filter(channel=channel, id=message_id).exists():
+        return None
+    return rows[:limit], len(rows) > limit
+
+
+def page_cursors(messages):
+    """before/after cursors for the edges of a page of serialized messages (None when empty)."""
+    if not messages:
+        return None, None
+    first, last = messages[0], messages[-1]
+    return encode_cursor(first['timestamp'], first['id']), encode_cursor(last['timestamp'], last['id'])
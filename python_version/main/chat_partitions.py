@@ -0,0 +1,200 @@
+"""
+Monthly range partitions of the chat message table.
+
+Migration 0020 turns main_chatmessage into a table partitioned by
+created_at. The rows that existed at that point live in
+main_chatmessage_legacy (from MINVALUE up to the first month boundary). Each
+later month gets its own main_chatmessage_pYYYY_MM partition, and
+main_chatmessage_default catches anything outside the prepared range.
+
+Retention drops (or detaches) whole partitions once they are older than the
+longest policy in use. Only servers that keep messages for a shorter time
+need row deletes, and those run in small batches.
+"""
+import logging
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ChatMessage, Server, TextChannel
+
+logger = logging.getLogger('main')
+
+PARENT_TABLE = 'main_chatmessage'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+CHAT_PARTITION_DEFAULTS = {
+    'months_ahead': 2,
+    'retention_days': None,  # Sunucu kendi süresini vermezse; None = sonsuza kadar sakla
+    'delete_batch_size': 5000,
+    'detach': False,  # True: süresi dolan partition silinmez, arşiv için ayrılır
+}
+
+
+def get_chat_partition_config():
+    config = dict(CHAT_PARTITION_DEFAULTS)
+    config.update(getattr(settings, 'CHAT_PARTITIONS', {}))
+    return config
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment, months):
+    month_index = moment.month - 1 + months
+    return moment.replace(year=moment.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_p{month:%Y_%m}"
+
+
+def _parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [PARENT_TABLE])
+    row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(cursor):
+    """
+    [(name, lower, upper)] ordered by lower bound; None stands for
+    MINVALUE/MAXVALUE. The default partition is not included.
+    """
+    cursor.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        [PARENT_TABLE]
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    partitions.sort(key=lambda partition: (partition[1] is not None, partition[1] or 0))
+    return partitions
+
+
+def _overlaps(lower, upper, partitions):
+    for _name, p_lower, p_upper in partitions:
+        if (p_lower is None or p_lower < upper) and (p_upper is None or lower < p_upper):
+            return True
+    return False
+
+
+def ensure_partitions(now=None, months_ahead=None):
+    """Creates the partitions for this month and the next months_ahead months. Returns the new names."""
+    if connection.vendor != 'postgresql':
+        return []
+    config = get_chat_partition_config()
+    months_ahead = config['months_ahead'] if months_ahead is None else months_ahead
+    month = month_start(now or timezone.now())
+
+    created = []
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return created
+        existing = list_partitions(cursor)
+        for _ in range(months_ahead + 1):
+            upper = add_months(month, 1)
+            if not _overlaps(month, upper, existing):
+                name = partition_name(month)
+                try:
+                    with transaction.atomic():
+                        cursor.execute(
+                            f'CREATE TABLE "{name}" PARTITION OF "{PARENT_TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                            [month, upper]
+                        )
+                except Exception as e:
+                    # Örn. default partition'da bu aya ait satırlar var
+                    logger.error(f"Could not create chat partition {name}: {e}")
+                else:
+                    created.append(name)
+                    existing.append((name, month, upper))
+            month = upper
+    return created
+
+
+def retention_policies():
+    """
+    {server_id: days} with the default applied; key None stands for channels
+    without a server. Servers that keep messages forever are left out.
+    Returns (policies, longest), longest being None when anything is kept forever.
+    """
+    default_days = get_chat_partition_config()['retention_days']
+    policies = {}
+    keeps_forever = default_days is None
+    for server_id, days in Server.objects.values_list('id', 'message_retention_days'):
+        days = days if days is not None else default_days
+        if days is None:
+            keeps_forever = True
+        else:
+            policies[server_id] = days
+    if default_days is not None:
+        policies[None] = default_days
+    longest = None if keeps_forever or not policies else max(policies.values())
+    return policies, longest
+
+
+def _delete_older_than(channel_ids, cutoff, batch_size):
+    deleted = 0
+    while True:
+        ids = list(
+            ChatMessage.objects.filter(channel_id__in=channel_ids, created_at__lt=cutoff)
+            .order_by().values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        # created_at koşulu partition budamasını sağlar
+        deleted += ChatMessage.objects.filter(id__in=ids, created_at__lt=cutoff).delete()[0]
+
+
+def apply_retention(now=None, detach=None, batch_size=None):
+    """
+    Drops/detaches partitions past the longest retention, then deletes rows
+    of servers with a shorter one. Returns a stats dict.
+    """
+    config = get_chat_partition_config()
+    now = now or timezone.now()
+    detach = config['detach'] if detach is None else detach
+    batch_size = batch_size or config['delete_batch_size']
+    stats = {'dropped': [], 'detached': [], 'deleted': 0}
+    if connection.vendor != 'postgresql':
+        return stats
+
+    policies, longest = retention_policies()
+    if longest is not None:
+        cutoff = now - timedelta(days=longest)
+        with connection.cursor() as cursor:
+            partitions = list_partitions(cursor) if is_partitioned(cursor) else []
+            for name, _lower, upper in partitions:
+                if upper is None or upper > cutoff:
+                    continue
+                if detach:
+                    cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"')
+                    stats['detached'].append(name)
+                else:
+                    cursor.execute(f'DROP TABLE "{name}"')
+                    stats['dropped'].append(name)
+                logger.info(f"Chat partition {name} {'detached' if detach else 'dropped'} (retention {longest} days)")
+
+    for server_id, days in policies.items():
+        if longest is not None and days >= longest:
+            continue  # Partition düşürme bu sunucuyu zaten kapsıyor
+        channel_ids = list(TextChannel.objects.filter(server_id=server_id).values_list('id', flat=True))
+        if channel_ids:
+            stats['deleted'] += _delete_older_than(channel_ids, now - timedelta(days=days), batch_size)
+    return stats
@@ -0,0 +1,75 @@
+"""
+Chat message rendering: raw content -> safe HTML, mentions and links.
+
+Runs once per message write (ChatWriter.submit, ChatMessage.save); readers
+get the stored result. Everything is escaped first, so the only markup in
+the output is what is produced here:
+    `code`, **bold**, *italic*, ~~strike~~, http(s) links, @mentions,
+    line breaks.
+"""
+import html
+import re
+
+# Render kuralları değişince artırın; eski mesajlar okunurken yeniden render edilir
+RENDER_VERSION = 2
+
+CODE_RE = re.compile(r'`([^`\n]+)`')
+URL_RE = re.compile(r'\bhttps?://[^\s<>"\']+[^\s<>"\'.,;:!?)\]]')
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]{1,150})')
+BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+ITALIC_RE = re.compile(r'(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?![\w*])')
+STRIKE_RE = re.compile(r'~~(?=\S)(.+?)(?<=\S)~~')
+PLACEHOLDER_RE = re.compile('\x00(\\d+)\x00')
+
+
+def _format_text(text, mentions, links, protected):
+    """Formats an already escaped chunk; links and mentions are swapped for placeholders."""
+
+    def protect(fragment):
+        protected.append(fragment)
+        return f'\x00{len(protected) - 1}\x00'
+
+    def link(match):
+        # Kaçışlı metindeki &amp; gibi varlıklar href'te de geçerli HTML
+        url = match.group(0)
+        links.append(html.unescape(url))
+        return protect(f'<a href="{url}" target="_blank" rel="noopener noreferrer nofollow">{url}</a>')
+
+    def mention(match):
+        name = match.group(1)
+        username = name.rstrip('.')
+        if not username:
+            return match.group(0)
+        if username not in mentions:
+            mentions.append(username)
+        # "@bob." -> cümle sonu noktası bağlantıdan sonra kalır
+        return protect(f'<span class="mention" data-username="{username}">@{username}</span>') + name[len(username):]
+
+    text = URL_RE.sub(link, text)
+    text = MENTION_RE.sub(mention, text)
+    text = BOLD_RE.sub(r'<strong>\1</strong>', text)
+    text = ITALIC_RE.sub(r'<em>\1</em>', text)
+    text = STRIKE_RE.sub(r'<del>\1</del>', text)
+    return text
+
+
+def render_message(content):
+    """Returns {'html': str, 'mentions': [username, ...], 'links': [url, ...]}."""
+    mentions, links, protected = [], [], []
+    if not isinstance(content, str):
+        content = '' if content is None else str(content)
+    # \x00 yer tutucular için ayrıldı
+    escaped = html.escape(content.replace('\x00', ''), quote=False)
+
+    parts = []
+    position = 0
+    for match in CODE_RE.finditer(escaped):
+        # Kod içindekiler biçimlendirilmez
+        parts.append(_format_text(escaped[position:match.start()], mentions, links, protected))
+        parts.append(f'<code>{match.group(1)}</code>')
+        position = match.end()
+    parts.append(_format_text(escaped[position:], mentions, links, protected))
+
+    rendered = PLACEHOLDER_RE.sub(lambda match: protected[int(match.group(1))], ''.join(parts))
+    rendered = rendered.replace('\r\n', '\n').replace('\n', '<br>')
+    return {'html': rendered, 'mentions': mentions, 'links': links}
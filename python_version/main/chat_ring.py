@@ -0,0 +1,132 @@
+"""
+Per-process ring buffer of each text channel's latest messages.
+
+Rings are filled from the broadcast path (VoiceChatConsumer.chat_message)
+and, on a miss, from one keyset query. A ring is only trusted while at least
+one consumer in this process is subscribed to the channel's group: such a
+consumer sees every broadcast, so nothing can slip past the buffer. When the
+last local subscriber leaves, the ring is dropped and reads go back to the
+database.
+
+Views run on worker threads and consumers on the event loop, hence the lock.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+from . import chat_history
+
+RING_SIZE = chat_history.DEFAULT_PAGE_SIZE
+
+
+def _sort_key(message):
+    return message['timestamp'], message['id']
+
+
+class _Ring:
+    __slots__ = ('messages', 'loaded', 'has_more_before')
+
+    def __init__(self):
+        self.messages = OrderedDict()  # id -> serialized message, eskiden yeniye
+        self.loaded = False
+        self.has_more_before = False
+
+
+class ChatRing:
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self._rings = {}
+        self._subscribers = Counter()
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel_id):
+        with self._lock:
+            self._subscribers[channel_id] += 1
+            self._rings.setdefault(channel_id, _Ring())
+
+    def unsubscribe(self, channel_id):
+        with self._lock:
+            self._subscribers[channel_id] -= 1
+            if self._subscribers[channel_id] <= 0:
+                del self._subscribers[channel_id]
+                self._rings.pop(channel_id, None)
+
+    def record(self, channel_id, message):
+        """
+        Adds a broadcast message. Every local consumer of the channel calls
+        this for the same message, so duplicates are dropped by id. Group
+        names are per slug, not per server, so a message of another channel
+        can arrive here; it is ignored.
+        """
+        if message.get('id') is None or message.get('channel_id', channel_id) != channel_id:
+            return
+        with self._lock:
+            ring = self._rings.get(channel_id)
+            if ring is None or message['id'] in ring.messages:
+                return
+            last = next(reversed(ring.messages.values()), None)
+            ring.messages[message['id']] = message
+            if last is not None and _sort_key(message) < _sort_key(last):
+                # Farklı süreçlerden gelen yayınlar sırasız gelebilir
+                ring.messages = OrderedDict(
+                    sorted(ring.messages.items(), key=lambda item: _sort_key(item[1]))
+                )
+            self._trim(ring)
+
+    def _trim(self, ring):
+        while len(ring.messages) > self.size:
+            ring.messages.popitem(last=False)
+            ring.has_more_before = True
+
+    def cached(self, channel_id):
+        """(messages, has_more_before) if the ring is warm, else None. Never queries."""
+        with self._lock:
+            ring = self._rings.get(channel_id)
+            if ring is None or not ring.loaded:
+                return None
+            return list(ring.messages.values()), ring.has_more_before
+
+    def messages_after(self, channel_id, message_id):
+        """Messages newer than message_id if the warm ring still holds it, else None."""
+        with self._lock:
+            ring = self._rings.get(channel_id)
+            if ring is None or not ring.loaded or message_id not in ring.messages:
+                return None
+            ids = list(ring.messages)
+            return [ring.messages[i] for i in ids[ids.index(message_id) + 1:]]
+
+    def recent(self, channel_id, loader):
+        """
+        Latest messages, oldest first, and whether older ones exist.
+        On a miss loader() must return the same pair from the database; the
+        result warms the ring if the channel has local subscribers.
+        """
+        hit = self.cached(channel_id)
+        if hit is not None:
+            return hit
+
+        messages, has_more_before = loader()
+        with self._lock:
+            ring = self._rings.get(channel_id)
+            if ring is None:
+                return messages, has_more_before
+            if not ring.loaded:
+                # Sorgu sürerken yayınlanan mesajlar ring'de bekliyor; ikisini birleştir
+                merged = {message['id']: message for message in messages}
+                merged.update(ring.messages)
+                ordered = sorted(merged.values(), key=_sort_key)
+                ring.messages = OrderedDict((message['id'], message) for message in ordered)
+                ring.has_more_before = has_more_before
+                ring.loaded = True
+                self._trim(ring)
+            return list(ring.messages.values()), ring.has_more_before
+
+
+chat_ring = ChatRing()
+
+
+def recent_messages(channel):
+    """Latest RING_SIZE messages of a text channel as serialized dicts, plus has_more_before."""
+    def load():
+        page = chat_history.fetch_page(channel, limit=chat_ring.size)
+        return [chat_history.serialize_message(message) for message in page['messages']], page['has_more_before']
+    return chat_ring.recent(channel.id, load)
@@ -0,0 +1,93 @@
+"""
+Full-text search over chat messages.
+
+ChatMessage.search_vector is maintained by a Postgres trigger (migration
+0019): the content is indexed once with the text search configuration of the
+message's language and once with 'simple', so stemmed words and exact tokens
+(nicknames, links, other languages) both hit the GIN index. Results are
+ranked with ts_rank and paginated with a keyset on (rank, id).
+"""
+import base64
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils.translation import get_supported_language_variant
+
+from .models import ChatMessage
+
+# settings.LANGUAGES -> Postgres text search configuration
+# Migration 0019'daki trigger aynı eşlemeyi kullanır; değişirse yeni migration gerekir
+SEARCH_CONFIGS = {
+    'en': 'english',
+    'tr': 'turkish',
+    'es': 'spanish',
+    'fr': 'french',
+    'de': 'german',
+}
+FALLBACK_CONFIG = 'simple'
+
+DEFAULT_RESULTS = 25
+MAX_RESULTS = 50
+
+
+def message_language(code):
+    """Normalizes a language code ('tr-TR', None, ...) to one of settings.LANGUAGES."""
+    if not code:
+        return settings.LANGUAGE_CODE
+    try:
+        return get_supported_language_variant(code)
+    except LookupError:
+        return settings.LANGUAGE_CODE
+
+
+def build_query(text, language):
+    """Stemmed query in the searcher's language OR'd with an exact 'simple' query."""
+    config = SEARCH_CONFIGS.get(message_language(language), FALLBACK_CONFIG)
+    query = SearchQuery(text, config=config, search_type='websearch')
+    if config != FALLBACK_CONFIG:
+        query |= SearchQuery(text, config=FALLBACK_CONFIG, search_type='websearch')
+    return query
+
+
+def encode_cursor(rank, message_id):
+    raw = f"{rank!r}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (rank, id); raises ValueError for anything malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, message_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        return float(rank), int(message_id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def search_messages(text, language, channels=None, server=None, limit=DEFAULT_RESULTS, cursor=None):
+    """
+    Best matches first. Scope with either `server` or a `channels` queryset/list.
+    Returns (messages annotated with .rank, next_cursor or None).
+    Raises ValueError for malformed cursors.
+    """
+    query = build_query(text, language)
+    queryset = ChatMessage.objects.filter(search_vector=query)
+    if channels is not None:
+        queryset = queryset.filter(channel__in=channels)
+    if server is not None:
+        queryset = queryset.filter(channel__server=server)
+
+    # ts_rank real döner; imleçteki değer birebir eşleşsin diye double'a çeviriyoruz
+    queryset = queryset.annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+    if cursor:
+        rank, message_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id))
+
+    rows = list(queryset.select_related('user', 'channel').order_by('-rank', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,212 @@
+"""
+Write-behind persistence for chat messages.
+
+VoiceChatConsumer hands messages to the per-process ChatWriter, which gives
+them their primary key and timestamp immediately (ids are reserved in blocks
+from the table's Postgres sequence) so the message can be broadcast before it
+is stored. Buffered messages are written with bulk_create every few
+milliseconds or as soon as a batch fills up, and whatever is left is written
+when the process exits. The messages were already broadcast, so a failed
+write (database down, deadlock) puts the batch back at the front of the
+buffer and retries with exponential backoff; only after max_attempts failures
+in a row is it dropped. Rows the database rejects (IntegrityError) are
+dropped one by one right away.
+"""
+import asyncio
+import atexit
+import logging
+import time
+from collections import deque
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import ChatMessage
+from .read_state import record_new_messages
+
+logger = logging.getLogger('main')
+
+CHAT_WRITER_DEFAULTS = {
+    'flush_interval_ms': 5,
+    'batch_size': 100,
+    'max_pending': 5000,  # Bu kadar mesaj birikirse gönderen, yazım bitene kadar bekler
+    'id_block_size': 100,
+    'max_attempts': 6,
+    'retry_base_delay_ms': 200,  # 200, 400, 800 ... ms arayla yeniden denenir
+}
+
+# Process-wide totals since start-up (messages, not batches)
+writer_metrics = {
+    'written': 0,
+    'retried': 0,
+    'dropped': 0,
+}
+
+
+def get_chat_writer_config():
+    config = dict(CHAT_WRITER_DEFAULTS)
+    config.update(getattr(settings, 'CHAT_WRITER', {}))
+    return config
+
+
+def update_unread_counters(messages):
+    """Counter failures must never cost a stored message, so they are only logged."""
+    if not messages:
+        return
+    try:
+        record_new_messages(messages)
+    except Exception as e:
+        logger.error(f"Error updating unread counters for {len(messages)} messages: {e}")
+
+
+class ChatWriter:
+    def __init__(self, flush_interval_ms, batch_size, max_pending, id_block_size, max_attempts, retry_base_delay_ms):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.id_block_size = id_block_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay_ms / 1000
+        self._failures = 0
+        self._pending = []
+        self._ids = deque()
+        self._task = None
+        self._wakeup = None
+        self._write_lock = None
+
+    # --- Async API (consumer tarafı) ---
+
+    async def submit(self, channel, user, content, language=None):
+        """
+        Returns an unsaved ChatMessage that already has its final id and
+        created_at; it is written to the database shortly afterwards.
+        """
+        if self._write_lock is None:
+            self._wakeup = asyncio.Event()
+            self._write_lock = asyncio.Lock()
+
+        if len(self._pending) >= self.max_pending:
+            # Sınırlı kuyruk: DB yetişemiyorsa göndereni yavaşlat
+            await self.flush()
+
+        if not self._ids:
+            self._ids.extend(await self._reserve_ids(self.id_block_size))
+
+        message = ChatMessage(
+            id=self._ids.popleft(),
+            channel=channel,
+            user=user,
+            content=content,
+            language=language or settings.LANGUAGE_CODE,
+            created_at=timezone.now(),
+        )
+        # Render bir kez burada; yayın, ring ve API hazır HTML'i kullanır
+        message.render()
+        self._pending.append(message)
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return message
+
+    async def flush(self):
+        async with self._write_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            if await database_sync_to_async(self._write)(batch):
+                self._failures = 0
+                return
+            delay = self._retry_or_drop(batch)
+            if delay:
+                # Kilit tutulur: bu arada gelen flush'lar da bekler, DB'ye yüklenilmez
+                await asyncio.sleep(delay)
+
+    def _retry_or_drop(self, batch):
+        """After a failed write: requeues batch and returns the backoff delay, or drops it (0)."""
+        self._failures += 1
+        if self._failures >= self.max_attempts:
+            logger.error(f"Dropping {len(batch)} chat messages after {self._failures} failed writes")
+            writer_metrics['dropped'] += len(batch)
+            self._failures = 0
+            return 0
+        # Yayınlanmış mesajlar kaybolmasın; sıra korunarak başa geri konur
+        self._pending[:0] = batch
+        writer_metrics['retried'] += len(batch)
+        return self.retry_base_delay * 2 ** (self._failures - 1)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        finally:
+            self._task = None
+
+    @database_sync_to_async
+    def _reserve_ids(self, count):
+        table = ChatMessage._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [table, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # --- Sync yazım ---
+
+    def _write(self, batch):
+        """Returns False if the batch should be retried."""
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch)
+            stored = batch
+        except IntegrityError:
+            # Örn. kanal bu arada silindi: sağlam mesajları tek tek kurtar
+            logger.warning(f"Chat batch of {len(batch)} failed, retrying row by row")
+            stored = []
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        ChatMessage.objects.bulk_create([message])
+                    stored.append(message)
+                except IntegrityError as e:
+                    logger.error(f"Dropping chat message {message.id}: {e}")
+                    writer_metrics['dropped'] += 1
+        except Exception as e:
+            logger.error(f"Error saving {len(batch)} chat messages: {e}")
+            return False
+        writer_metrics['written'] += len(stored)
+        update_unread_counters(stored)
+        return True
+
+    def flush_sync(self):
+        """Process exit: write whatever is still buffered, with the same retries."""
+        while self._pending:
+            batch, self._pending = self._pending, []
+            if self._write(batch):
+                return
+            delay = self._retry_or_drop(batch)
+            if delay:
+                time.sleep(delay)
+
+
+_writer = None
+
+
+def get_chat_writer():
+    """Per-process ChatWriter, or None when the database cannot reserve ids up front."""
+    global _writer
+    if connection.vendor != 'postgresql':
+        return None
+    if _writer is None:
+        _writer = ChatWriter(**get_chat_writer_config())
+        atexit.register(_writer.flush_sync)
+    return _writer
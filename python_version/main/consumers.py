@@ -4,11 +4,12 @@ import logging
 import random
 
 from asgiref.sync import sync_to_async, async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.utils.translation import gettext as _
 
-from .models import GameSession, ChatMessage
+from .models import GameSession, ChatMessage, StaleGameSession
 from django.utils import timezone
 
 User = get_user_model()
@@ -68,90 +69,50 @@ def update_player_rankings(game, winner):
 from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
 from .models import VoiceChannel, TextChannel
+from . import dice_wars as rules
+from .chat_writer import get_chat_writer, update_unread_counters
+from .chat_ring import chat_ring, recent_messages
+from .chat_search import message_language
+from .chat_render import render_message
+from .voice_roster import make_entry, public_entry, voice_roster
+from .presence import get_presence_service, presence_group
+from .ephemeral import EPHEMERAL_KINDS, get_ephemeral_hub
+from . import sfu
+from channels.layers import InMemoryChannelLayer
+from . import chat_history
+from . import channel_access
+from .maintenance import get_reaper_config
 logger = logging.getLogger('main') # İstediğiniz bir isim verin
 
 
 class DiceWars:
+    # Kurallar main/dice_wars.py içinde saf fonksiyonlar olarak duruyor;
+    # bu sınıf GameSession objeleri üzerinde çalışan ince bir sarmalayıcı.
     def get_valid_neighbors(self,row, col, board_size):
-        """
-        Belirtilen boyuttaki (board_size x board_size) bir tahta için
-        geçerli komşuları döndürür.
-        """
-        potential_moves = [
-            (row - 1, col),  # Yukarı
-            (row + 1, col),  # Aşağı
-            (row, col - 1),  # Sol
-            (row, col + 1)  # Sağ
-        ]
-        valid_neighbors = []
-
-        for r, c in potential_moves:
-            # --- DEĞİŞTİ: 5 yerine board_size ---
-            if 0 <= r < board_size and 0 <= c < board_size:
-                valid_neighbors.append((r, c))
-            # else:
-            # print(f"-> Geçersiz komşu atlandı: ({r}, {c})")
-
-        return valid_neighbors
+        return rules.get_valid_neighbors(row, col, board_size)
+
     def find_critical_cells(self,board_state):
         """
         SÖZLÜK (dict) tabanlı tahtada patlamaya hazır hücreleri bulur.
         YENİ KURAL: Bir hücre 4 veya daha fazla olduğunda patlar.
         """
-        critical_cells = []
-        if not board_state: return critical_cells
-
-        for r_str, row in board_state.items():
-            for c_str, cell in row.items():
-                if not cell:
-                    continue
-
-                # KURAL: Basitçe 4'ü kontrol et
-                if cell.get('count', 0) >= 4:
-                    critical_cells.append((int(r_str), int(c_str)))
-        return critical_cells
+        return rules.find_critical_cells(board_state)
+
     def bum(self,game, row, col, username):
         """
         SÖZLÜK (dict) tabanlı tahtada bir hücreyi patlatır.
         'game' objesinden dinamik 'board_size' alır.
         """
-        r_str, c_str = str(row), str(col)
-        try:
-            current_count = game.board_state[r_str][c_str].get('count', 0)
-        except KeyError:
-            return
+        rules.explode_cell(game.board_state, row, col, username, game.board_size)
 
-        new_count = current_count - 4
-        if new_count <= 0:
-            game.board_state[r_str][c_str] = None
-        else:
-            game.board_state[r_str][c_str]['count'] = new_count
-
-        # --- DEĞİŞTİ: game.board_size parametresi eklendi ---
-        valids = self.get_valid_neighbors(row, col, game.board_size)
-        # ---------------------------------------------------
-
-        for r_int, c_int in valids:
-            r_neighbor_str, c_neighbor_str = str(r_int), str(c_int)
-            if r_neighbor_str not in game.board_state:
-                game.board_state[r_neighbor_str] = {}
-
-            current_cell = game.board_state[r_neighbor_str].get(c_neighbor_str)
-            if current_cell is None:
-                game.board_state[r_neighbor_str][c_neighbor_str] = {
-                    'owner': username, 'count': 1
-                }
-            else:
-                current_cell['count'] += 1
-                current_cell['owner'] = username
     def check_for_winner(self,game, current_player_user):
-        owners_left = set()
+        """
+        Oyun bittiyse game üzerinde status/winner/finished_at alanlarını ayarlar
+        ve kazananı döndürür. Kaydetmez.
+        """
         board_state = game.board_state
         if not board_state: return
-        for r_key, row in board_state.items():
-            for c_key, cell in row.items():
-                if cell and cell.get('owner'):
-                    owners_left.add(cell.get('owner'))
+        owners_left = set(rules.count_pieces(board_state))
 
         # --- DÜZELTME: Oyunun başlamış olması ve 1'den fazla oyuncu olması lazım ---
         # Bu kontrol, tek başına oynayan host'un anında kazanmasını engeller
@@ -169,25 +130,15 @@ class DiceWars:
 
                 game.status = 'finished'
                 game.winner = winner_user
-                # Oyun bittiğinde sıralamayı güncelle
                 game.finished_at = timezone.now()
-                game.save()
-                # Sıralama güncellemesini yap
-                if winner_user:
-                    update_player_rankings(game, winner_user)
-        return
+                # Kaydetme ve sıralama güncellemesi çağıranda (CAS yazımından sonra)
+                return winner_user
+        return None
     def _count_player_pieces(self,board_state, player_username):
         """
         SÖZLÜK (dict) tabanlı tahtada bir oyuncunun kaç taşı olduğunu sayar.
         """
-        count = 0
-        if not board_state: return 0
-        # board_state artık {'0': {'0': ...}, '1': ...}
-        for r_key, row in board_state.items():
-            for c_key, cell in row.items():
-                if cell and cell.get('owner') == player_username:
-                    count += 1
-        return count
+        return rules.count_pieces(board_state).get(player_username, 0)
     
     def check_and_get_eliminated_players(self, game):
         """
@@ -210,85 +161,77 @@ class DiceWars:
         active_players = set(p.username for p in game.players.all())
         
         # Tahtada hala taşı olan oyuncuları bul
-        players_with_pieces = set()
-        for r_key, row in board_state.items():
-            for c_key, cell in row.items():
-                if cell and cell.get('owner'):
-                    players_with_pieces.add(cell.get('owner'))
+        players_with_pieces = set(rules.count_pieces(board_state))
         
         # Tahtada taşı olmayan ama hala oyunda olan oyuncuları bul
         eliminated = list(active_players - players_with_pieces)
         
         return eliminated
 
+# Yeniden bağlanmada en fazla bu kadar kaçırılmış mesaj tek tek gönderilir
+CATCHUP_LIMIT = chat_history.MAX_PAGE_SIZE
+
+SIGNALING_DEFAULTS = {
+    'ice_batch_window_ms': 20,  # Aynı alıcıya giden ICE adayları bu süre içinde tek mesajda toplanır
+    'ice_batch_max': 20,        # Bu kadar aday birikince beklemeden gönderilir
+    'roster_sync_timeout_ms': 150,  # Odada yerel üye yokken diğer süreçlerden kadro bekleme süresi
+}
+
+
+def get_signaling_config():
+    config = dict(SIGNALING_DEFAULTS)
+    config.update(getattr(settings, 'VOICE_SIGNALING', {}))
+    return config
+
+
 class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
 
-    # DB'den TextChannel veya VoiceChannel objesini çeker
+    # TextChannel veya VoiceChannel objesini bulur ve kullanıcının girip giremeyeceğini söyler
     @database_sync_to_async
-    def get_channel_by_slug(self, slug, channel_type=None):
+    def get_channel_by_slug(self, slug, channel_type=None, server_slug=None):
         """
-        Get channel by slug, checking both TextChannel and VoiceChannel.
-        If channel_type is provided ('text' or 'voice'), only check that type to avoid slug collision bugs.
+        Returns (channel, allowed); channel is None if not found (see
+        channel_access.lookup). Without channel_type, TextChannel first, then
+        VoiceChannel.
         """
-        # If channel_type is specified, only check that type
-        if channel_type == 'text':
-            try:
-                channel = TextChannel.objects.get(slug=slug)
-                logger.debug(f"Found TextChannel: {channel.name} with slug: {slug}")
-                return channel
-            except TextChannel.DoesNotExist:
-                logger.warning(f"TextChannel with slug '{slug}' not found")
-                return None
-        
-        elif channel_type == 'voice':
-            try:
-                channel = VoiceChannel.objects.get(slug=slug)
-                logger.debug(f"Found VoiceChannel: {channel.name} with slug: {slug}")
-                return channel
-            except VoiceChannel.DoesNotExist:
-                logger.warning(f"VoiceChannel with slug '{slug}' not found")
-                return None
-        
-        # If channel_type not specified, try TextChannel first, then VoiceChannel (backward compatibility)
-        # WARNING: This can cause bugs if both have the same slug!
-        else:
-            logger.warning(f"No channel_type specified for slug '{slug}'. Auto-detecting (may cause conflicts).")
-            try:
-                # First try TextChannel
-                channel = TextChannel.objects.get(slug=slug)
-                logger.debug(f"Found TextChannel: {channel.name} with slug: {slug}")
-                return channel
-            except TextChannel.DoesNotExist:
-                try:
-                    # Fallback to VoiceChannel
-                    channel = VoiceChannel.objects.get(slug=slug)
-                    logger.debug(f"Found VoiceChannel: {channel.name} with slug: {slug}")
-                    return channel
-                except VoiceChannel.DoesNotExist:
-                    logger.warning(f"No channel found with slug: {slug}")
-                    return None
+        channel, allowed = channel_access.lookup(server_slug, channel_type, slug, self.scope["user"].id)
+        if channel is None:
+            logger.warning(f"No channel found with slug: {slug}")
+        return channel, allowed
 
-    @database_sync_to_async
-    def save_chat_message(self, content):
-        """Save chat message to database (only for TextChannel)"""
+    async def save_chat_message(self, content):
+        """
+        Queue chat message for storage (only for TextChannel).
+        The returned message already has its id and timestamp; the INSERT is
+        batched by the per-process ChatWriter so broadcasting never waits on it.
+        """
         if not hasattr(self, 'channel_object') or not self.channel_object:
             return None
-        
+
         # Only save messages for TextChannel, not VoiceChannel
         if isinstance(self.channel_object, VoiceChannel):
             return None
-            
+
+        writer = get_chat_writer()
         try:
-            message = ChatMessage.objects.create(
-                channel=self.channel_object,
-                user=self.scope["user"],
-                content=content
-            )
-            return message
+            if writer is None:
+                return await self._create_chat_message(content)
+            return await writer.submit(self.channel_object, self.scope["user"], content, self.language)
         except Exception as e:
             logger.error(f"Error saving chat message: {e}")
             return None
 
+    @database_sync_to_async
+    def _create_chat_message(self, content):
+        message = ChatMessage.objects.create(
+            channel=self.channel_object,
+            user=self.scope["user"],
+            content=content,
+            language=self.language,
+        )
+        update_unread_counters([message])
+        return message
+
     async def connect(self):
         username = self.scope["user"].username if not self.scope["user"].is_anonymous else "Anonymous"
         logger.info(f"New connection attempt from user: {username}, Anonymous: {self.scope['user'].is_anonymous}")
@@ -302,8 +245,13 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
         query_params = parse_qs(self.scope['query_string'].decode('utf-8'))
         channel_slug = query_params.get('channel_slug', [None])[0]
         channel_type = query_params.get('channel_type', [''])[0]  # 'text' or 'voice'
+        server_slug = query_params.get('server_slug', [''])[0]
+        # Yeniden bağlanan istemci son gördüğü mesajı bildirir; sadece aradakiler gönderilir
+        last_message_id = query_params.get('last_message_id', [''])[0]
 
         self.channel_slug = channel_slug
+        # Mesajların arama dili: dil seçicinin çerezi (WS isteğinde URL dil öneki yok)
+        self.language = message_language(self.scope.get('cookies', {}).get(settings.LANGUAGE_COOKIE_NAME))
 
         if not self.channel_slug:
             logger.warning(f"No channel_slug provided. Rejecting connection.")
@@ -312,22 +260,67 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
 
         logger.info(f"Looking up channel with slug: {self.channel_slug}, type: {channel_type or 'auto-detect'}")
 
-        # 3. Check if channel exists (use channel_type if provided to avoid slug collision bugs)
-        self.channel_object = await self.get_channel_by_slug(self.channel_slug, channel_type)
+        # 3. Check if channel exists and the user may join it (server_slug disambiguates slugs across servers)
+        self.channel_object, allowed = await self.get_channel_by_slug(self.channel_slug, channel_type, server_slug)
         if not self.channel_object:
             logger.warning(f"Channel with slug '{self.channel_slug}' and type '{channel_type}' not found. Rejecting connection.")
             await self.close()
             return
+        if not allowed:
+            logger.warning(f"{username} may not join channel '{self.channel_slug}'. Rejecting connection.")
+            await self.close()
+            return
 
         # Use different group names for TextChannel vs VoiceChannel
         channel_type = "TextChannel" if isinstance(self.channel_object, TextChannel) else "VoiceChannel"
         logger.info(f"Channel found: {channel_type} - {self.channel_object.name} (slug: {self.channel_slug})")
         
+        # Slug sadece sunucu içinde tekil; grup (ve gösterge odası) kanalın pk'sından
         if isinstance(self.channel_object, TextChannel):
-            self.channel_group_name = f'text_{self.channel_slug}'
+            self.channel_group_name = f'text_{self.channel_object.pk}'
         else:
-            self.channel_group_name = f'voice_{self.channel_slug}'
+            self.channel_group_name = f'voice_{self.channel_object.pk}'
         self.user_id = str(self.scope["user"].id)
+        # Odadaki diğer bağlantılar: channel_name -> user_id (aynı kullanıcının her sekmesi ayrı eş)
+        self.peer_channels = {}
+        # İstemci 'ice_candidates' toplu çerçevelerini anlıyorsa (?signal_batching=1)
+        self.batch_signals = query_params.get('signal_batching', [''])[0] == '1'
+        # Alıcıya göre bekleyen ICE adayları ve onları gönderecek zamanlayıcılar
+        self.ice_buffers = {}
+        self.ice_flush_tasks = {}
+        self.in_roster = False
+
+        if isinstance(self.channel_object, VoiceChannel):
+            # Kadroya gir ya da user_limit dolu ise reddedil (gruba katılmadan önce)
+            remote_mode = None
+            if not voice_roster.has_local(self.channel_group_name) and not isinstance(self.channel_layer, InMemoryChannelLayer):
+                entries, remote_mode = await self.sync_roster()
+                voice_roster.seed(self.channel_group_name, entries)
+            self.roster_entry = make_entry(self.user_id, self.scope["user"].username, self.channel_name, local=True)
+            admitted, members = voice_roster.admit(
+                self.channel_group_name, self.roster_entry, self.channel_object.user_limit
+            )
+            if not admitted:
+                logger.info(f"Voice room {self.channel_group_name} is full ({self.channel_object.user_limit}); rejecting {username}")
+                await self.accept()
+                await self.send_json({
+                    "type": "voice_room_full",
+                    "user_limit": self.channel_object.user_limit,
+                    "message": _("This voice channel is full."),
+                })
+                await self.close(code=4003)
+                return
+            self.in_roster = True
+            if remote_mode:
+                voice_roster.set_mode(self.channel_group_name, remote_mode)
+            # Oda eşiği geçtiyse mesh'ten SFU'ya geçilir; herkes tek bağlantıya döner
+            user_count = len({member['user_id'] for member in members} | {self.user_id})
+            self.switch_to_sfu = (
+                voice_roster.mode(self.channel_group_name) != 'sfu' and sfu.use_sfu(self.channel_object, user_count)
+            )
+            if self.switch_to_sfu:
+                voice_roster.set_mode(self.channel_group_name, 'sfu')
+            self.sfu_joined = False
 
         # 4. Join the group (channel)
         await self.channel_layer.group_add(
@@ -338,9 +331,38 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
         logger.info(f"User {username} joined {channel_type} group: {self.channel_group_name}")
         await self.accept()
 
+        # Sunucu üyelerinin çevrimiçi durumu: bağlantı + heartbeat
+        self.presence_group_name = presence_group(self.channel_object.server_id) if self.channel_object.server_id else None
+        if self.presence_group_name:
+            await self.channel_layer.group_add(self.presence_group_name, self.channel_name)
+        get_presence_service().connected(self.scope["user"].id, self.channel_name)
+        self.presence_tracked = True
+
+        # Yazıyor/konuşuyor göstergeleri kanal katmanının sohbet yolunu kullanmaz
+        ephemeral_queue = await get_ephemeral_hub().subscribe(self.channel_group_name, self.user_id, self.channel_name)
+        self.ephemeral_task = asyncio.create_task(self._pump_ephemeral(ephemeral_queue))
+
+        if isinstance(self.channel_object, TextChannel):
+            # Bu süreçte abone varken ring buffer tüm yayınları görür
+            chat_ring.subscribe(self.channel_object.id)
+            self.ring_channel_id = self.channel_object.id
+            if last_message_id.isdigit():
+                await self.send_chat_catchup(int(last_message_id))
+            else:
+                await self.send_chat_history()
+
         # 5. Notify group that user joined (only for voice channels)
         # Don't send "joined room" message for text channels
         if isinstance(self.channel_object, VoiceChannel):
+            # Geç katılan herkesi tek tek yoklamak yerine tam kadroyu alır
+            await self.send_json({
+                "type": "voice_roster",
+                "user_limit": self.channel_object.user_limit,
+                "mode": voice_roster.mode(self.channel_group_name),
+                "members": [public_entry(member) for member in members],
+            })
+            if self.switch_to_sfu:
+                await self.channel_layer.group_send(self.channel_group_name, {"type": "voice.mode", "mode": "sfu"})
             logger.info(f"Notifying voice channel group that {username} joined")
             await self.channel_layer.group_send(
                 self.channel_group_name,
@@ -348,10 +370,44 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
                     "type": "member.joined",
                     "sender_id": self.user_id,
                     "username": self.scope["user"].username,
+                    "channel_name": self.channel_name,
+                    "member": self.roster_entry,
                 }
             )
 
     async def disconnect(self, close_code):
+        for task in getattr(self, 'ice_flush_tasks', {}).values():
+            task.cancel()
+
+        if getattr(self, 'ephemeral_task', None) is not None:
+            self.ephemeral_task.cancel()
+            self.ephemeral_task = None
+            await get_ephemeral_hub().unsubscribe(self.channel_group_name, self.channel_name)
+
+        if getattr(self, 'ring_channel_id', None) is not None:
+            chat_ring.unsubscribe(self.ring_channel_id)
+            self.ring_channel_id = None
+
+        if getattr(self, 'presence_tracked', False):
+            get_presence_service().disconnected(self.scope["user"].id, self.channel_name)
+            self.presence_tracked = False
+            if self.presence_group_name:
+                await self.channel_layer.group_discard(self.presence_group_name, self.channel_name)
+
+        if getattr(self, 'sfu_joined', False):
+            self.sfu_joined = False
+            try:
+                await sfu.get_sfu_client().leave(self.channel_group_name, self.channel_name)
+            except Exception as e:
+                logger.error(f"SFU leave failed for {self.channel_name}: {e}")
+
+        if getattr(self, 'in_roster', False):
+            voice_roster.discard(self.channel_group_name, self.channel_name)
+            self.in_roster = False
+        elif isinstance(getattr(self, 'channel_object', None), VoiceChannel):
+            # Oda doluydu; hiç katılmadı
+            return await super().disconnect(close_code)
+
         if hasattr(self, 'channel_group_name') and self.channel_group_name and not self.scope["user"].is_anonymous:
             # 1. Gruptan (Oda) ayrıl
             await self.channel_layer.group_discard(
@@ -367,38 +423,99 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
                         "type": "member.left",
                         "sender_id": self.user_id,
                         "username": self.scope["user"].username,
+                        "channel_name": self.channel_name,
                     }
                 )
 
         await super().disconnect(close_code)
 
+    async def send_chat_history(self):
+        """Initial 'chat_history' frame: the channel's latest messages, from the ring when warm."""
+        page = chat_ring.cached(self.channel_object.id)
+        if page is None:
+            page = await database_sync_to_async(recent_messages)(self.channel_object)
+        messages, has_more_before = page
+        before_cursor, _after_cursor = chat_history.page_cursors(messages)
+        await self.send_json({
+            "type": "chat_history",
+            "messages": messages,
+            "has_more_before": has_more_before,
+            "before_cursor": before_cursor,
+        })
+
+    async def send_chat_catchup(self, last_message_id):
+        """
+        Reconnect: a 'chat_catchup' frame with only the messages after
+        last_message_id, from the ring when it still holds that id, else from
+        one range query. Clients more than CATCHUP_LIMIT messages behind get
+        too_far_behind followed by a fresh 'chat_history' frame.
+        """
+        missed = chat_ring.messages_after(self.channel_object.id, last_message_id)
+        if missed is None:
+            missed = await self._missed_messages(last_message_id)
+        if missed is None:
+            await self.send_json({"type": "chat_catchup", "messages": [], "too_far_behind": True})
+            await self.send_chat_history()
+            return
+        await self.send_json({"type": "chat_catchup", "messages": missed, "too_far_behind": False})
+
+    @database_sync_to_async
+    def _missed_messages(self, last_message_id):
+        result = chat_history.fetch_after_id(self.channel_object, last_message_id, CATCHUP_LIMIT)
+        if result is None or result[1]:
+            return None
+        return [chat_history.serialize_message(message) for message in result[0]]
+
     # --- Sinyalleşme ve Sohbet Mesajlarını İşleme ---
 
     async def receive_json(self, content, **kwargs):
         signal_type = content.get("signal_type")
-        recipient_id = content.get("recipient_id")
+        recipient = (content.get("recipient_channel"), content.get("recipient_id"))
         data = content.get("data")
 
-        # 1. WebRTC Sinyalleşmesi (Offer/Answer/ICE)
-        if signal_type in ['offer', 'answer', 'ice_candidate']:
-            # Sinyali sadece ilgili alıcıya değil, gruba gönderiyoruz.
-            # İstemci (JS) bu sinyalin kendisi için olup olmadığını kontrol edecek.
-            await self.channel_layer.group_send(
-                self.channel_group_name,
-                {
-                    "type": "webrtc.signal",
-                    "sender_id": self.user_id,
-                    "username": self.scope["user"].username,  # Add username
-                    "recipient_id": recipient_id,  # Kimin alması gerektiğini belirt
-                    "signal_type": signal_type,
-                    "data": data,
-                }
+        # Her mesaj bağlantının canlı olduğunu gösterir
+        get_presence_service().heartbeat(self.scope["user"].id, self.channel_name)
+        if signal_type == 'heartbeat':
+            return
+
+        # Yazıyor/konuşuyor: sadece son durum önemli, toplanıp kısılarak yayılır
+        if signal_type in EPHEMERAL_KINDS:
+            get_ephemeral_hub().publish(
+                self.channel_group_name, self.user_id, self.scope["user"].username, self.channel_name,
+                signal_type, bool(isinstance(data, dict) and data.get('active')),
             )
+            return
+
+        # 1. WebRTC Sinyalleşmesi (Offer/Answer/ICE)
+        if signal_type == 'ice_candidate':
+            await self.queue_ice_candidates(recipient, [data])
+
+        elif signal_type == 'ice_candidates':
+            # İstemcinin kendi topladığı adaylar
+            if isinstance(data, list):
+                await self.queue_ice_candidates(recipient, data)
+
+        elif signal_type in ['offer', 'answer']:
+            # Sıra korunmalı: bekleyen adaylar SDP'den önce gitsin
+            await self.flush_ice_candidates(recipient)
+            await self.send_signal(recipient, {
+                "type": "webrtc.signal",
+                "sender_id": self.user_id,
+                "username": self.scope["user"].username,  # Add username
+                "signal_type": signal_type,
+                "data": data,
+            })
+
+        # SFU modu: istemcinin tek bağlantısı sunucuyla
+        elif signal_type in ['sfu_offer', 'sfu_answer', 'sfu_candidate']:
+            await self.handle_sfu_signal(signal_type, data)
 
         # 2. Normal Sohbet Mesajı
         elif signal_type == 'chat_message':
             # Save message to database
             message_obj = await self.save_chat_message(data)
+            # Kaydedilen mesaj yazılırken render edildi; sesli kanal sohbeti burada render edilir
+            html = message_obj.rendered_content if message_obj else render_message(data)['html']
             await self.channel_layer.group_send(
                 self.channel_group_name,
                 {
@@ -406,8 +523,10 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
                     "sender_id": self.user_id,
                     "username": self.scope["user"].username,
                     "message": data,
+                    "html": html,
                     "message_id": message_obj.id if message_obj else None,
                     "timestamp": message_obj.created_at.isoformat() if message_obj else None,
+                    "record": chat_history.serialize_message(message_obj) if message_obj else None,
                 }
             )
 
@@ -425,67 +544,244 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
         
         # 4. Microphone state change
         elif signal_type == 'mic_state_change':
+            voice_roster.update(self.channel_group_name, self.channel_name, muted=data.get('muted', False))
             await self.channel_layer.group_send(
                 self.channel_group_name,
                 {
                     "type": "mic.state.change",
                     "sender_id": self.user_id,
                     "username": self.scope["user"].username,
+                    "channel_name": self.channel_name,
                     "muted": data.get('muted', False)
                 }
             )
         
         # 5. Camera state change
         elif signal_type == 'camera_state_change':
+            voice_roster.update(self.channel_group_name, self.channel_name, camera_enabled=data.get('enabled', True))
             await self.channel_layer.group_send(
                 self.channel_group_name,
                 {
                     "type": "camera.state.change",
                     "sender_id": self.user_id,
                     "username": self.scope["user"].username,
+                    "channel_name": self.channel_name,
                     "enabled": data.get('enabled', True)
                 }
             )
 
+    async def sync_roster(self):
+        """
+        Asks the room's consumers (on any worker) for their roster entries via
+        a temporary reply channel; used when this process has no member in
+        the room yet. Returns whatever arrived within roster_sync_timeout_ms.
+        """
+        reply_channel = await self.channel_layer.new_channel()
+        await self.channel_layer.group_send(self.channel_group_name, {
+            "type": "voice.roster.request",
+            "reply_channel": reply_channel,
+        })
+        entries = []
+        mode = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + get_signaling_config()['roster_sync_timeout_ms'] / 1000
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                reply = await asyncio.wait_for(self.channel_layer.receive(reply_channel), remaining)
+            except asyncio.TimeoutError:
+                break
+            if reply.get("member"):
+                entries.append(reply["member"])
+            mode = reply.get("mode") or mode
+        return entries, mode
+
+    async def handle_sfu_signal(self, signal_type, data):
+        if not isinstance(self.channel_object, VoiceChannel) or voice_roster.mode(self.channel_group_name) != 'sfu':
+            return
+        client = sfu.get_sfu_client()
+        try:
+            if signal_type == 'sfu_offer':
+                answer = await client.join(
+                    self.channel_group_name, self.channel_name, self.user_id, self.scope["user"].username,
+                    data, notify=self.sfu_offer
+                )
+                self.sfu_joined = True
+                await self.send_json({"type": "sfu_answer", "data": answer})
+            elif signal_type == 'sfu_answer':
+                await client.answer(self.channel_group_name, self.channel_name, data)
+            elif signal_type == 'sfu_candidate':
+                await client.candidate(self.channel_group_name, self.channel_name, data)
+        except Exception as e:
+            logger.error(f"SFU {signal_type} failed for {self.channel_name}: {e}")
+            await self.send_json({"type": "sfu_error", "message": _("Could not connect to the voice server.")})
+
+    async def _pump_ephemeral(self, queue):
+        while True:
+            await self.send_json(await queue.get())
+
+    async def sfu_offer(self, event):
+        """SFU yeni track'leri iletmek için yeniden teklif gönderiyor (SFUClient notify)."""
+        await self.send_json({"type": "sfu_offer", "data": event["offer"], "mids": event["mids"]})
+
+    async def send_signal(self, recipient, event):
+        """
+        Sends a WebRTC signal to one connection. ``recipient`` is the
+        (channel_name, user_id) pair from the client frame; a channel_name
+        known to the room registry gets the signal directly. Anything else
+        falls back to the group, where consumers and clients drop signals
+        that are not addressed to them.
+        """
+        recipient_channel, recipient_id = recipient
+        event = dict(
+            event,
+            sender_channel=self.channel_name,
+            recipient_channel=recipient_channel,
+            recipient_id=recipient_id,  # Kimin alması gerektiğini belirt
+        )
+        if recipient_channel in self.peer_channels:
+            await self.channel_layer.send(recipient_channel, event)
+        else:
+            await self.channel_layer.group_send(self.channel_group_name, event)
+
+    async def queue_ice_candidates(self, recipient, candidates):
+        """
+        Coalesces trickle ICE candidates per recipient connection: everything
+        arriving within ice_batch_window_ms goes out as one 'ice_candidates'
+        signal.
+        """
+        key = tuple(str(part) if part is not None else None for part in recipient)
+        config = get_signaling_config()
+        buffer = self.ice_buffers.setdefault(key, [])
+        buffer.extend(candidates)
+        if len(buffer) >= config['ice_batch_max']:
+            await self.flush_ice_candidates(key)
+        elif key not in self.ice_flush_tasks:
+            self.ice_flush_tasks[key] = asyncio.create_task(
+                self._flush_ice_later(key, config['ice_batch_window_ms'] / 1000)
+            )
+
+    async def _flush_ice_later(self, key, delay):
+        await asyncio.sleep(delay)
+        self.ice_flush_tasks.pop(key, None)
+        await self.flush_ice_candidates(key)
+
+    async def flush_ice_candidates(self, recipient):
+        key = tuple(str(part) if part is not None else None for part in recipient)
+        task = self.ice_flush_tasks.pop(key, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        candidates = self.ice_buffers.pop(key, None)
+        if not candidates:
+            return
+        await self.send_signal(key, {
+            "type": "webrtc.signal",
+            "sender_id": self.user_id,
+            "username": self.scope["user"].username,
+            "signal_type": "ice_candidates",
+            "data": candidates,
+        })
+
+    def _remember_peer(self, event):
+        channel_name = event.get("channel_name")
+        if channel_name and channel_name != self.channel_name:
+            self.peer_channels[channel_name] = event.get("sender_id")
+
     # --- Channel Layer'dan Gelen Olay İşleyicileri ---
 
     # Normal sohbet mesajlarını istemciye ilet
     async def chat_message(self, event):
+        if event.get("record") and getattr(self, 'ring_channel_id', None) is not None:
+            chat_ring.record(self.ring_channel_id, event["record"])
         await self.send_json({
             "type": "chat_message",
             "sender_id": event["sender_id"],
             "username": event["username"],
             "message": event["message"],
+            "html": event.get("html"),
             "message_id": event.get("message_id"),
             "timestamp": event.get("timestamp"),
         })
 
     # Yeni üye katılımını bildir
     async def member_joined(self, event):
+        if event.get("member"):
+            voice_roster.mirror(self.channel_group_name, event["member"])
+        if event.get("channel_name") and event["channel_name"] != self.channel_name:
+            self._remember_peer(event)
+            # Yeni gelen de bizi tanısın; tek bir doğrudan mesaj
+            await self.channel_layer.send(event["channel_name"], {
+                "type": "voice.peer.hello",
+                "sender_id": self.user_id,
+                "channel_name": self.channel_name,
+            })
         await self.send_json({
             "type": "system_notification",
             "event": "member_joined",
             "sender_id": event["sender_id"],
             "username": event["username"],
+            "channel_name": event.get("channel_name"),
             "message": _("{username} joined the room.").format(username=event['username'])
         })
 
+    # Başka süreçteki yeni üye kadroyu soruyor; kendi kaydımızla cevap ver
+    async def voice_roster_request(self, event):
+        if self.in_roster:
+            entry = next(
+                (member for member in voice_roster.snapshot(self.channel_group_name)
+                 if member['channel_name'] == self.channel_name),
+                self.roster_entry
+            )
+            await self.channel_layer.send(event["reply_channel"], {
+                "type": "voice.roster.reply",
+                "member": dict(entry, local=False),
+                "mode": voice_roster.mode(self.channel_group_name),
+            })
+
+    # Oda SFU moduna geçti; istemci mesh bağlantılarını kapatıp sunucuya bağlanır
+    async def voice_mode(self, event):
+        voice_roster.set_mode(self.channel_group_name, event["mode"])
+        await self.send_json({"type": "voice_mode", "mode": event["mode"]})
+
+    # Odadaki mevcut üyeden gelen tanışma; istemciye iletilmez
+    async def voice_peer_hello(self, event):
+        self._remember_peer(event)
+
     # Üye ayrılışını bildir
     async def member_left(self, event):
+        if event.get("channel_name") and event["channel_name"] != self.channel_name:
+            voice_roster.discard(self.channel_group_name, event["channel_name"])
+        # Sadece ayrılan bağlantı; aynı kullanıcının diğer sekmeleri odada kalır
+        self.peer_channels.pop(event.get("channel_name"), None)
         await self.send_json({
             "type": "system_notification",
             "event": "member_left",
             "sender_id": event["sender_id"],
             "username": event["username"],
+            "channel_name": event.get("channel_name"),
             "message": _("{username} left the room.").format(username=event['username'])
         })
 
     # WebRTC sinyallerini istemciye ilet
     async def webrtc_signal(self, event):
+        # Grup üzerinden gelen başka bir bağlantıya ait (ya da kendi) sinyal
+        if event.get("sender_channel") == self.channel_name:
+            return
+        if event.get("recipient_channel") and event["recipient_channel"] != self.channel_name:
+            return
+        if event["signal_type"] == "ice_candidates" and not self.batch_signals:
+            # Eski istemci: her aday ayrı çerçeve
+            for candidate in event["data"]:
+                await self.webrtc_signal({**event, "signal_type": "ice_candidate", "data": candidate})
+            return
         await self.send_json({
             "type": "webrtc_signal",
             "sender_id": event["sender_id"],
+            "sender_channel": event.get("sender_channel"),
             "recipient_id": event.get("recipient_id"),
+            "recipient_channel": event.get("recipient_channel"),
             "signal_type": event["signal_type"],
             "username": event.get("username", ""),  # Add username for easier identification
             "data": event["data"],
@@ -493,6 +789,8 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
 
     # Microphone state change - broadcast to all users
     async def mic_state_change(self, event):
+        if event.get("channel_name"):
+            voice_roster.update(self.channel_group_name, event["channel_name"], muted=event.get("muted", False))
         await self.send_json({
             "type": "mic_state_change",
             "sender_id": event["sender_id"],
@@ -506,6 +804,8 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
     
     # Camera state change - broadcast to all users
     async def camera_state_change(self, event):
+        if event.get("channel_name"):
+            voice_roster.update(self.channel_group_name, event["channel_name"], camera_enabled=event.get("enabled", True))
         await self.send_json({
             "type": "camera_state_change",
             "sender_id": event["sender_id"],
@@ -517,6 +817,14 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
             }
         })
     
+    # Sunucudaki çevrimiçi/çevrimdışı değişiklikleri
+    async def presence_diff(self, event):
+        await self.send_json({
+            "type": "presence",
+            "online": event["online"],
+            "offline": event["offline"],
+        })
+
     # Durum güncellemesini gruba yayınla
     async def member_status_update(self, event):
         await self.send_json({
@@ -531,6 +839,12 @@ class VoiceChatConsumer(AsyncJsonWebsocketConsumer):
 
 
 dw = DiceWars()
+
+# İyimser eşzamanlılık: çakışmada kaç kez ve ne kadar bekleyerek tekrar denenir
+CAS_RETRY_ATTEMPTS = 5
+CAS_RETRY_BASE_DELAY = 0.01  # saniye; her denemede iki katına çıkar (jitter'lı)
+
+
 class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
 
     async def connect(self):
@@ -552,13 +866,16 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
+            # Masada bekleyen varken reaper masayı terk edilmiş saymasın
+            await self.touch_game()
+            self.keepalive_task = asyncio.create_task(self._keep_alive())
 
-            is_player = await self.is_user_in_game(self.game)
+            is_player = self.is_user_in_game(self.game)
 
             # --- OTOMATİK KATILMA (DEĞİŞTİ) ---
             # 'add_player_and_start_game' artık oyunu BAŞLATMAYACAK, sadece ekleyecek.
             if self.game.status == 'waiting' and not self.game.is_full and not is_player:
-                self.game = await self.add_player_to_game(self.game, self.user)
+                self.game = await self._cas_retry(self.add_player_to_game, self.game, self.user)
                 # Odaya yeni katılanı duyur
                 await self.broadcast_game_state(
                     self.game,
@@ -572,11 +889,30 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             await self.close()
 
     async def disconnect(self, close_code):
+        if getattr(self, 'keepalive_task', None) is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
         await self.channel_layer.group_discard(
             self.game_group_name,
             self.channel_name
         )
 
+    async def _keep_alive(self):
+        # Hamle gelmese de bağlı oyuncu last_activity_at'i TTL dolmadan tazeler
+        config = get_reaper_config()
+        interval = min(config['waiting_ttl_minutes'], config['in_progress_ttl_minutes']) * 60 / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.touch_game()
+            except Exception as e:
+                logger.error(f"Could not refresh game {self.game_id} activity: {e}")
+
+    @database_sync_to_async
+    def touch_game(self):
+        # Sadece zaman damgası; sürüm artmaz, eşzamanlı CAS yazımlarıyla çakışmaz
+        GameSession.objects.filter(game_id=self.game_id).exclude(status='finished').update(last_activity_at=timezone.now())
+
     async def receive_json(self, content, **kwargs):
         if not self.user.is_authenticated:
             await self.send_error(_("You must be logged in."))
@@ -593,10 +929,13 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         elif command_type == 'kick_player':
             await self.handle_kick_player(content)
 
+        elif command_type == 'preview_move':
+            await self.handle_preview_move(content)
+
     # --- DEĞİŞEN FONKSİYON ---
     async def handle_make_move(self, content):
         try:
-            game, is_valid_move, error_msg = await self.perform_initial_click(content)
+            game, is_valid_move, error_msg = await self._cas_retry(self.perform_initial_click, content)
             if not is_valid_move:
                 await self.send_error(error_msg)
                 return
@@ -628,8 +967,8 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
                 await asyncio.sleep(0.25)  # Delay for explosion animation to show
                 
                 # Then apply the explosions and broadcast updated state
-                game, exploded_cells_list = await self.apply_explosions(
-                    game.game_id, cells_to_explode, player_username
+                game, exploded_cells_list = await self._cas_retry(
+                    self.apply_explosions, game.game_id, player_username
                 )
                 # Broadcast updated board state (cells are now cleared)
                 # Include current eliminated players in case eliminations happened
@@ -644,10 +983,14 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             final_game = None
             eliminated_players = []
             if reaction_happened:
-                final_game, eliminated_players = await self.check_winner_and_change_turn(game.game_id, self.user)
+                final_game, eliminated_players = await self._cas_retry(
+                    self.check_winner_and_change_turn, game.game_id, self.user
+                )
             else:
                 # Patlama olmadıysa, kazananı kontrol etme (Oyun bitmez)
-                final_game, eliminated_players = await self.just_change_turn(game.game_id, self.user)
+                final_game, eliminated_players = await self._cas_retry(
+                    self.just_change_turn, game.game_id, self.user
+                )
 
             await asyncio.sleep(0.3)  # Faster turn change delay
             
@@ -684,8 +1027,41 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             print(f"HATA (handle_make_move ASYNC): {e}")
             await self.send_error(_("Move could not be made: {error}").format(error=str(e)))
 
+    async def handle_preview_move(self, content):
+        """
+        Hover önizlemesi: tıklamanın neyi patlatacağını hesaplar.
+        Son yayınlanan durum üzerinde çalışır; DB'ye ve canlı oyuna dokunmaz.
+        """
+        state = getattr(self, 'latest_state', None)
+        try:
+            row, col = int(content.get('row')), int(content.get('col'))
+        except (TypeError, ValueError):
+            return
+        if not state or state.get('status') != 'in_progress':
+            return
+        board_size = state.get('board_size') or 5
+        if not (0 <= row < board_size and 0 <= col < board_size):
+            return
+
+        players = state.get('players') or []
+        is_first_round = state.get('move_count', 0) < len(players)
+        preview = rules.preview_move(
+            state.get('state') or {}, board_size, row, col,
+            self.user.username, is_first_round,
+            version=state.get('board_version'),
+        )
+        await self.send_json({
+            'type': 'move_preview',
+            'row': row,
+            'col': col,
+            'board_version': state.get('board_version'),
+            'valid': preview['valid'],
+            'exploded_frames': preview.get('frames', []),
+            'board': preview.get('board'),
+        })
+
     async def handle_start_game(self):
-        game, message = await self._start_game_db()
+        game, message = await self._cas_retry(self._start_game_db)
         if not game:
             await self.send_error(message)
             return
@@ -701,7 +1077,7 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             await self.send_error("Kullanıcı adı belirtilmedi.")
             return
 
-        game, message = await self._kick_player_db(username_to_kick)
+        game, message = await self._cas_retry(self._kick_player_db, username_to_kick)
 
         if not game:
             await self.send_error(message)
@@ -709,7 +1085,20 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
 
         # Herkese güncel oyuncu listesini gönder
         await self.broadcast_game_state(game, message=message)
-    # --- Grup Yayını Metodları ---
+    # --- Veritabanı yazımları (compare-and-swap) ---
+    # Yazım yolları satır kilidi tutmaz: oyunu okur, yeni durumu hesaplar ve
+    # GameSession.save_if_unchanged ile sürüm değişmediyse yazar. Çakışmada
+    # StaleGameSession fırlar ve _cas_retry işlemi baştan (taze veriyle) dener.
+
+    async def _cas_retry(self, operation, *args):
+        for attempt in range(CAS_RETRY_ATTEMPTS):
+            try:
+                return await operation(*args)
+            except StaleGameSession:
+                logger.info(f"CAS conflict on game {self.game_id} in {operation.__name__} (attempt {attempt + 1})")
+                await asyncio.sleep(random.uniform(0, CAS_RETRY_BASE_DELAY * (2 ** attempt)))
+        raise StaleGameSession(f"Gave up on game {self.game_id} after {CAS_RETRY_ATTEMPTS} attempts")
+
     @database_sync_to_async
     def perform_initial_click(self, content):
         """
@@ -717,57 +1106,35 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         İlk turda: Boş hücrelere yerleştirme yapılabilir
         Sonraki turlarda: Sadece kendi hücrelerini yükseltme yapılabilir
         """
-        with transaction.atomic():
-            game = GameSession.objects.select_for_update().get(game_id=self.game_id)
-            if game.status != 'in_progress':
-                return game, False, _("Game has not started or has ended.")
-            if game.current_turn != self.user:
-                return game, False, _("It is not your turn.")
-
-            row, col = content.get('row'), content.get('col')
-            r_str, c_str = str(row), str(col)
-            if r_str not in game.board_state:
-                game.board_state[r_str] = {}
-            cell = game.board_state[r_str].get(c_str)
-            
-            player_count = game.players.count()
-            is_first_round = game.move_count < player_count
-            
-            if cell is None:
-                # Boş hücreye tıklama
-                if is_first_round:
-                    # İlk turda: Boş hücrelere yerleştirme yapılabilir
-                    game.board_state[r_str][c_str] = {
-                        'owner': self.user.username,
-                        'count': 3
-                    }
-                else:
-                    # Sonraki turlarda: Boş hücrelere yerleştirme yapılamaz
-                    return game, False, _("After the first round, you can only upgrade your own cells.")
-            else:
-                # Dolu hücreye tıklama
-                if cell.get('owner') != self.user.username:
-                    return game, False, _("This cell belongs to your opponent.")
-                # Kendi hücresini yükselt
-                cell['count'] += 1
-            
-            # Hamle sayısını artır
-            game.move_count += 1
-            game.save()
-            return game, True, ""
+        game = GameSession.objects.get(game_id=self.game_id)
+        if game.status != 'in_progress':
+            return game, False, _("Game has not started or has ended.")
+        if game.current_turn_id != self.user.id:
+            return game, False, _("It is not your turn.")
 
-    @database_sync_to_async
-    def just_change_turn(self, game_id, user):
-        with transaction.atomic():
-            game = GameSession.objects.get(game_id=game_id)
-            if game.status == 'in_progress':
-                players_list = list(game.players.all())
-                if user in players_list:
-                    current_turn_index = players_list.index(user)
-                    next_turn_index = (current_turn_index + 1) % len(players_list)
-                    game.current_turn = players_list[next_turn_index]
-            game.save()
-            return game
+        row, col = content.get('row'), content.get('col')
+        try:
+            row, col = int(row), int(col)
+        except (TypeError, ValueError):
+            return game, False, _("Invalid cell.")
+        if not (0 <= row < game.board_size and 0 <= col < game.board_size):
+            return game, False, _("Invalid cell.")
+
+        player_count = game.players.count()
+        is_first_round = game.move_count < player_count
+
+        error = rules.place_piece(game.board_state, row, col, self.user.username, is_first_round)
+        if error == 'not_first_round':
+            # Sonraki turlarda: Boş hücrelere yerleştirme yapılamaz
+            return game, False, _("After the first round, you can only upgrade your own cells.")
+        if error == 'opponent_cell':
+            return game, False, _("This cell belongs to your opponent.")
+
+        # Hamle sayısını artır ve tekrar oynatma (replay) için kaydet
+        game.move_count += 1
+        game.move_log = (game.move_log or []) + [[self.user.username, row, col]]
+        game.save_if_unchanged(['board_state', 'move_count', 'move_log'])
+        return game, True, ""
 
     @database_sync_to_async
     def find_critical_cells_async(self, board_state):
@@ -781,17 +1148,17 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             return None, _("Only the host can start the game.")
         if game.status != 'waiting':
             return None, _("Game has already started.")
-        if game.players.count() < game.game_type.min_players:
+        players_list = list(game.players.all())
+        if len(players_list) < game.game_type.min_players:
             return None, _("At least {min_players} players are required to start the game.").format(min_players=game.game_type.min_players)
 
         # --- Başlatma Mantığı ---
         game.status = 'in_progress'
-        players_list = list(game.players.all())
         starter = random.choice(players_list)
         game.current_turn = starter
 
         # Tahta boyutunu gerçek oyuncu sayısına göre ayarla
-        player_count = game.players.count()
+        player_count = len(players_list)
         if player_count <= 2:
             game.board_size = 5
         elif player_count == 3:
@@ -801,18 +1168,20 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
 
         # Hamle sayacını sıfırla (ilk tur için)
         game.move_count = 0
-        game.save()
+        game.save_if_unchanged(['status', 'current_turn', 'board_size', 'move_count'])
         return game, _("Game started! {username} begins.").format(username=starter.username)
 
     @database_sync_to_async
-    def apply_explosions(self, game_id, cells_to_explode, player_username):
-        # ... (Değişiklik yok) ...
-        with transaction.atomic():
-            game = GameSession.objects.get(game_id=game_id)
-            for r, c in cells_to_explode:
-                dw.bum(game, r, c, player_username)
-            game.save()
+    def apply_explosions(self, game_id, player_username):
+        game = GameSession.objects.get(game_id=game_id)
+        # Kritik hücreler taze tahtadan: CAS tekrarında eski liste kullanılmaz
+        cells_to_explode = dw.find_critical_cells(game.board_state)
+        if not cells_to_explode:
             return game, cells_to_explode
+        for r, c in cells_to_explode:
+            dw.bum(game, r, c, player_username)
+        game.save_if_unchanged(['board_state'])
+        return game, cells_to_explode
 
     @database_sync_to_async
     def _kick_player_db(self, username_to_kick):
@@ -826,13 +1195,48 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
 
         try:
             user_to_kick = User.objects.get(username=username_to_kick)
-            game.players.remove(user_to_kick)
-            game.save()
-            return game, f"{username_to_kick} oyundan atıldı."
         except User.DoesNotExist:
             return None, "Kullanıcı bulunamadı."
-        except Exception as e:
-            return None, f"Hata: {e}"
+
+        with transaction.atomic():
+            # Önce sürümü al; oyun bu arada başladıysa M2M değişikliği geri alınır
+            game.save_if_unchanged([])
+            game.players.remove(user_to_kick)
+        return game, f"{username_to_kick} oyundan atıldı."
+
+    def _eliminate_and_pick_next_turn(self, game, user):
+        """
+        Elenmiş oyuncuları günceller ve sırayı bir sonraki aktif oyuncuya verir.
+        Returns: list of usernames eliminated on this board
+        """
+        eliminated_usernames = dw.check_and_get_eliminated_players(game)
+        if eliminated_usernames:
+            # Elenmiş oyuncuları JSON field'a ekle (players listesinden çıkarma)
+            current_eliminated = list(game.eliminated_players) if game.eliminated_players else []
+            for username in eliminated_usernames:
+                if username not in current_eliminated:
+                    current_eliminated.append(username)
+            game.eliminated_players = current_eliminated
+
+        if game.status == 'in_progress':
+            # Tüm oyuncuları al, ama elenmiş olanları filtrele
+            all_players = list(game.players.all())
+            eliminated_set = set(game.eliminated_players) if game.eliminated_players else set()
+            active_players = [p for p in all_players if p.username not in eliminated_set]
+
+            if active_players:  # Hala aktif oyuncu varsa
+                if user in active_players:
+                    # Sonraki aktif oyuncuyu bul
+                    current_turn_index = active_players.index(user)
+                    next_turn_index = (current_turn_index + 1) % len(active_players)
+                    game.current_turn = active_players[next_turn_index]
+                else:
+                    # Eğer mevcut oyuncu listede yoksa, ilk aktif oyuncuyu al
+                    game.current_turn = active_players[0]
+            else:
+                # Hiç aktif oyuncu kalmadıysa oyunu bitir
+                game.status = 'finished'
+        return eliminated_usernames
 
     @database_sync_to_async
     def check_winner_and_change_turn(self, game_id, user):
@@ -840,57 +1244,17 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         Kazananı KONTROL EDER, elenmiş oyuncuları kontrol eder ve sırayı değiştirir.
         Returns: (game, eliminated_players_list)
         """
-        with transaction.atomic():
-            game = GameSession.objects.get(game_id=game_id)
-
-            # --- ELENMİŞ OYUNCULARI KONTROL ET ---
-            eliminated_usernames = dw.check_and_get_eliminated_players(game)
-            eliminated_players = []
-            
-            if eliminated_usernames:
-                # Elenmiş oyuncuları JSON field'a ekle (players listesinden çıkarma)
-                current_eliminated = list(game.eliminated_players) if game.eliminated_players else []
-                for username in eliminated_usernames:
-                    if username not in current_eliminated:
-                        current_eliminated.append(username)
-                        try:
-                            eliminated_user = User.objects.get(username=username)
-                            eliminated_players.append(eliminated_user)
-                        except User.DoesNotExist:
-                            pass
-                game.eliminated_players = current_eliminated
-
-            # --- KAZANAN KONTROLÜ ---
-            try:
-                dw.check_for_winner(game, user)
-            except TypeError:
-                dw.check_for_winner(game, user)
-
-            # --- SIRAYI DEĞİŞTİR (Elenmiş oyuncuları atla) ---
-            if game.status != 'finished':
-                # Tüm oyuncuları al, ama elenmiş olanları filtrele
-                all_players = list(game.players.all())
-                eliminated_set = set(game.eliminated_players) if game.eliminated_players else set()
-                active_players = [p for p in all_players if p.username not in eliminated_set]
-                
-                if active_players:  # Hala aktif oyuncu varsa
-                    try:
-                        current_turn_index = active_players.index(user)
-                        # Sonraki aktif oyuncuyu bul
-                        next_turn_index = (current_turn_index + 1) % len(active_players)
-                        game.current_turn = active_players[next_turn_index]
-                    except ValueError:
-                        # Eğer mevcut oyuncu listede yoksa, ilk aktif oyuncuyu al
-                        if active_players:
-                            game.current_turn = active_players[0]
-                else:
-                    # Hiç aktif oyuncu kalmadıysa oyunu bitir
-                    game.status = 'finished'
+        game = GameSession.objects.get(game_id=game_id)
+        winner_user = dw.check_for_winner(game, user)
+        eliminated_usernames = self._eliminate_and_pick_next_turn(game, user)
 
-            game.save()
-            return game, eliminated_usernames
+        with transaction.atomic():
+            game.save_if_unchanged(['eliminated_players', 'status', 'winner', 'finished_at', 'current_turn'])
+            # Sıralama sadece oyunu bitiren yazım başarılı olduysa güncellenir
+            if winner_user:
+                update_player_rankings(game, winner_user)
+        return game, eliminated_usernames
 
-    # --- YENİ YARDIMCI FONKSİYON ---
     @database_sync_to_async
     def just_change_turn(self, game_id, user):
         """
@@ -898,47 +1262,10 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         Elenmiş oyuncuları kontrol eder ve atlar.
         Returns: (game, eliminated_players_list)
         """
-        with transaction.atomic():
-            game = GameSession.objects.get(game_id=game_id)
-
-            # --- ELENMİŞ OYUNCULARI KONTROL ET ---
-            eliminated_usernames = dw.check_and_get_eliminated_players(game)
-            eliminated_players = []
-            
-            if eliminated_usernames:
-                # Elenmiş oyuncuları JSON field'a ekle (players listesinden çıkarma)
-                current_eliminated = list(game.eliminated_players) if game.eliminated_players else []
-                for username in eliminated_usernames:
-                    if username not in current_eliminated:
-                        current_eliminated.append(username)
-                        try:
-                            eliminated_user = User.objects.get(username=username)
-                            eliminated_players.append(eliminated_user)
-                        except User.DoesNotExist:
-                            pass
-                game.eliminated_players = current_eliminated
-
-            if game.status == 'in_progress':  # Sadece oyun sürüyorsa
-                # Tüm oyuncuları al, ama elenmiş olanları filtrele
-                all_players = list(game.players.all())
-                eliminated_set = set(game.eliminated_players) if game.eliminated_players else set()
-                active_players = [p for p in all_players if p.username not in eliminated_set]
-                
-                if active_players:  # Hala aktif oyuncu varsa
-                    if user in active_players:
-                        current_turn_index = active_players.index(user)
-                        next_turn_index = (current_turn_index + 1) % len(active_players)
-                        game.current_turn = active_players[next_turn_index]
-                    else:
-                        # Eğer mevcut oyuncu listede yoksa, ilk aktif oyuncuyu al
-                        if active_players:
-                            game.current_turn = active_players[0]
-                else:
-                    # Hiç aktif oyuncu kalmadıysa oyunu bitir
-                    game.status = 'finished'
-
-            game.save()
-            return game, eliminated_usernames
+        game = GameSession.objects.get(game_id=game_id)
+        eliminated_usernames = self._eliminate_and_pick_next_turn(game, user)
+        game.save_if_unchanged(['eliminated_players', 'status', 'current_turn'])
+        return game, eliminated_usernames
 
     async def broadcast_game_state(self, game, message=None, exploded_cells=None, special_event=None, eliminated_players=None, move_cell=None):
         state_data = await self.get_game_state_data_async(game)
@@ -957,9 +1284,14 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         async_to_sync(self.channel_layer.group_send)(self.game_group_name, state_data)
 
     async def game_state(self, event):
-        # ... (Değişiklik yok) ...
+        self._remember_state(event)
         await self.send_json(event)
 
+    def _remember_state(self, state_data):
+        # Önizlemeler için son tahta; sürüm bir kez hesaplanıp paylaşılır
+        self.latest_state = dict(state_data)
+        self.latest_state['board_version'] = rules.board_version(state_data.get('state'))
+
     async def rematch_invite(self, event):
         await self.send_json(event)
 
@@ -982,24 +1314,25 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
         except GameSession.DoesNotExist:
             return None
 
-    @database_sync_to_async
     def is_user_in_game(self, game):
-        # ... (Değişiklik yok) ...
-        return game.players.filter(id=self.user.id).exists()
+        # players get_game'de prefetch edildi; ayrı bir sorgu gerekmez
+        return any(player.id == self.user.id for player in game.players.all())
 
     @database_sync_to_async
     def add_player_to_game(self, game, user):
         """
         Sadece oyuncuyu ekler, oyunu BAŞLATMAZ.
         """
-        with transaction.atomic():
-            game_with_lock = GameSession.objects.select_for_update().get(game_id=game.id)
-            if game_with_lock.is_full or game_with_lock.status != 'waiting':
-                return game_with_lock
+        game = GameSession.objects.select_related('game_type').get(game_id=game.game_id)
+        if game.is_full or game.status != 'waiting':
+            return game
+        if game.is_private and user != game.host and user.username not in (game.invited_players or []):
+            return game
 
-            game_with_lock.players.add(user)
-            game_with_lock.save()
-            return game_with_lock
+        with transaction.atomic():
+            game.save_if_unchanged([])
+            game.players.add(user)
+        return game
 
     @database_sync_to_async
     def get_game_state_data_async(self, game_obj):
@@ -1019,10 +1352,12 @@ class GameConsumer_DiceWars(AsyncJsonWebsocketConsumer):
             'status': game_obj.status,
             'winner': game_obj.winner.username if game_obj.winner else None,
             'board_size': game_obj.board_size,
+            'move_count': game_obj.move_count,
             'eliminated_players': eliminated_players,
         }
 
     async def send_game_state_to_user(self, game_obj):
         # ... (Değişiklik yok) ...
         state_data = await self.get_game_state_data_async(game_obj)
+        self._remember_state(state_data)
         await self.send_json(state_data)
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+Dice Wars rules as pure functions.
+
+Boards are the same dict based structure stored in GameSession.board_state:
+    {'0': {'0': {'owner': 'adem', 'count': 2}, '1': None}, ...}
+Nothing here touches the database; callers that must not mutate their board
+pass a copy (see copy_board).
+"""
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
+EXPLODE_AT = 4
+FIRST_PLACEMENT_COUNT = 3
+# Güvenlik sınırı: doymuş bir tahtada zincirleme patlama hiç bitmeyebilir
+MAX_EXPLOSION_ROUNDS = 500
+PREVIEW_CACHE_SIZE = 4096
+
+# (board_version, board_size, row, col, username, is_first_round) -> preview
+_preview_cache = OrderedDict()
+
+
+def copy_board(board_state):
+    return copy.deepcopy(board_state) if board_state else {}
+
+
+def get_valid_neighbors(row, col, board_size):
+    """(row, col) hücresinin tahta içindeki dört komşusu."""
+    neighbors = []
+    for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+        if 0 <= r < board_size and 0 <= c < board_size:
+            neighbors.append((r, c))
+    return neighbors
+
+
+def find_critical_cells(board_state):
+    """Patlamaya hazır (count >= 4) hücreler."""
+    critical_cells = []
+    if not board_state:
+        return critical_cells
+    for r_str, row in board_state.items():
+        for c_str, cell in row.items():
+            if cell and cell.get('count', 0) >= EXPLODE_AT:
+                critical_cells.append((int(r_str), int(c_str)))
+    return critical_cells
+
+
+def explode_cell(board_state, row, col, username, board_size):
+    """Tek bir hücreyi patlatır; board_state yerinde değişir."""
+    r_str, c_str = str(row), str(col)
+    try:
+        current_count = board_state[r_str][c_str].get('count', 0)
+    except (KeyError, AttributeError):
+        return
+
+    new_count = current_count - EXPLODE_AT
+    if new_count <= 0:
+        board_state[r_str][c_str] = None
+    else:
+        board_state[r_str][c_str]['count'] = new_count
+
+    for r_int, c_int in get_valid_neighbors(row, col, board_size):
+        neighbor_row = board_state.setdefault(str(r_int), {})
+        current_cell = neighbor_row.get(str(c_int))
+        if current_cell is None:
+            neighbor_row[str(c_int)] = {'owner': username, 'count': 1}
+        else:
+            current_cell['count'] += 1
+            current_cell['owner'] = username
+
+
+def place_piece(board_state, row, col, username, is_first_round):
+    """
+    Oyuncunun tıklamasını uygular; board_state yerinde değişir.
+    İlk turda boş hücreye 3'lük taş konur, sonraki turlarda sadece kendi
+    hücresi yükseltilebilir.
+    Returns: None if the move is valid, otherwise an error code
+    ('not_first_round' or 'opponent_cell').
+    """
+    r_str, c_str = str(row), str(col)
+    board_row = board_state.setdefault(r_str, {})
+    cell = board_row.get(c_str)
+
+    if cell is None:
+        if not is_first_round:
+            return 'not_first_round'
+        board_row[c_str] = {'owner': username, 'count': FIRST_PLACEMENT_COUNT}
+        return None
+
+    if cell.get('owner') != username:
+        return 'opponent_cell'
+    cell['count'] += 1
+    return None
+
+
+def resolve_explosions(board_state, board_size, username, max_rounds=MAX_EXPLOSION_ROUNDS):
+    """
+    Zincirleme patlamaları tur tur uygular (board_state yerinde değişir).
+    Yields the list of cells exploded in each round, after applying it.
+    """
+    for _ in range(max_rounds):
+        cells = find_critical_cells(board_state)
+        if not cells:
+            return
+        for r, c in cells:
+            explode_cell(board_state, r, c, username, board_size)
+        yield cells
+
+
+def count_pieces(board_state):
+    """{username: hücre sayısı}"""
+    counts = {}
+    for row in (board_state or {}).values():
+        for cell in row.values():
+            if cell and cell.get('owner'):
+                counts[cell['owner']] = counts.get(cell['owner'], 0) + 1
+    return counts
+
+
+def replay_moves(moves, board_size):
+    """
+    Kayıtlı hamlelerden oyunu baştan oynatır.
+    `moves` is GameSession.move_log: [[username, row, col], ...].
+    Yields frame dicts: one 'move' frame per move followed by one
+    'explosion' frame per chain reaction round. Boards in the frames are
+    snapshots, safe to keep or serialize later.
+    """
+    board_state = {}
+    for seq, (username, row, col) in enumerate(moves, start=1):
+        # Kayıtlı hamleler zaten doğrulanmış; ilk tur kuralı burada gevşek tutulur
+        place_piece(board_state, row, col, username, is_first_round=True)
+        yield {
+            'type': 'move',
+            'seq': seq,
+            'player': username,
+            'row': row,
+            'col': col,
+            'board': copy_board(board_state),
+        }
+        for round_no, cells in enumerate(resolve_explosions(board_state, board_size, username), start=1):
+            yield {
+                'type': 'explosion',
+                'seq': seq,
+                'round': round_no,
+                'exploded_cells': [list(cell) for cell in cells],
+                'board': copy_board(board_state),
+            }
+
+
+def board_version(board_state):
+    """Content hash of a board; identical boards share cached previews."""
+    canonical = json.dumps(board_state or {}, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def preview_move(board_state, board_size, row, col, username, is_first_round, version=None):
+    """
+    Hamlenin sonucunu gerçek tahtaya dokunmadan hesaplar.
+    Returns {'valid': False, 'error': code} or
+    {'valid': True, 'frames': [[[r, c], ...], ...], 'board': final_board}.
+    Results are cached per board version and move, so treat them as read-only.
+    """
+    key = (version or board_version(board_state), board_size, row, col, username, is_first_round)
+    cached = _preview_cache.get(key)
+    if cached is not None:
+        _preview_cache.move_to_end(key)
+        return cached
+
+    board = copy_board(board_state)
+    error = place_piece(board, row, col, username, is_first_round)
+    if error:
+        result = {'valid': False, 'error': error}
+    else:
+        frames = [
+            [list(cell) for cell in cells]
+            for cells in resolve_explosions(board, board_size, username)
+        ]
+        result = {'valid': True, 'frames': frames, 'board': board}
+
+    _preview_cache[key] = result
+    if len(_preview_cache) > PREVIEW_CACHE_SIZE:
+        _preview_cache.popitem(last=False)
+    return result
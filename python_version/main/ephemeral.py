@@ -0,0 +1,252 @@
+"""
+Ephemeral indicators: "typing" in text channels, "speaking" in voice channels.
+
+These arrive at keystroke / audio-level frequency and only the latest state
+matters, so they never take the chat/signaling path and are never stored:
+
+- publish() only overwrites the (user, kind) slot of the room: any number of
+  updates between two flushes coalesce into one.
+- An active indicator is re-broadcast at most every ttl/2 (receivers expire
+  it after ttl_ms on their own); a slot nobody refreshes for ttl expires and
+  is broadcast as inactive.
+- Every flush_interval_ms each room with changes gets one frame, sent over
+  the CHANNEL_LAYERS alias EPHEMERAL_EVENTS['layer'] (falls back to
+  'default'), so indicator traffic never uses chat or signaling capacity.
+  A full layer drops the frame.
+- Frames reach local connections through a bounded per-connection queue;
+  when a client reads too slowly the oldest frames are dropped.
+
+Each process keeps one channel on that layer, joined to the ephemeral group
+of every room that has a local subscriber. The flush and receive loops log
+an error (layer down, bad frame) and carry on after RESTART_DELAY_SECONDS.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger('main')
+
+EPHEMERAL_DEFAULTS = {
+    'layer': 'ephemeral',
+    'flush_interval_ms': 250,
+    'typing_ttl_seconds': 6,
+    'speaking_ttl_seconds': 2,
+    'queue_size': 16,
+}
+
+EPHEMERAL_KINDS = ('typing', 'speaking')
+# Hata veren döngü bu kadar bekleyip devam eder
+RESTART_DELAY_SECONDS = 1
+
+
+def get_ephemeral_config():
+    config = dict(EPHEMERAL_DEFAULTS)
+    config.update(getattr(settings, 'EPHEMERAL_EVENTS', {}))
+    return config
+
+
+def ephemeral_group(room):
+    return f'ephemeral_{room}'
+
+
+class _Slot:
+    __slots__ = ('username', 'channel_name', 'expires_at', 'refresh_at')
+
+    def __init__(self, username, channel_name):
+        self.username = username
+        self.channel_name = channel_name
+        self.expires_at = 0
+        self.refresh_at = 0
+
+
+class _Subscriber:
+    __slots__ = ('user_id', 'queue')
+
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, frame):
+        # Yavaş okuyan istemci: en eski çerçeve düşer, en yeni durum kalır
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(frame)
+
+
+class EphemeralHub:
+    def __init__(self, layer, flush_interval_ms, typing_ttl_seconds, speaking_ttl_seconds, queue_size):
+        self.layer_alias = layer if layer in getattr(settings, 'CHANNEL_LAYERS', {}) else 'default'
+        self.flush_interval = flush_interval_ms / 1000
+        self.ttls = {'typing': typing_ttl_seconds, 'speaking': speaking_ttl_seconds}
+        self.queue_size = queue_size
+        self._active = defaultdict(dict)  # room -> {(user_id, kind): _Slot}
+        self._pending = defaultdict(dict)  # room -> {(user_id, kind): event}; son flush'tan beri
+        self._subscribers = defaultdict(dict)  # room -> {channel_name: _Subscriber}
+        self._lock = threading.Lock()
+        self._channel = None
+        self._tasks = []
+        self._starting = None
+        self.dropped = 0
+
+    # --- Consumer tarafı ---
+
+    async def subscribe(self, room, user_id, channel_name):
+        """Registers a local connection; returns the queue its frames arrive on."""
+        subscriber = _Subscriber(str(user_id), self.queue_size)
+        first = not self._subscribers[room]
+        self._subscribers[room][channel_name] = subscriber
+        await self._ensure_running()
+        if first:
+            await self.layer.group_add(ephemeral_group(room), self._channel)
+        return subscriber.queue
+
+    async def unsubscribe(self, room, channel_name):
+        subscribers = self._subscribers.get(room, {})
+        if subscribers.pop(channel_name, None) is None:
+            return
+        # Bağlantının açık bıraktığı göstergeler hemen kapanır
+        with self._lock:
+            for (user_id, kind), slot in list(self._active.get(room, {}).items()):
+                if slot.channel_name == channel_name:
+                    self._deactivate(room, user_id, kind)
+        if not subscribers:
+            del self._subscribers[room]
+            await self.flush_room(room)
+            if self._channel is not None:
+                await self.layer.group_discard(ephemeral_group(room), self._channel)
+        if not self._subscribers:
+            await self._stop()
+
+    def publish(self, room, user_id, username, channel_name, kind, active):
+        """Records the latest indicator state; costs no I/O (the flush task sends it)."""
+        if kind not in self.ttls:
+            return
+        key = (str(user_id), kind)
+        now = time.monotonic()
+        with self._lock:
+            slot = self._active.get(room, {}).get(key)
+            if not active:
+                if slot is not None:
+                    self._deactivate(room, *key)
+                return
+            if slot is None:
+                slot = self._active[room][key] = _Slot(username, channel_name)
+            slot.channel_name = channel_name
+            slot.expires_at = now + self.ttls[kind]
+            if now >= slot.refresh_at:
+                slot.refresh_at = now + self.ttls[kind] / 2
+                self._pending[room][key] = self._event(key, username, True)
+
+    def _deactivate(self, room, user_id, kind):
+        slot = self._active[room].pop((user_id, kind))
+        if not self._active[room]:
+            del self._active[room]
+        self._pending[room][(user_id, kind)] = self._event((user_id, kind), slot.username, False)
+
+    def _event(self, key, username, active):
+        user_id, kind = key
+        return {
+            'kind': kind,
+            'user_id': user_id,
+            'username': username,
+            'active': active,
+            'ttl_ms': int(self.ttls[kind] * 1000),
+        }
+
+    # --- Flush ve dağıtım ---
+
+    @property
+    def layer(self):
+        return get_channel_layer(self.layer_alias)
+
+    async def _ensure_running(self):
+        if self._starting is None:
+            self._starting = asyncio.Lock()
+        async with self._starting:
+            if self._tasks and not any(task.done() for task in self._tasks):
+                return
+            for task in self._tasks:
+                task.cancel()
+            if self._channel is None:
+                self._channel = await self.layer.new_channel('ephemeral.')
+            loop = asyncio.get_running_loop()
+            self._tasks = [
+                loop.create_task(self._supervise('flush', self._flush_once)),
+                loop.create_task(self._supervise('receive', self._receive_once)),
+            ]
+
+    async def _stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        self._channel = None
+        self._starting = None
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for room in list(self._active):
+                for (user_id, kind), slot in list(self._active[room].items()):
+                    if slot.expires_at <= now:
+                        self._deactivate(room, user_id, kind)
+
+    async def _supervise(self, name, step):
+        """Runs step() until cancelled; an error is logged and the loop goes on."""
+        while True:
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ephemeral {name} loop failed: {e}; retrying in {RESTART_DELAY_SECONDS}s")
+                await asyncio.sleep(RESTART_DELAY_SECONDS)
+
+    async def _flush_once(self):
+        await asyncio.sleep(self.flush_interval)
+        self.expire()
+        with self._lock:
+            rooms = list(self._pending)
+        for room in rooms:
+            await self.flush_room(room)
+
+    async def flush_room(self, room):
+        with self._lock:
+            events = list(self._pending.pop(room, {}).values())
+        if not events:
+            return
+        try:
+            await self.layer.group_send(
+                ephemeral_group(room), {"type": "ephemeral.events", "room": room, "events": events}
+            )
+        except ChannelFull:
+            self.dropped += 1
+
+    async def _receive_once(self):
+        message = await self.layer.receive(self._channel)
+        self.deliver(message['room'], message['events'])
+
+    def deliver(self, room, events):
+        for subscriber in list(self._subscribers.get(room, {}).values()):
+            # Kişi kendi göstergesini geri almaz
+            visible = [event for event in events if event['user_id'] != subscriber.user_id]
+            if visible:
+                subscriber.offer({"type": "ephemeral", "events": visible})
+
+
+_hub = None
+
+
+def get_ephemeral_hub():
+    global _hub
+    if _hub is None:
+        _hub = EphemeralHub(**get_ephemeral_config())
+    return _hub
@@ -0,0 +1,46 @@
+"""
+Pieces shared by the multi-process channel layers (pg_layer, socket_layer).
+
+Messages travel as JSON; bytes values (e.g. websocket.send bytes) are
+wrapped as {"__bytes__": base64}. Process-specific channel names embed the
+id of the layer instance (process) that owns them:
+    <prefix>.<layer id>!<random>
+"""
+import base64
+import json
+import uuid
+
+
+def _default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} is not serializable by the channel layer')
+
+
+def _object_hook(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def encode_message(message):
+    return json.dumps(message, separators=(',', ':'), default=_default)
+
+
+def decode_message(text):
+    return json.loads(text, object_hook=_object_hook)
+
+
+def new_layer_id():
+    return uuid.uuid4().hex[:12]
+
+
+def specific_channel_name(prefix, layer_id):
+    return f"{prefix.rstrip('.')}.{layer_id}!{uuid.uuid4().hex}"
+
+
+def channel_owner(channel):
+    """Layer id of the process owning a process-specific channel, else None."""
+    if '!' not in channel:
+        return None
+    return channel[:channel.index('!')].rsplit('.', 1)[-1]
@@ -0,0 +1,274 @@
+"""
+Periodic background jobs (run via management commands).
+
+Each job works in small batches inside short transactions and uses
+SELECT ... FOR UPDATE SKIP LOCKED so it never waits on rows that a live
+consumer is currently writing.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import channel_access
+from .models import (
+    ChannelReadState, ChatMessage, CustomUser, GameArchive, GameSession, Server, ServerMember, ServerRole,
+    TextChannel, VoiceChannel
+)
+
+logger = logging.getLogger('main')
+
+REAPER_DEFAULTS = {
+    'waiting_ttl_minutes': 30,
+    'in_progress_ttl_minutes': 120,
+    'batch_size': 200,
+    'interval_seconds': 60,
+}
+
+ARCHIVE_DEFAULTS = {
+    'after_days': 7,
+    'batch_size': 200,
+}
+
+DELETION_DEFAULTS = {
+    'batch_size': 1000,
+    'interval_seconds': 30,
+}
+
+# Process-wide totals since start-up, handy for a long running reaper loop
+reaper_metrics = {
+    'runs': 0,
+    'waiting_deleted': 0,
+    'in_progress_closed': 0,
+}
+
+
+def get_reaper_config():
+    config = dict(REAPER_DEFAULTS)
+    config.update(getattr(settings, 'GAME_SESSION_REAPER', {}))
+    return config
+
+
+def get_archive_config():
+    config = dict(ARCHIVE_DEFAULTS)
+    config.update(getattr(settings, 'GAME_ARCHIVE', {}))
+    return config
+
+
+def get_deletion_config():
+    config = dict(DELETION_DEFAULTS)
+    config.update(getattr(settings, 'PENDING_DELETIONS', {}))
+    return config
+
+
+def _locked_batch(queryset, batch_size):
+    """Primary keys of up to batch_size rows nobody else is holding a lock on."""
+    return list(
+        queryset.select_for_update(skip_locked=True)
+        .order_by('last_activity_at')
+        .values_list('game_id', flat=True)[:batch_size]
+    )
+
+
+def reap_stale_game_sessions(now=None, batch_size=None):
+    """
+    Deletes waiting tables and closes in-progress games that have seen no
+    activity for longer than the configured TTLs. A connected GameConsumer
+    refreshes last_activity_at, so only tables nobody sits at expire.
+    Returns a dict with how many rows were reclaimed in this run.
+    """
+    config = get_reaper_config()
+    now = now or timezone.now()
+    batch_size = batch_size or config['batch_size']
+    waiting_cutoff = now - timedelta(minutes=config['waiting_ttl_minutes'])
+    in_progress_cutoff = now - timedelta(minutes=config['in_progress_ttl_minutes'])
+
+    stats = {'waiting_deleted': 0, 'in_progress_closed': 0}
+
+    # 1. Nobody is left at these tables; nothing worth keeping
+    while True:
+        with transaction.atomic():
+            ids = _locked_batch(
+                GameSession.objects.filter(status='waiting', last_activity_at__lt=waiting_cutoff),
+                batch_size
+            )
+            if not ids:
+                break
+            GameSession.objects.filter(game_id__in=ids).delete()
+        stats['waiting_deleted'] += len(ids)
+
+    # 2. Abandoned mid-game: close without a winner so the row leaves the lobby queries
+    while True:
+        with transaction.atomic():
+            ids = _locked_batch(
+                GameSession.objects.filter(status='in_progress', last_activity_at__lt=in_progress_cutoff),
+                batch_size
+            )
+            if not ids:
+                break
+            GameSession.objects.filter(game_id__in=ids).update(
+                status='finished',
+                current_turn=None,
+                finished_at=now,
+                last_activity_at=now,
+                version=F('version') + 1,
+            )
+        stats['in_progress_closed'] += len(ids)
+
+    reaper_metrics['runs'] += 1
+    for key, value in stats.items():
+        reaper_metrics[key] += value
+
+    if any(stats.values()):
+        logger.info(
+            f"GameSession reaper: deleted {stats['waiting_deleted']} waiting, "
+            f"closed {stats['in_progress_closed']} in-progress sessions"
+        )
+    return stats
+
+
+def archive_finished_games(older_than=None, batch_size=None, now=None):
+    """
+    Moves finished GameSessions older than `older_than` (timedelta, defaults to
+    GAME_ARCHIVE['after_days']) into GameArchive and deletes the hot rows.
+    Returns the number of archived games.
+    """
+    config = get_archive_config()
+    now = now or timezone.now()
+    older_than = older_than if older_than is not None else timedelta(days=config['after_days'])
+    batch_size = batch_size or config['batch_size']
+    cutoff = now - older_than
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = _locked_batch(
+                GameSession.objects.filter(status='finished', last_activity_at__lt=cutoff),
+                batch_size
+            )
+            if not ids:
+                break
+            games = GameSession.objects.filter(game_id__in=ids).prefetch_related('players')
+            GameArchive.objects.bulk_create(
+                [GameArchive.from_session(game) for game in games],
+                ignore_conflicts=True
+            )
+            GameSession.objects.filter(game_id__in=ids).delete()
+        archived += len(ids)
+
+    if archived:
+        logger.info(f"GameSession archiver: moved {archived} finished sessions to GameArchive")
+    return archived
+
+
+def _no_report(label, count):
+    pass
+
+
+def _delete_batched(queryset, batch_size, label, report):
+    """
+    Deletes queryset in primary key order, batch_size rows per short
+    transaction, so other writers only ever wait on one small batch.
+    """
+    model = queryset.model
+    deleted = 0
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(batch.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            model._base_manager.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        last_pk = pks[-1]
+        report(label, deleted)
+    return deleted
+
+
+def _clear_batched(queryset, field, batch_size, label, report):
+    """Batched SET_NULL for a nullable foreign key (what the cascade would have done)."""
+    model = queryset.model
+    cleared = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            model._base_manager.filter(pk__in=pks).update(**{field: None})
+        cleared += len(pks)
+        report(label, cleared)
+    return cleared
+
+
+def _purge_text_channel(channel, batch_size, report):
+    _delete_batched(ChatMessage._base_manager.filter(channel=channel), batch_size, f"{channel} messages", report)
+    _delete_batched(ChannelReadState._base_manager.filter(channel=channel), batch_size, f"{channel} read states", report)
+    # Bağımlılar gitti; son silme tek satırlık
+    channel.delete()
+
+
+def _purge_server(server, batch_size, report):
+    for channel in TextChannel._base_manager.filter(server=server).order_by('pk'):
+        _purge_text_channel(channel, batch_size, report)
+    _delete_batched(VoiceChannel._base_manager.filter(server=server), batch_size, f"{server} voice channels", report)
+    _delete_batched(ServerMember._base_manager.filter(server=server), batch_size, f"{server} members", report)
+    _delete_batched(ServerRole._base_manager.filter(server=server), batch_size, f"{server} roles", report)
+    # Kanal ve üye silmeleri sinyal göndermez (hızlı silme); önbellek Server'ın post_delete'iyle bir kez düşer
+    server.delete()
+
+
+def _purge_user(user, batch_size, report):
+    # Sahip olunan sunucular da kullanıcıyla birlikte gider (CASCADE)
+    for server in Server._base_manager.filter(owner=user).order_by('pk'):
+        _purge_server(server, batch_size, report)
+    _delete_batched(ChatMessage._base_manager.filter(user=user), batch_size, f"{user} messages", report)
+    _delete_batched(ChannelReadState._base_manager.filter(user=user), batch_size, f"{user} read states", report)
+    # Üyelik silmek sinyal göndermez; diğer sunucuların üye önbelleği burada düşürülür
+    member_of = list(Server._base_manager.filter(members__user=user).values_list('slug', flat=True))
+    _delete_batched(ServerMember._base_manager.filter(user=user), batch_size, f"{user} memberships", report)
+    channel_access.invalidate(*member_of)
+
+    sessions = GameSession._base_manager
+    for field in ('host', 'current_turn', 'winner'):
+        _delete_batched(sessions.filter(**{field: user}), batch_size, f"{user} games ({field})", report)
+    through = GameSession.players.through
+    _delete_batched(
+        through._base_manager.filter(**{GameSession.players.field.m2m_reverse_field_name(): user}),
+        batch_size, f"{user} game seats", report
+    )
+    for field in ('host', 'winner'):
+        _clear_batched(GameArchive._base_manager.filter(**{field: user}), field, batch_size, f"{user} archived games ({field})", report)
+    user.delete()
+
+
+def process_pending_deletions(batch_size=None, report=None):
+    """
+    Removes servers, text channels and users marked with request_deletion(),
+    dependents first, in small batches. report(label, count) is called after
+    every batch. Returns a dict with how many objects of each kind were removed.
+    """
+    batch_size = batch_size or get_deletion_config()['batch_size']
+    report = report or _no_report
+    stats = {'servers': 0, 'text_channels': 0, 'users': 0}
+
+    # Önce kullanıcılar; sunucuları ve kanalları da kapsar
+    for user in CustomUser.all_objects.filter(deletion_requested_at__isnull=False).order_by('deletion_requested_at'):
+        _purge_user(user, batch_size, report)
+        stats['users'] += 1
+        logger.info(f"Pending deletion: user {user} removed")
+
+    for server in Server.all_objects.filter(deletion_requested_at__isnull=False).order_by('deletion_requested_at'):
+        _purge_server(server, batch_size, report)
+        stats['servers'] += 1
+        logger.info(f"Pending deletion: server {server} removed")
+
+    for channel in TextChannel.all_objects.filter(deletion_requested_at__isnull=False).order_by('deletion_requested_at'):
+        _purge_text_channel(channel, batch_size, report)
+        stats['text_channels'] += 1
+        logger.info(f"Pending deletion: text channel {channel} removed")
+
+    return stats
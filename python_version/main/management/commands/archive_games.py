@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main.maintenance import archive_finished_games
+
+
+class Command(BaseCommand):
+    help = "Moves finished GameSessions into the compact GameArchive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=None,
+                            help="Archive games finished more than this many days ago (default: GAME_ARCHIVE['after_days']).")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options['older_than_days'] is not None:
+            older_than = timedelta(days=options['older_than_days'])
+
+        archived = archive_finished_games(older_than=older_than, batch_size=options['batch_size'])
+        self.stdout.write(f"archived={archived}")
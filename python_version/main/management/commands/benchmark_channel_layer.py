@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from main.pg_layer import PostgresChannelLayer
+from main.socket_layer import UnixSocketChannelLayer
+
+BACKENDS = ('memory', 'postgres', 'socket')
+
+
+def make_layer(backend, capacity):
+    if backend == 'postgres':
+        return PostgresChannelLayer(capacity=capacity)
+    if backend == 'socket':
+        return UnixSocketChannelLayer(capacity=capacity, socket_dir=os.path.join(tempfile.gettempdir(), 'nbcsw2-bench'))
+    return InMemoryChannelLayer(capacity=capacity)
+
+
+class Command(BaseCommand):
+    help = "Measures channel layer throughput (send, group fan-out, large payloads) for the in-memory, Postgres and UNIX socket layers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(BACKENDS), help="Comma separated: memory,postgres,socket.")
+        parser.add_argument('--messages', type=int, default=2000, help="Point-to-point messages per run.")
+        parser.add_argument('--members', type=int, default=20, help="Channels in the fan-out group.")
+        parser.add_argument('--size', type=int, default=200, help="Payload size in bytes for small messages.")
+        parser.add_argument('--large-size', type=int, default=20000, help="Payload size that exceeds the NOTIFY limit.")
+
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = set(backends) - set(BACKENDS)
+        if unknown:
+            raise CommandError(f"Unknown backend(s): {', '.join(sorted(unknown))}")
+        for backend in backends:
+            asyncio.run(self.run_backend(backend, options))
+
+    def make_layers(self, backend, capacity):
+        """Two layers standing in for two processes (the in-memory layer can only talk to itself)."""
+        if backend == 'memory':
+            layer = make_layer(backend, capacity)
+            return layer, layer
+        return make_layer(backend, capacity), make_layer(backend, capacity)
+
+    async def run_backend(self, backend, options):
+        count = options['messages']
+        members = options['members']
+        sender, receiver = self.make_layers(backend, capacity=max(count, members) * 2)
+        await sender.flush()
+        try:
+            small = {'type': 'bench.message', 'payload': 'x' * options['size']}
+            large = {'type': 'bench.message', 'payload': 'x' * options['large_size']}
+
+            rate = await self.point_to_point(sender, receiver, small, count)
+            self.report(backend, f"send {options['size']}B", count, rate)
+
+            large_count = max(count // 10, 1)
+            rate = await self.point_to_point(sender, receiver, large, large_count)
+            self.report(backend, f"send {options['large_size']}B", large_count, rate)
+
+            sends = max(count // members, 1)
+            rate = await self.fan_out(sender, receiver, small, members, sends)
+            self.report(backend, f"group_send x{members}", sends * members, rate)
+        finally:
+            await sender.flush()
+            for layer in {sender, receiver}:
+                if hasattr(layer, 'close'):
+                    await layer.close()
+
+    async def point_to_point(self, sender, receiver, message, count):
+        channel = await receiver.new_channel()
+        started = time.perf_counter()
+        consumer = asyncio.create_task(self.consume(receiver, [channel], count))
+        for _ in range(count):
+            await sender.send(channel, message)
+        await asyncio.wait_for(consumer, 60)
+        return count / (time.perf_counter() - started)
+
+    async def fan_out(self, sender, receiver, message, members, sends):
+        group = 'bench_fan_out'
+        # Üyelerin yarısı gönderenin "sürecinde", yarısı diğerinde
+        channels = []
+        for index in range(members):
+            layer = receiver if index % 2 else sender
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+            channels.append((layer, channel))
+        started = time.perf_counter()
+        consumers = [asyncio.create_task(self.consume(layer, [channel], sends)) for layer, channel in channels]
+        for _ in range(sends):
+            await sender.group_send(group, message)
+        await asyncio.wait_for(asyncio.gather(*consumers), 60)
+        elapsed = time.perf_counter() - started
+        for layer, channel in channels:
+            await layer.group_discard(group, channel)
+        return sends * members / elapsed
+
+    async def consume(self, layer, channels, count):
+        for channel in channels:
+            for _ in range(count):
+                await layer.receive(channel)
+
+    def report(self, backend, scenario, count, rate):
+        self.stdout.write(f"{backend:<9} {scenario:<20} {count:>7} msgs  {rate:>10,.0f} msg/s")
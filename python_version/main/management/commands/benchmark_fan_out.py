@@ -0,0 +1,108 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+GROUP = 'bench_fan_out'
+
+
+async def _hold_members(layer, members, rounds, ready, results):
+    """Joins `members` channels to the group and reports, per round, how long until all of them had the message."""
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    ready.put(members)
+    for _ in range(rounds):
+        for channel in channels:
+            message = await layer.receive(channel)
+        # Aynı makinede time.monotonic() süreçler arasında karşılaştırılabilir
+        results.put(time.monotonic() - message['sent_at'])
+    for channel in channels:
+        await layer.group_discard(GROUP, channel)
+
+
+def _member_process(backend, members, rounds, ready, results):
+    # spawn ile başlayan süreç: katmanlar modelleri içe aktarır, önce Django kurulmalı
+    import django
+    django.setup()
+    from .benchmark_channel_layer import make_layer
+
+    async def run():
+        layer = make_layer(backend, capacity=rounds + 1)
+        try:
+            await _hold_members(layer, members, rounds, ready, results)
+        finally:
+            if hasattr(layer, 'close'):
+                await layer.close()
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = "Measures group_send fan-out latency (send until every member has it) with members spread over worker processes."
+
+    def add_arguments(self, parser):
+        from .benchmark_channel_layer import BACKENDS
+
+        parser.add_argument('--backend', choices=BACKENDS, default='socket')
+        parser.add_argument('--members', default='1000,10000', help="Comma separated group sizes.")
+        parser.add_argument('--processes', type=int, default=min(os.cpu_count() or 1, 4),
+                            help="Worker processes holding the members (the in-memory layer always uses 1).")
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['members'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError("--members must be comma separated integers.")
+        processes = 0 if options['backend'] == 'memory' else max(options['processes'], 1)
+        for members in sizes:
+            latencies = asyncio.run(self.run(options['backend'], members, processes, options['rounds']))
+            latencies.sort()
+            self.stdout.write(
+                f"{options['backend']:<9} {members:>6} members  {processes or 1} proc  "
+                f"p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+                f"p95 {latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000:8.2f} ms  "
+                f"max {latencies[-1] * 1000:8.2f} ms"
+            )
+
+    async def run(self, backend, members, processes, rounds):
+        from .benchmark_channel_layer import make_layer
+
+        layer = make_layer(backend, capacity=rounds + 1)
+        workers = []
+        local = None
+        if processes:
+            context = multiprocessing.get_context('spawn')
+            ready, results = context.Queue(), context.Queue()
+            shares = [members // processes + (1 if index < members % processes else 0) for index in range(processes)]
+            for share in shares:
+                worker = context.Process(target=_member_process, args=(backend, share, rounds, ready, results))
+                worker.start()
+                workers.append(worker)
+        else:
+            ready, results = queue.Queue(), queue.Queue()
+            local = asyncio.create_task(_hold_members(layer, members, rounds, ready, results))
+        try:
+            for _ in range(len(workers) or 1):
+                await asyncio.to_thread(ready.get, timeout=120)
+            latencies = []
+            for _ in range(rounds):
+                await layer.group_send(GROUP, {'type': 'bench.fan_out', 'sent_at': time.monotonic()})
+                # Tur, en son alan üyeyle biter
+                per_holder = [await asyncio.to_thread(results.get, timeout=60) for _ in range(len(workers) or 1)]
+                latencies.append(max(per_holder))
+            if local is not None:
+                await local
+            return latencies
+        finally:
+            for worker in workers:
+                worker.join(timeout=10)
+                if worker.is_alive():
+                    worker.terminate()
+            if hasattr(layer, 'close'):
+                await layer.close()
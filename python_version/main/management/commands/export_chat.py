@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.chat_export import EXPORT_FORMATS, export_chunks, export_queryset_from_params
+
+
+class Command(BaseCommand):
+    help = "Streams chat messages as NDJSON or CSV, filtered by server, channel, user and time window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', help="Server slug.")
+        parser.add_argument('--channel', help="Text channel slug (needs --server).")
+        parser.add_argument('--user', help="Username of the author.")
+        parser.add_argument('--since', help="ISO date or datetime, inclusive.")
+        parser.add_argument('--until', help="ISO date or datetime, exclusive (a bare date includes that day).")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output on the fly.")
+        parser.add_argument('--output', '-o', default='-', help="Output file, '-' for stdout.")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Rows fetched per cursor round trip.")
+
+    def handle(self, *args, **options):
+        try:
+            queryset = export_queryset_from_params(
+                server=options['server'],
+                channel=options['channel'],
+                user=options['user'],
+                since=options['since'],
+                until=options['until'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        extra = {'chunk_size': options['chunk_size']} if options['chunk_size'] else {}
+        chunks = export_chunks(queryset, options['format'], compress=options['gzip'], **extra)
+
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written} bytes to {options['output']}")
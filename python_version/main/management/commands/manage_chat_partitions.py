@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from main.chat_partitions import apply_retention, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = "Creates upcoming monthly ChatMessage partitions and applies per-server message retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None,
+                            help="Partitions to prepare after the current month (default: CHAT_PARTITIONS['months_ahead']).")
+        parser.add_argument('--detach', action='store_true', default=None,
+                            help="Detach expired partitions instead of dropping them (e.g. to pg_dump them first).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows per DELETE for servers with a shorter retention than the partitions.")
+        parser.add_argument('--skip-retention', action='store_true',
+                            help="Only create partitions.")
+
+    def handle(self, *args, **options):
+        created = ensure_partitions(months_ahead=options['months_ahead'])
+        self.stdout.write(f"created={','.join(created) or '-'}")
+        if options['skip_retention']:
+            return
+
+        stats = apply_retention(detach=options['detach'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f"dropped={','.join(stats['dropped']) or '-'} "
+            f"detached={','.join(stats['detached']) or '-'} "
+            f"deleted={stats['deleted']}"
+        )
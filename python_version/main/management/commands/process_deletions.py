@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.maintenance import get_deletion_config, process_pending_deletions
+
+
+class Command(BaseCommand):
+    help = "Removes servers, text channels and users marked for deletion, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running, sweeping every --interval seconds.")
+        parser.add_argument('--interval', type=int, default=None, help="Seconds between sweeps in --loop mode.")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--quiet', action='store_true', help="Only print the summary, not per-batch progress.")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_deletion_config()['interval_seconds']
+
+        def report(label, count):
+            if not options['quiet']:
+                self.stdout.write(f"  {label}: {count} rows")
+
+        while True:
+            stats = process_pending_deletions(batch_size=options['batch_size'], report=report)
+            self.stdout.write(
+                f"servers={stats['servers']} "
+                f"text_channels={stats['text_channels']} "
+                f"users={stats['users']}"
+            )
+            if not options['loop']:
+                break
+            time.sleep(interval)
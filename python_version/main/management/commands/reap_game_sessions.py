@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.maintenance import get_reaper_config, reap_stale_game_sessions, reaper_metrics
+
+
+class Command(BaseCommand):
+    help = "Deletes abandoned waiting tables and closes stale in-progress GameSessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running, sweeping every --interval seconds.")
+        parser.add_argument('--interval', type=int, default=None, help="Seconds between sweeps in --loop mode.")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_reaper_config()['interval_seconds']
+
+        while True:
+            stats = reap_stale_game_sessions(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"waiting_deleted={stats['waiting_deleted']} "
+                f"in_progress_closed={stats['in_progress_closed']} "
+                f"(totals: runs={reaper_metrics['runs']} "
+                f"waiting_deleted={reaper_metrics['waiting_deleted']} "
+                f"in_progress_closed={reaper_metrics['in_progress_closed']})"
+            )
+            if not options['loop']:
+                break
+            time.sleep(interval)
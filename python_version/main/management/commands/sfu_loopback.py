@@ -0,0 +1,82 @@
+import asyncio
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.sfu import SFU_AVAILABLE, get_sfu_client
+
+
+class Command(BaseCommand):
+    help = "Connects local aiortc loopback peers to the SFU worker pool and checks that each one receives everyone else's tracks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peers', type=int, default=3)
+        parser.add_argument('--video', action='store_true', help="Send a synthetic video track as well as audio.")
+        parser.add_argument('--timeout', type=float, default=15, help="Seconds to wait for every track to arrive.")
+
+    def handle(self, *args, **options):
+        if not SFU_AVAILABLE:
+            raise CommandError("aiortc is not installed; the SFU is unavailable (pip install aiortc).")
+        if options['peers'] < 2:
+            raise CommandError("Need at least two peers.")
+        ok = asyncio.run(self.run(options['peers'], options['video'], options['timeout']))
+        if not ok:
+            raise CommandError("Not every peer received all forwarded tracks.")
+
+    async def run(self, peer_count, video, timeout):
+        from aiortc import RTCPeerConnection, RTCSessionDescription
+        from aiortc.mediastreams import AudioStreamTrack, VideoStreamTrack
+
+        client = get_sfu_client()
+        room = f'sfu-loopback-{uuid.uuid4().hex[:8]}'
+        tracks_per_peer = 2 if video else 1
+        expected = (peer_count - 1) * tracks_per_peer
+        peers = []
+        started = time.monotonic()
+
+        try:
+            for index in range(peer_count):
+                peer_id = f'{room}-{index}'
+                pc = RTCPeerConnection()
+                pc.addTrack(AudioStreamTrack())
+                if video:
+                    pc.addTrack(VideoStreamTrack())
+                received = []
+                pc.on('track', lambda track, received=received: received.append(track.kind))
+
+                async def notify(event, pc=pc, peer_id=peer_id):
+                    # SFU yeni track'ler için teklif gönderdi; tarayıcının yapacağı gibi cevapla
+                    await pc.setRemoteDescription(RTCSessionDescription(**event['offer']))
+                    await pc.setLocalDescription(await pc.createAnswer())
+                    await client.answer(room, peer_id, {'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type})
+
+                await pc.setLocalDescription(await pc.createOffer())
+                answer = await client.join(
+                    room, peer_id, str(index), f'loopback-{index}',
+                    {'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type}, notify=notify
+                )
+                await pc.setRemoteDescription(RTCSessionDescription(**answer))
+                peers.append((peer_id, pc, received))
+                self.stdout.write(f"peer {index} joined ({time.monotonic() - started:.2f}s)")
+
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline and any(len(received) < expected for _, _, received in peers):
+                await asyncio.sleep(0.2)
+
+            stats = await client.stats(room)
+            ok = True
+            for index, (_, _, received) in enumerate(peers):
+                ok = ok and len(received) >= expected
+                self.stdout.write(
+                    f"peer {index}: received {len(received)}/{expected} tracks, "
+                    f"sfu incoming={stats.get(f'loopback-{index}', {}).get('incoming')} "
+                    f"forwarded={stats.get(f'loopback-{index}', {}).get('forwarded')}"
+                )
+            self.stdout.write(f"{'OK' if ok else 'FAILED'} in {time.monotonic() - started:.2f}s")
+            return ok
+        finally:
+            for peer_id, pc, _ in peers:
+                await client.leave(room, peer_id)
+                await pc.close()
+            client.shutdown()
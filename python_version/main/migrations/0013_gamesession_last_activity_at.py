@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at_to_last_activity(apps, schema_editor):
+    """created_at was auto_now, so it already holds the last save time"""
+    GameSession = apps.get_model('main', 'GameSession')
+    GameSession.objects.update(last_activity_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_customuser_user_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamesession',
+            name='last_activity_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Son Aktivite'),
+        ),
+        migrations.RunPython(copy_created_at_to_last_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='gamesession',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['status', 'last_activity_at'], name='main_gamese_status_015902_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_gamesession_last_activity_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('game_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('players', models.JSONField(default=list, verbose_name='Oyuncular')),
+                ('board_size', models.PositiveSmallIntegerField(default=5, verbose_name='Tahta Boyutu (N x N)')),
+                ('move_count', models.PositiveIntegerField(default=0, verbose_name='Hamle Sayısı')),
+                ('final_board', models.BinaryField(verbose_name='Son Tahta')),
+                ('created_at', models.DateTimeField(verbose_name='Oluşturulma Tarihi')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Bitiş Zamanı')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Arşivlenme Zamanı')),
+                ('game_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archived_sessions', to='main.minigame')),
+                ('host', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('winner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_games_won', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Arşivlenmiş Oyun',
+                'verbose_name_plural': 'Arşivlenmiş Oyunlar',
+                'ordering': ['-finished_at'],
+                'indexes': [models.Index(fields=['game_type', 'finished_at'], name='main_gamear_game_ty_66042d_idx')],
+            },
+        ),
+    ]
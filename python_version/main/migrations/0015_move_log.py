@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_gamearchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamearchive',
+            name='moves',
+            field=models.BinaryField(default=b'', verbose_name='Hamleler'),
+        ),
+        migrations.AddField(
+            model_name='gamesession',
+            name='move_log',
+            field=models.JSONField(blank=True, default=list, verbose_name='Hamle Kaydı'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_move_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamesession',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Sürüm'),
+        ),
+    ]
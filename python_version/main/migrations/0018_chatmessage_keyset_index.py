@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_chatmessage_created_at_default'),
+    ]
+
+    operations = [
+        # Yeni index eski kaldırılmadan önce oluşturulur; geçmiş okumaları index'siz kalmaz
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['channel', 'created_at', 'id'], name='main_chatme_channel_2d2523_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='chatmessage',
+            name='main_chatme_channel_3c4cd9_idx',
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models, transaction
+
+# chat_search.SEARCH_CONFIGS ile aynı eşleme (migration'lar dondurulmuş kalmalı)
+SEARCH_CONFIGS = {
+    'en': 'english',
+    'tr': 'turkish',
+    'es': 'spanish',
+    'fr': 'french',
+    'de': 'german',
+}
+
+# Trigger ve doldurma aynı ifadeyi kullanır; {row} satırın öneki (NEW. ya da boş)
+SEARCH_VECTOR = """
+to_tsvector((CASE {row}language %s ELSE 'simple' END)::regconfig, coalesce({row}content, ''))
+|| to_tsvector('simple', coalesce({row}content, ''))
+""" % ' '.join(f"WHEN '{code}' THEN '{config}'" for code, config in SEARCH_CONFIGS.items())
+
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION main_chatmessage_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {vector};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_chatmessage_search_vector
+    BEFORE INSERT OR UPDATE OF content, language ON main_chatmessage
+    FOR EACH ROW EXECUTE FUNCTION main_chatmessage_search_vector();
+""".format(vector=SEARCH_VECTOR.format(row='NEW.'))
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS main_chatmessage_search_vector ON main_chatmessage;
+DROP FUNCTION IF EXISTS main_chatmessage_search_vector();
+"""
+
+# Mevcut mesajlar id aralıklarıyla doldurulur: her parti kendi kısa transaction'ı
+BACKFILL_BATCH_SIZE = 5000
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_TRIGGER)
+
+
+def backfill_search_vector(apps, schema_editor):
+    # Trigger'dan sonra: yeni ve düzenlenen mesajları trigger doldurur, burada sadece eskiler kalır
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(id), max(id) FROM main_chatmessage")
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute(
+                    f"UPDATE main_chatmessage SET search_vector = {SEARCH_VECTOR.format(row='')} "
+                    "WHERE id >= %s AND id < %s AND search_vector IS NULL",
+                    [start, start + BACKFILL_BATCH_SIZE],
+                )
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+    # Büyük tabloda tek transaction uzun kilit ve şişme demek; doldurma partiler halinde
+    atomic = False
+
+    dependencies = [
+        ('main', '0018_chatmessage_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='language',
+            field=models.CharField(default='en', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        # Yazmaları kilitlemeden, doldurmadan sonra. Geri alırken düz DROP: 0020'den sonra
+        # tablo partition'lı kalır ve partition'lı index CONCURRENTLY silinemez
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='chatmessage',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='main_chatmessage_search_gin'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS main_chatmessage_search_gin "
+                    "ON main_chatmessage USING gin (search_vector)",
+                    "DROP INDEX IF EXISTS main_chatmessage_search_gin",
+                ),
+            ],
+        ),
+    ]
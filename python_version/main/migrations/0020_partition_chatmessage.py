@@ -0,0 +1,118 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:31
+
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+from django.utils import timezone
+
+TABLE = 'main_chatmessage'
+LEGACY = 'main_chatmessage_legacy'
+MONTHS_AHEAD = 2
+
+
+def _add_months(moment, months):
+    month_index = moment.month - 1 + months
+    return moment.replace(year=moment.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_chat_messages(apps, schema_editor):
+    """
+    Monthly range partitioning by created_at (see main/chat_partitions.py).
+    The existing table is attached as-is as the partition holding everything
+    before the next month boundary, so no rows are copied. The primary key
+    becomes (id, created_at) because Postgres requires the partition key in it.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+    boundary = _add_months(
+        timezone.now().astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0), 1
+    )
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [TABLE, f'{TABLE}_pkey']
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE]
+        )
+        foreign_keys = cursor.fetchall()
+        # id identity mi (Django >= 4.1) yoksa eski serial mı?
+        cursor.execute(
+            "SELECT pg_get_serial_sequence(%s, 'id'), attidentity <> '' FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'id'",
+            [TABLE, TABLE]
+        )
+        sequence, is_identity = cursor.fetchone()
+        # ChatWriter'ın önceden ayırdığı id'ler de atlanmış olsun diye sequence'tan devam
+        cursor.execute(f'SELECT nextval(%s), (SELECT coalesce(max(id), 0) + 1 FROM "{TABLE}")', [sequence])
+        next_id = max(cursor.fetchone())
+
+    # 1. Eski tablo legacy partition olacak
+    execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+    execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+    execute(f'DROP TRIGGER IF EXISTS main_chatmessage_search_vector ON "{LEGACY}"')
+    for name, _definition in indexes:
+        execute(f'ALTER INDEX "{name}" RENAME TO "{name[:50]}_legacy"')
+    if is_identity:
+        # Identity'nin sequence'ı onunla birlikte düşer; aşağıda yenisi kurulur
+        execute(f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP IDENTITY')
+        sequence = f'"{TABLE}_id_seq"'
+    else:
+        # serial: sequence kalır ve ana tabloya devredilir
+        execute(f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP DEFAULT')
+    execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{TABLE}_pkey"')
+    execute(f'ALTER TABLE "{LEGACY}" ADD CONSTRAINT "{LEGACY}_pkey" PRIMARY KEY (id, created_at)')
+
+    # 2. Partition'lı ana tablo; id artık OWNED BY sequence'tan gelir (pg_get_serial_sequence çalışmaya devam eder)
+    execute(f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    execute(f'CREATE SEQUENCE IF NOT EXISTS {sequence}')
+    execute(f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE}".id')
+    execute('SELECT setval(%s, %s, false)', [sequence, int(next_id)])
+    execute(f"""ALTER TABLE "{TABLE}" ALTER COLUMN id SET DEFAULT nextval('{sequence}')""")
+    execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, created_at)')
+
+    execute(
+        f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY}" FOR VALUES FROM (MINVALUE) TO (%s)',
+        [boundary]
+    )
+    # Eşdeğer index ve FK'lar legacy'de zaten var; Postgres yeniden kurmadan bağlar
+    for _name, definition in indexes:
+        execute(definition)
+    for name, definition in foreign_keys:
+        execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+    execute(
+        f'CREATE TRIGGER main_chatmessage_search_vector BEFORE INSERT OR UPDATE OF content, language '
+        f'ON "{TABLE}" FOR EACH ROW EXECUTE FUNCTION main_chatmessage_search_vector()'
+    )
+
+    # 3. Önümüzdeki aylar ve güvenlik ağı
+    month = boundary
+    for _ in range(MONTHS_AHEAD):
+        upper = _add_months(month, 1)
+        execute(
+            f'CREATE TABLE "{TABLE}_p{month:%Y_%m}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+            [month, upper]
+        )
+        month = upper
+    execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_chatmessage_search'),
+    ]
+
+    operations = [
+        # Geri alma: model durumu değişmiyor, partition'lı tablo eski kodla da çalışır
+        migrations.RunPython(partition_chat_messages, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='server',
+            name='message_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text="Delete chat messages older than this many days (empty: CHAT_PARTITIONS['retention_days'])", null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_pending_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voicechannel',
+            name='sfu_enabled',
+            field=models.BooleanField(default=False, help_text='Forward media through the server-side SFU instead of a peer-to-peer mesh'),
+        ),
+        migrations.AddField(
+            model_name='voicechannel',
+            name='sfu_threshold',
+            field=models.PositiveIntegerField(default=0, help_text='Switch the room to the SFU once this many users are in it (0 = always)'),
+        ),
+    ]
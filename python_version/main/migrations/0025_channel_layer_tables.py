@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:58
+
+from django.db import migrations, models
+
+LAYER_TABLES = ('main_channellayergroup', 'main_channellayermessage')
+
+
+def set_unlogged(apps, schema_editor):
+    # Kanal katmanı verisi geçici: WAL'a yazılmaz, çökmede boşalması sorun değil
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in LAYER_TABLES:
+        schema_editor.execute(f'ALTER TABLE {table} SET UNLOGGED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_voicechannel_sfu'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLayerGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_name', models.CharField(max_length=100)),
+                ('channel_name', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='main_channe_expires_a2dde5_idx')],
+                'unique_together': {('group_name', 'channel_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ChannelLayerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_name', models.CharField(max_length=100)),
+                ('payload', models.TextField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['channel_name', 'id'], name='main_channe_channel_e65436_idx'), models.Index(fields=['expires_at'], name='main_channe_expires_b19093_idx')],
+            },
+        ),
+        migrations.RunPython(set_unlogged, migrations.RunPython.noop),
+    ]
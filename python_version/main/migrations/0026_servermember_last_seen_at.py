@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:30
+
+from django.db import migrations, models
+
+
+def reset_online(apps, schema_editor):
+    # Eski join_server her üyeliği çevrimiçi yazıyordu; çalışan süreçler kendi kullanıcılarını ilk flush'ta geri yazar
+    ServerMember = apps.get_model('main', 'ServerMember')
+    ServerMember.objects.filter(is_online=True).update(is_online=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0025_channel_layer_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servermember',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(reset_online, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:40
+
+from django.db import migrations
+
+
+def seed_read_states(apps, schema_editor):
+    # Üyenin hiç açmadığı kanallar için de satır olsun ki yeni mesajlar rozet göstersin
+    ChannelReadState = apps.get_model('main', 'ChannelReadState')
+    ServerMember = apps.get_model('main', 'ServerMember')
+    TextChannel = apps.get_model('main', 'TextChannel')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'INSERT INTO {ChannelReadState._meta.db_table} (user_id, channel_id, unread_count, updated_at) '
+            f'SELECT m.user_id, c.id, 0, now() FROM {ServerMember._meta.db_table} m '
+            f'JOIN {TextChannel._meta.db_table} c ON c.server_id = m.server_id '
+            f'ON CONFLICT (user_id, channel_id) DO NOTHING'
+        )
+        return
+    for member in ServerMember.objects.all().iterator():
+        ChannelReadState.objects.bulk_create(
+            [
+                ChannelReadState(user_id=member.user_id, channel_id=channel_id)
+                for channel_id in TextChannel.objects.filter(server_id=member.server_id).values_list('id', flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0026_servermember_last_seen_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:49
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_read_at(apps, schema_editor):
+    # Okunan mesaj silinmişse işaretin yazıldığı an kullanılır
+    ChannelReadState = apps.get_model('main', 'ChannelReadState')
+    ChatMessage = apps.get_model('main', 'ChatMessage')
+    read_at = ChatMessage.objects.filter(
+        channel_id=OuterRef('channel_id'), id=OuterRef('last_read_message_id')
+    ).values('created_at')[:1]
+    ChannelReadState.objects.filter(last_read_message_id__isnull=False).update(
+        last_read_at=Coalesce(Subquery(read_at), F('updated_at'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_seed_channel_read_states'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channelreadstate',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_read_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0028_channelreadstate_last_read_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='channellayermessage',
+            name='main_channe_channel_e65436_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='channellayergroup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='channellayergroup',
+            name='layer',
+            field=models.CharField(default='channel_layer', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='channellayermessage',
+            name='layer',
+            field=models.CharField(default='channel_layer', max_length=50),
+        ),
+        migrations.AlterUniqueTogether(
+            name='channellayergroup',
+            unique_together={('layer', 'group_name', 'channel_name')},
+        ),
+        migrations.AddIndex(
+            model_name='channellayermessage',
+            index=models.Index(fields=['layer', 'channel_name', 'id'], name='main_channe_layer_a8f96f_idx'),
+        ),
+    ]
@@ -1,15 +1,102 @@
 # kullanicilar/models.py
 from django.conf import settings
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
+import json
 import uuid
-from django.db.models import JSONField
+import zlib
+from django.db.models import F, JSONField
+from django.dispatch import Signal
 from django.template.defaultfilters import truncatechars
+from django.utils import timezone
 from django.utils.text import slugify
 
+from .chat_render import RENDER_VERSION, render_message
 
-class CustomUser(AbstractUser):
+
+# request_deletion() save() çağırmaz; post_save yerine bunu gönderir (sender=model, instance=satır)
+deletion_requested = Signal()
+
+
+class ActiveManager(models.Manager):
+    """Default manager: hides rows waiting for the deletion worker (see PendingDeletionModel)."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deletion_requested_at__isnull=True)
+
+
+class ServerChannelManager(models.Manager):
+    """Default manager of channels: hides the channels of servers waiting for deletion."""
+
+    def get_queryset(self):
+        # LEFT JOIN: sunucusuz eski kanallar da gelir
+        return super().get_queryset().filter(server__deletion_requested_at__isnull=True)
+
+
+class ActiveChannelManager(ServerChannelManager):
+    """ServerChannelManager that also hides channels waiting for deletion themselves."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deletion_requested_at__isnull=True)
+
+
+class ActiveUserManager(UserManager):
+    """UserManager that hides users waiting for deletion; they can no longer log in either."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deletion_requested_at__isnull=True)
+
+
+class PendingDeletionModel(models.Model):
+    """
+    Deleting a big server, channel or user in one transaction would cascade
+    through millions of rows. Instead the row is only marked here: `objects`
+    stops returning it right away, and the process_deletions command removes
+    its dependents in small batches before deleting the row itself.
+    `all_objects` still sees marked rows.
+
+    Unique fields listed in release_on_deletion are renamed to
+    "<value>~deleted~<pk>" when the row is marked, so the name can be used
+    again right away instead of failing with IntegrityError until the purge.
+    """
+    deletion_requested_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+    release_on_deletion = ()
+
+    class Meta:
+        abstract = True
+
+    @property
+    def is_pending_deletion(self):
+        return self.deletion_requested_at is not None
+
+    def _released_values(self):
+        suffix = f'~deleted~{self.pk}'
+        released = {}
+        for name in self.release_on_deletion:
+            value = getattr(self, name)
+            max_length = self._meta.get_field(name).max_length
+            released[name] = f'{value[:max_length - len(suffix)]}{suffix}'
+        return released
+
+    def request_deletion(self):
+        now = timezone.now()
+        released = self._released_values()
+        marked = type(self).all_objects.filter(pk=self.pk, deletion_requested_at__isnull=True).update(
+            deletion_requested_at=now, **released
+        )
+        self.deletion_requested_at = self.deletion_requested_at or now
+        # Alıcılar (ör. channel_access) eski adı/slug'ı görsün; yeni değerler sonra atanır
+        deletion_requested.send(sender=type(self), instance=self)
+        if marked:
+            for name, value in released.items():
+                setattr(self, name, value)
+
+
+class CustomUser(AbstractUser, PendingDeletionModel):
     # AbstractUser, username, first_name, last_name, email, is_staff, is_active, date_joined gibi alanları zaten içerir.
 
     rank_point = models.PositiveIntegerField(null=True, blank=True, default=0)
@@ -23,6 +110,17 @@ class CustomUser(AbstractUser):
     # }
     per_game_stats = JSONField(default=dict, verbose_name="Oyun Bazlı İstatistikler")
     user_settings = JSONField(default=dict, verbose_name="Kullanıcı Ayarları")
+
+    objects = ActiveUserManager()
+    all_objects = UserManager()
+
+    release_on_deletion = ('username',)
+
+    def request_deletion(self):
+        super().request_deletion()
+        # Sahip olduğu sunucular da kullanıcıyla birlikte gider (adları da serbest kalır)
+        for server in Server.objects.filter(owner=self):
+            server.request_deletion()
     
     @property
     def win_rate(self):
@@ -51,7 +149,7 @@ class CustomUser(AbstractUser):
         return self.username
 
 
-class Server(models.Model):
+class Server(PendingDeletionModel):
     """Servers contain channels, roles, and members"""
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(unique=True)
@@ -59,9 +157,18 @@ class Server(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='owned_servers')
     icon = models.CharField(max_length=100, blank=True, null=True, help_text="Icon name or emoji")
     is_private = models.BooleanField(default=False)
+    message_retention_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Delete chat messages older than this many days (empty: CHAT_PARTITIONS['retention_days'])"
+    )
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
+    release_on_deletion = ('name', 'slug')
+
     class Meta:
         ordering = ['name']
 
@@ -99,6 +206,8 @@ class ServerMember(models.Model):
     nickname = models.CharField(max_length=100, blank=True, null=True)
     joined_at = models.DateTimeField(auto_now=True)
     is_online = models.BooleanField(default=False)
+    # presence'ın son damgası; eskiyen is_online=True satırları bununla düzeltilir
+    last_seen_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('server', 'user')
@@ -111,7 +220,7 @@ class ServerMember(models.Model):
         return self.nickname or self.user.username
 
 
-class TextChannel(models.Model):
+class TextChannel(PendingDeletionModel):
     """Text channels for chat messages"""
     server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name='text_channels', null=True, blank=True)
     name = models.CharField(max_length=100)
@@ -121,6 +230,9 @@ class TextChannel(models.Model):
     is_private = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now=True)
 
+    objects = ActiveChannelManager()
+    all_objects = models.Manager()
+
     class Meta:
         ordering = ['position', 'name']
         # Remove unique_together since server can be null - slug uniqueness will be handled at application level
@@ -143,9 +255,15 @@ class VoiceChannel(models.Model):
     description = models.TextField(blank=True, null=True)
     position = models.IntegerField(default=0)
     user_limit = models.IntegerField(default=0, help_text="0 = unlimited")
+    # Büyük odalarda medya sunucu tarafı SFU üzerinden iletilir (main/sfu.py, aiortc gerekir)
+    sfu_enabled = models.BooleanField(default=False, help_text="Forward media through the server-side SFU instead of a peer-to-peer mesh")
+    sfu_threshold = models.PositiveIntegerField(default=0, help_text="Switch the room to the SFU once this many users are in it (0 = always)")
     is_private = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now=True)
 
+    objects = ServerChannelManager()
+    all_objects = models.Manager()
+
     class Meta:
         ordering = ['position', 'name']
         # Remove unique_together since server can be null - slug uniqueness will be handled at application level
@@ -165,13 +283,25 @@ class ChatMessage(models.Model):
     channel = models.ForeignKey(TextChannel, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_messages')
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now=True)
+    # auto_now değil: ChatWriter zaman damgasını yayından önce kendisi atar
+    created_at = models.DateTimeField(default=timezone.now)
     edited_at = models.DateTimeField(null=True, blank=True)
+    # Yazarın dili (settings.LANGUAGES); arama hangi kök bulma kurallarının kullanılacağını buradan seçer
+    language = models.CharField(max_length=10, default=settings.LANGUAGE_CODE)
+    # Postgres trigger'ı doldurur (bkz. chat_search), elle yazılmaz
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Yazım anında bir kez üretilir (bkz. chat_render); okuyucular hazır HTML alır
+    rendered_content = models.TextField(blank=True, default='', editable=False)
+    mentions = models.JSONField(default=list, blank=True, editable=False)
+    links = models.JSONField(default=list, blank=True, editable=False)
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['created_at']
         indexes = [
-            models.Index(fields=['channel', 'created_at']),
+            # Keyset sayfalama (created_at, id) sırasıyla bu index'i kullanır
+            models.Index(fields=['channel', 'created_at', 'id']),
+            GinIndex(fields=['search_vector'], name='main_chatmessage_search_gin'),
         ]
 
     def __str__(self):
@@ -179,7 +309,81 @@ class ChatMessage(models.Model):
             return f"{self.user.username} in #{self.channel.name}: {self.content[:50]}"
         return f"{self.user.username}: {self.content[:50]}"
 
+    RENDERED_FIELDS = ('rendered_content', 'mentions', 'links', 'render_version')
 
+    def render(self):
+        """Fills the rendered fields from content."""
+        rendered = render_message(self.content)
+        self.rendered_content = rendered['html']
+        self.mentions = rendered['mentions']
+        self.links = rendered['links']
+        self.render_version = RENDER_VERSION
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.render()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.RENDERED_FIELDS)
+        super().save(*args, **kwargs)
+
+
+
+
+class ChannelReadState(models.Model):
+    """
+    How far a user has read a text channel. unread_count is maintained
+    incrementally (see main/read_state.py) so unread badges never need COUNT
+    queries over the message table.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='channel_read_states')
+    channel = models.ForeignKey(TextChannel, on_delete=models.CASCADE, related_name='read_states')
+    # FK değil: ChatMessage partition'lı tablo, PK'sı (id, created_at)
+    last_read_message_id = models.BigIntegerField(null=True, blank=True)
+    # Okunan mesajın created_at'i; sıra (created_at, id), id'ler süreçlere blok blok dağıtılır
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # (user, channel) unique index'i sunucu başına tek sorguluk okunmamış listesini de karşılar
+        unique_together = ('user', 'channel')
+
+    def __str__(self):
+        return f"{self.user.username} in #{self.channel.name}: {self.unread_count} unread"
+
+
+class ChannelLayerMessage(models.Model):
+    """
+    Postgres channel layer (main/pg_layer.py): payloads too big for a NOTIFY
+    and messages for shared (not process-specific) channels. UNLOGGED table;
+    rows are deleted when read or once expired.
+    """
+    # Katmanın prefix'i: aynı tabloları kullanan CHANNEL_LAYERS takma adları birbirine karışmaz
+    layer = models.CharField(max_length=50, default='channel_layer')
+    channel_name = models.CharField(max_length=100)
+    payload = models.TextField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Paylaşılan kanaldan sıradaki mesajı alma (FOR UPDATE SKIP LOCKED)
+            models.Index(fields=['layer', 'channel_name', 'id']),
+            models.Index(fields=['expires_at']),
+        ]
+
+
+class ChannelLayerGroup(models.Model):
+    """Group memberships of the Postgres channel layer; refreshed by group_add, dropped after group_expiry."""
+    layer = models.CharField(max_length=50, default='channel_layer')
+    group_name = models.CharField(max_length=100)
+    channel_name = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        # group_send bu unique index'in (layer, group_name, ...) önekiyle okur
+        unique_together = ('layer', 'group_name', 'channel_name')
+        indexes = [models.Index(fields=['expires_at'])]
 
 
 # 5x5'lik boş bir tahta oluşturan varsayılan fonksiyon
@@ -212,6 +416,10 @@ class MiniGame(models.Model):
         return self.name
 
 
+class StaleGameSession(Exception):
+    """A compare-and-swap write lost against a concurrent GameSession update."""
+
+
 class GameSession(models.Model):
     game_type = models.ForeignKey(
         MiniGame,
@@ -248,8 +456,12 @@ class GameSession(models.Model):
     current_turn = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
     winner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='games_won', on_delete=models.CASCADE, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Her kayıtta güncellenir; terk edilmiş masaları bulmak için kullanılır
+    last_activity_at = models.DateTimeField(auto_now=True, verbose_name="Son Aktivite")
     move_count = models.PositiveIntegerField(default=0, verbose_name="Hamle Sayısı")
+    # Tekrar oynatma için hamleler: [[username, row, col], ...]
+    move_log = models.JSONField(default=list, blank=True, verbose_name="Hamle Kaydı")
     eliminated_players = models.JSONField(default=list, verbose_name="Elenmiş Oyuncular")
     finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Bitiş Zamanı")
     is_private = models.BooleanField(default=False, verbose_name="Özel Oda")
@@ -261,6 +473,45 @@ class GameSession(models.Model):
         blank=True,
         related_name='rematch_children'
     )
+    # Her yazmada artar; iyimser eşzamanlılık (compare-and-swap) için
+    version = models.PositiveIntegerField(default=0, verbose_name="Sürüm")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'last_activity_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Var olan satıra düz save() de CAS ile yazar: eski bir kopya sessizce üzerine yazamaz
+        if self._state.adding or kwargs.get('force_insert'):
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        # save_if_unchanged sürümü ve last_activity_at'i kendisi yazar
+        self.save_if_unchanged([name for name in update_fields if name not in ('version', 'last_activity_at')])
+
+    def save_if_unchanged(self, update_fields):
+        """
+        Compare-and-swap save: writes update_fields (plus version and
+        last_activity_at) only if the row still has the version this instance
+        was loaded with. Raises StaleGameSession when another writer got there
+        first; no row lock is held while the caller computes the new state.
+        """
+        values = {}
+        for name in update_fields:
+            field = self._meta.get_field(name)
+            values[field.attname] = getattr(self, field.attname)
+        now = timezone.now()
+        updated = GameSession.objects.filter(pk=self.pk, version=self.version).update(
+            version=F('version') + 1,
+            last_activity_at=now,
+            **values
+        )
+        if not updated:
+            raise StaleGameSession(f"GameSession {self.pk} changed since version {self.version}")
+        self.version += 1
+        self.last_activity_at = now
 
     @property
     def player_count(self):
@@ -277,4 +528,107 @@ class GameSession(models.Model):
     def __str__(self):
         id_str = str(self.game_id)
         truncated_id = truncatechars(id_str, 8)
-        return f"Masa {truncated_id}"
\ No newline at end of file
+        return f"Masa {truncated_id}"
+
+
+class GameArchive(models.Model):
+    """
+    Compact cold storage for finished GameSessions.
+    Rows are written by main.maintenance.archive_finished_games and the hot
+    GameSession row (board, M2M players, eliminated list) is deleted.
+    """
+    # Arşivdeki oyunlar her zaman bitmiş oyunlardır (game_room şablonu için)
+    status = 'finished'
+    current_turn = None
+
+    game_id = models.UUIDField(primary_key=True, editable=False)
+    game_type = models.ForeignKey(
+        MiniGame,
+        on_delete=models.PROTECT,
+        related_name='archived_sessions',
+        null=True
+    )
+    host = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='+',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    winner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='archived_games_won',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    # [{"id": 1, "username": "adem"}, ...]
+    players = models.JSONField(default=list, verbose_name="Oyuncular")
+    board_size = models.PositiveSmallIntegerField(default=5, verbose_name="Tahta Boyutu (N x N)")
+    move_count = models.PositiveIntegerField(default=0, verbose_name="Hamle Sayısı")
+    # zlib ile sıkıştırılmış son tahta durumu (JSON)
+    final_board = models.BinaryField(verbose_name="Son Tahta")
+    # zlib ile sıkıştırılmış hamle kaydı (GameSession.move_log)
+    moves = models.BinaryField(default=b'', verbose_name="Hamleler")
+    created_at = models.DateTimeField(verbose_name="Oluşturulma Tarihi")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Bitiş Zamanı")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Arşivlenme Zamanı")
+
+    class Meta:
+        verbose_name = "Arşivlenmiş Oyun"
+        verbose_name_plural = "Arşivlenmiş Oyunlar"
+        ordering = ['-finished_at']
+        indexes = [
+            models.Index(fields=['game_type', 'finished_at']),
+        ]
+
+    @staticmethod
+    def compress(data):
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+    @staticmethod
+    def decompress(blob, empty=None):
+        if not blob:
+            return {} if empty is None else empty
+        return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+
+    @classmethod
+    def from_session(cls, game):
+        """Builds (does not save) the archive row for a finished GameSession."""
+        return cls(
+            game_id=game.game_id,
+            game_type_id=game.game_type_id,
+            host_id=game.host_id,
+            winner_id=game.winner_id,
+            players=[{'id': p.id, 'username': p.username} for p in game.players.all()],
+            board_size=game.board_size,
+            move_count=game.move_count,
+            final_board=cls.compress(game.board_state or {}),
+            moves=cls.compress(game.move_log or []),
+            created_at=game.created_at,
+            finished_at=game.finished_at or game.last_activity_at,
+        )
+
+    @property
+    def board_state(self):
+        return self.decompress(self.final_board)
+
+    @property
+    def move_log(self):
+        return self.decompress(self.moves, empty=[])
+
+    @property
+    def player_usernames(self):
+        return [p['username'] for p in self.players]
+
+    def has_player(self, user):
+        return any(p['id'] == user.id for p in self.players)
+
+    @property
+    def duration(self):
+        if not self.finished_at:
+            return None
+        return self.finished_at - self.created_at
+
+    def __str__(self):
+        return f"Arşiv {truncatechars(str(self.game_id), 8)}"
@@ -0,0 +1,179 @@
+"""
+One WebSocket per client carrying several streams (ws/mux/).
+
+Client frames:
+    {"action": "subscribe", "stream": "<id>", "path": "/ws/voice/?channel_slug=...&channel_type=text"}
+    {"action": "unsubscribe", "stream": "<id>"}
+    {"stream": "<id>", "text": "<frame for that stream>"}
+Server frames:
+    {"stream": "<id>", "event": "accept"}
+    {"stream": "<id>", "event": "close", "code": <int>}
+    {"stream": "<id>", "text": "<frame from that stream>"}
+
+A stream runs whatever consumer its path routes to in
+routing.stream_urlpatterns (VoiceChatConsumer, GameConsumer_DiceWars) as an
+inner ASGI app. It gets the outer scope, with user and session already
+resolved once by AuthMiddlewareStack, plus its own path and query string
+and its own channel layer name, and sees the usual websocket.connect /
+receive / disconnect events; the consumers need no changes.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.routing import URLRouter
+from django.conf import settings
+
+logger = logging.getLogger('main')
+
+MULTIPLEX_DEFAULTS = {
+    'max_streams': 16,
+}
+
+# Akışa özel kapanış kodları
+CLOSE_NO_ROUTE = 4004
+CLOSE_TOO_MANY_STREAMS = 4008
+CLOSE_INTERNAL_ERROR = 1011
+
+
+def get_multiplex_config():
+    config = dict(MULTIPLEX_DEFAULTS)
+    config.update(getattr(settings, 'WEBSOCKET_MULTIPLEX', {}))
+    return config
+
+
+_router = None
+
+
+def _stream_router():
+    # routing bu modülü içe aktarır; döngüye girmemek için ilk kullanımda kurulur
+    global _router
+    if _router is None:
+        from .routing import stream_urlpatterns
+        _router = URLRouter(stream_urlpatterns)
+    return _router
+
+
+class _Stream:
+    __slots__ = ('queue', 'task', 'accepted', 'closed')
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.accepted = False
+        self.closed = False
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    # Dış bağlantının kendi kanalı yok; grupları iç consumer'lar kullanır
+    channel_layer_alias = None
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.close()
+            return
+        self.streams = {}
+        self.max_streams = get_multiplex_config()['max_streams']
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        streams = list(getattr(self, 'streams', {}))
+        # İç consumer'lar kendi disconnect'lerini (grup çıkışı, kadro, presence) bitirsin
+        await asyncio.gather(*(self.end_stream(stream_id, close_code, notify=False) for stream_id in streams))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            frame = json.loads(text_data or '')
+        except ValueError:
+            return
+        if not isinstance(frame, dict) or not isinstance(frame.get('stream'), str) or not frame['stream']:
+            return
+        stream_id = frame['stream']
+        action = frame.get('action')
+
+        if action == 'subscribe':
+            await self.start_stream(stream_id, frame.get('path'))
+        elif action == 'unsubscribe':
+            await self.end_stream(stream_id, 1000)
+        elif isinstance(frame.get('text'), str):
+            stream = self.streams.get(stream_id)
+            if stream is not None and not stream.closed:
+                stream.queue.put_nowait({'type': 'websocket.receive', 'text': frame['text']})
+
+    async def start_stream(self, stream_id, path):
+        if stream_id in self.streams:
+            return
+        if len(self.streams) >= self.max_streams:
+            await self.send_event(stream_id, 'close', code=CLOSE_TOO_MANY_STREAMS)
+            return
+        if not isinstance(path, str) or not path.startswith('/'):
+            await self.send_event(stream_id, 'close', code=CLOSE_NO_ROUTE)
+            return
+
+        parts = urlsplit(path)
+        scope = dict(self.scope, path=parts.path, raw_path=parts.path.encode('utf-8'), query_string=parts.query.encode('utf-8'))
+        scope.pop('url_route', None)
+        scope.pop('path_remaining', None)
+
+        stream = self.streams[stream_id] = _Stream()
+        stream.queue.put_nowait({'type': 'websocket.connect'})
+        stream.task = asyncio.create_task(self.run_stream(stream_id, stream, scope))
+
+    async def run_stream(self, stream_id, stream, scope):
+        async def send(message):
+            await self.from_stream(stream_id, stream, message)
+
+        try:
+            await _stream_router()(scope, stream.queue.get, send)
+        except Exception as e:
+            if not stream.accepted and isinstance(e, ValueError):
+                # URLRouter: bu yol için route yok
+                code = CLOSE_NO_ROUTE
+            else:
+                logger.error(f"Multiplexed stream {scope['path']} failed: {e}")
+                code = CLOSE_INTERNAL_ERROR
+            if not stream.closed:
+                stream.closed = True
+                await self.send_event(stream_id, 'close', code=code)
+        finally:
+            if self.streams.get(stream_id) is stream:
+                del self.streams[stream_id]
+
+    async def from_stream(self, stream_id, stream, message):
+        """The inner consumer's ASGI send()."""
+        if message['type'] == 'websocket.accept':
+            stream.accepted = True
+            await self.send_event(stream_id, 'accept')
+        elif message['type'] == 'websocket.send':
+            if message.get('text') is not None and not stream.closed:
+                await self.send(text_data=json.dumps({'stream': stream_id, 'text': message['text']}))
+        elif message['type'] == 'websocket.close':
+            if not stream.closed:
+                stream.closed = True
+                code = message.get('code') or 1000
+                await self.send_event(stream_id, 'close', code=code)
+                # Gerçek bir sunucu gibi: kapatılan bağlantının consumer'ı disconnect alır
+                stream.queue.put_nowait({'type': 'websocket.disconnect', 'code': code})
+
+    async def end_stream(self, stream_id, code, notify=True):
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return
+        if not stream.closed:
+            stream.closed = True
+            stream.queue.put_nowait({'type': 'websocket.disconnect', 'code': code})
+            if notify:
+                await self.send_event(stream_id, 'close', code=code)
+        try:
+            await asyncio.wait_for(asyncio.shield(stream.task), 5)
+        except asyncio.TimeoutError:
+            logger.warning(f"Multiplexed stream {stream_id} did not finish its disconnect; cancelling")
+            stream.task.cancel()
+        except Exception:
+            # run_stream hatayı zaten bildirdi
+            pass
+
+    async def send_event(self, stream_id, event, **extra):
+        await self.send(text_data=json.dumps({'stream': stream_id, 'event': event, **extra}))
@@ -0,0 +1,472 @@
+"""
+Channel layer on PostgreSQL LISTEN/NOTIFY, so several Daphne processes (on
+one or more hosts) can share groups without running Redis.
+
+    CHANNEL_LAYERS = {"default": {
+        "BACKEND": "main.pg_layer.PostgresChannelLayer",
+        "CONFIG": {"expiry": 60, "group_expiry": 86400, "capacity": 100},
+    }}
+
+- Every layer instance (one per process) LISTENs on its own Postgres
+  channel. Process-specific channel names (new_channel) carry that
+  instance's id, so send() is a single pg_notify to the owning process;
+  channels of this process are delivered in memory without Postgres.
+- Group memberships live in ChannelLayerGroup. group_send reads the members
+  and sends one NOTIFY per process, listing that process's channels.
+- A payload over the NOTIFY limit (8000 bytes) is written once to
+  ChannelLayerMessage and the NOTIFY only carries its id; so is a
+  process's channel list when a big group would not fit either.
+- Shared channel names (no "!", e.g. worker channels) are queued in
+  ChannelLayerMessage; receivers claim rows with FOR UPDATE SKIP LOCKED,
+  woken by a NOTIFY on the layer's shared Postgres channel.
+- Rows carry the layer's `prefix`, so several CHANNEL_LAYERS aliases
+  (e.g. "default" and "ephemeral") can share the tables; give each alias
+  its own prefix. flush() only deletes this layer's rows.
+- Messages older than `expiry` are dropped, memberships expire after
+  `group_expiry`. Capacity is enforced where the queue lives: sends to
+  local or shared channels raise ChannelFull; a remote process drops what
+  its full channel buffer cannot hold (like group_send on other layers).
+
+The layer uses its own psycopg2 connections (from DATABASES[database]): one
+for LISTEN, polled on the event loop, and a small thread pool for queries.
+"""
+import asyncio
+import copy
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.db import connections
+
+from .layer_codec import channel_owner, decode_message, encode_message, new_layer_id, specific_channel_name
+from .models import ChannelLayerGroup, ChannelLayerMessage
+
+logger = logging.getLogger('main')
+
+# Postgres NOTIFY yükü 8000 baytla sınırlı; zarf için pay bırakılır
+NOTIFY_LIMIT = 7900
+# Paylaşılan kanallarda kaçırılan bir NOTIFY'a karşı yoklama aralığı
+SHARED_POLL_SECONDS = 1
+# LISTEN bağlantısı koparsa yeniden bağlanma bekleme aralığı (üstel artar)
+RECONNECT_MIN_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 10
+
+MESSAGES = ChannelLayerMessage._meta.db_table
+GROUPS = ChannelLayerGroup._meta.db_table
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 database='default', prefix='channel_layer', pool_size=2, cleanup_interval=60, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.database = database
+        self.cleanup_interval = cleanup_interval
+        self.prefix = prefix
+        self.client_id = new_layer_id()
+        self.listen_channel = f'{prefix}_{self.client_id}'
+        self.shared_channel = f'{prefix}_shared'
+        self.dropped = 0
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='pg-layer')
+        self._local = threading.local()
+        self._queues = {}  # bu süreçteki kanal -> asyncio.Queue of (expires, message)
+        self._shared_waiters = {}  # paylaşılan kanal -> asyncio.Event
+        self._loop = None
+        self._ready = None
+        self._listener = None
+        self._listener_fd = None
+        self._cleanup_task = None
+        self._tasks = []
+
+    # --- Bağlantılar ---
+
+    def _connect(self):
+        connection = psycopg2.connect(**connections[self.database].get_connection_params())
+        connection.set_session(autocommit=True)
+        return connection
+
+    def _cursor(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or connection.closed:
+            connection = self._local.connection = self._connect()
+        return connection.cursor()
+
+    def _query(self, function, *args):
+        """Runs function(cursor, *args) on a pool thread; reconnects once if the connection dropped."""
+        def run():
+            try:
+                with self._cursor() as cursor:
+                    return function(cursor, *args)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                connection = getattr(self._local, 'connection', None)
+                if connection is not None:
+                    connection.close()
+                with self._cursor() as cursor:
+                    return function(cursor, *args)
+
+        return asyncio.get_running_loop().run_in_executor(self._pool, run)
+
+    async def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # İlk kullanım ya da yeni event loop (ör. testlerde asyncio.run): yerel durum sıfırlanır
+            self._close_listener()
+            self._queues = {}
+            self._shared_waiters = {}
+            self._loop = loop
+            self._ready = loop.create_task(self._listen())
+        elif self._ready.done() and (self._ready.cancelled() or self._ready.exception() is not None):
+            # Önceki bağlanma denemesi başarısız oldu; kuyruklar korunur
+            self._ready = loop.create_task(self._listen())
+        await asyncio.shield(self._ready)
+
+    async def _listen(self):
+        listener = await asyncio.get_running_loop().run_in_executor(self._pool, self._connect)
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.listen_channel}"; LISTEN "{self.shared_channel}"')
+        self._listener = listener
+        # Bağlantı kopunca fileno() hata verir; reader bu numarayla kaldırılır
+        self._listener_fd = listener.fileno()
+        self._loop.add_reader(self._listener_fd, self._on_notify)
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = self._loop.create_task(self._cleanup_loop())
+            self._tasks.append(self._cleanup_task)
+
+    async def _relisten(self):
+        """Reconnects the listener after it lost its connection, with backoff."""
+        task = asyncio.current_task()
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                await self._listen()
+            except (psycopg2.Error, OSError) as e:
+                logger.error(f"Channel layer listener could not reconnect: {e}; retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+            else:
+                logger.info("Channel layer listener reconnected")
+                # Kesinti sırasında bırakılmış paylaşılan mesajlar için bekleyenleri uyandır
+                for waiter in self._shared_waiters.values():
+                    waiter.set()
+                if task in self._tasks:
+                    self._tasks.remove(task)
+                return
+
+    def _drop_listener(self):
+        if self._listener is not None:
+            try:
+                if self._loop is not None and not self._loop.is_closed():
+                    self._loop.remove_reader(self._listener_fd)
+                self._listener.close()
+            except (psycopg2.Error, OSError, ValueError):
+                pass
+            self._listener = None
+
+    def _close_listener(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._cleanup_task = None
+        self._drop_listener()
+
+    def _on_notify(self):
+        try:
+            self._listener.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Channel layer listener lost its connection: {e}")
+            # Kuyruklar ve bekleyen receive()'ler yerinde kalır; yalnız LISTEN bağlantısı yenilenir.
+            # Kesinti sırasında gönderilen NOTIFY'lar kaybolur (expiry içinde tekrar gönderilmezler).
+            self._drop_listener()
+            self._ready = self._loop.create_task(self._relisten())
+            self._tasks.append(self._ready)
+            return
+        notifies = self._listener.notifies
+        while notifies:
+            notify = notifies.pop(0)
+            if notify.channel == self.shared_channel:
+                waiter = self._shared_waiters.get(notify.payload)
+                if waiter is not None:
+                    waiter.set()
+            else:
+                try:
+                    self._dispatch(decode_message(notify.payload))
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Malformed channel layer notification: {e}")
+
+    def _dispatch(self, envelope):
+        if envelope['e'] < time.time():
+            return
+        if 's' in envelope:
+            # Büyük mesaj tabloda; okununca dağıtılır
+            self._tasks.append(self._loop.create_task(self._fetch_spilled(envelope)))
+            return
+        for channel in envelope['c']:
+            self._deliver(channel, envelope['e'], envelope['m'], copy_message=len(envelope['c']) > 1)
+
+    async def _fetch_spilled(self, envelope):
+        task = asyncio.current_task()
+        try:
+            payload, channels = await self._query(_read_spilled, envelope['s'], envelope['k'], envelope.get('l'))
+            channels = envelope.get('c', channels)
+            if payload is not None and channels:
+                message = decode_message(payload)
+                for channel in channels:
+                    self._deliver(channel, envelope['e'], message, copy_message=len(channels) > 1)
+        except Exception as e:
+            logger.error(f"Could not read spilled channel layer message {envelope['s']}: {e}")
+        finally:
+            if task in self._tasks:
+                self._tasks.remove(task)
+
+    def _deliver(self, channel, expires, message, copy_message=False):
+        queue = self._queues.get(channel)
+        if queue is None:
+            # Kanalın consumer'ı gitmiş
+            return False
+        if queue.full():
+            self.dropped += 1
+            return False
+        queue.put_nowait((expires, copy.deepcopy(message) if copy_message else message))
+        return True
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self._query(_delete_expired)
+            except Exception as e:
+                logger.error(f"Channel layer cleanup failed: {e}")
+
+    # --- Kanal adları ---
+
+    def _listen_channel_of(self, client_id):
+        return f'{self.listen_channel[:-len(self.client_id)]}{client_id}'
+
+    async def new_channel(self, prefix='specific'):
+        await self._ensure_listener()
+        channel = specific_channel_name(prefix, self.client_id)
+        self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return channel
+
+    # --- Kanal katmanı API'si ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._ensure_listener()
+        expires = time.time() + self.expiry
+        owner = channel_owner(channel)
+        if owner == self.client_id:
+            queue = self._queues.get(channel)
+            if queue is not None and queue.full():
+                raise ChannelFull(channel)
+            self._deliver(channel, expires, copy.deepcopy(message))
+        elif owner is not None:
+            await self._query(self._notify, {owner: [channel]}, message, expires)
+        elif not await self._query(self._enqueue_shared, [channel], encode_message(message), expires,
+                                   self.get_capacity(channel)):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self._ensure_listener()
+        if '!' in channel:
+            queue = self._queues.get(channel)
+            if queue is None:
+                queue = self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+            try:
+                while True:
+                    expires, message = await queue.get()
+                    if expires >= time.time():
+                        return message
+            except asyncio.CancelledError:
+                # Consumer kapandı; boş kuyruğu bırak
+                if queue.empty() and self._queues.get(channel) is queue:
+                    del self._queues[channel]
+                raise
+
+        waiter = self._shared_waiters.setdefault(channel, asyncio.Event())
+        while True:
+            waiter.clear()
+            payload = await self._query(_claim_shared, self.prefix, channel)
+            if payload is not None:
+                return decode_message(payload)
+            try:
+                await asyncio.wait_for(waiter.wait(), SHARED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._query(_group_add, self.prefix, group, channel, self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._query(_group_discard, self.prefix, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._ensure_listener()
+        expires = time.time() + self.expiry
+        local = await self._query(self._group_send, group, message, expires)
+        for channel in local:
+            self._deliver(channel, expires, copy.deepcopy(message))
+
+    async def flush(self):
+        await self._query(_flush, self.prefix)
+        for queue in self._queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def close(self):
+        self._close_listener()
+        self._loop = None
+        self._pool.shutdown(wait=False)
+
+    # --- Havuz thread'lerinde çalışan sorgular ---
+
+    def _group_send(self, cursor, group, message, expires):
+        """Notifies every other process holding members of group; returns this process's members."""
+        cursor.execute(
+            f'SELECT channel_name FROM {GROUPS} WHERE layer = %s AND group_name = %s AND expires_at > now()',
+            [self.prefix, group],
+        )
+        by_owner = defaultdict(list)
+        shared = []
+        for (channel,) in cursor.fetchall():
+            owner = channel_owner(channel)
+            if owner is None:
+                shared.append(channel)
+            else:
+                by_owner[owner].append(channel)
+        local = by_owner.pop(self.client_id, [])
+        if by_owner:
+            self._notify(cursor, by_owner, message, expires)
+        if shared:
+            # Dolu paylaşılan kanal atlanır (group_send hata vermez)
+            self._enqueue_shared(cursor, shared, encode_message(message), expires, self.capacity)
+        return local
+
+    def _notify(self, cursor, targets, message, expires):
+        """
+        targets: {layer id: [channel, ...]}; one NOTIFY per process. A body
+        that does not fit is stored once for every process; a channel list
+        that still does not fit (big group) gets its own row.
+        """
+        body = encode_message(message)
+        body_id = None
+        listen_channels, payloads, spilled = [], [], []
+        for owner, channels in targets.items():
+            payload = f'{{"c":{json.dumps(channels)},"e":{expires},"m":{body}}}'
+            if len(payload.encode('utf-8')) > NOTIFY_LIMIT:
+                if body_id is None:
+                    body_id = _spill(cursor, self.prefix, channels[0], body, expires)
+                envelope = {'c': channels, 'e': expires, 's': body_id, 'k': True}
+                if len(json.dumps(envelope)) > NOTIFY_LIMIT:
+                    del envelope['c']
+                    envelope['l'] = _spill(cursor, self.prefix, channels[0], json.dumps(channels), expires)
+                spilled.append(envelope)
+                payload = envelope
+            listen_channels.append(self._listen_channel_of(owner))
+            payloads.append(payload)
+        for envelope in spilled:
+            # Birden çok süreç okuyacaksa gövde satırı silinmez, süresi dolunca temizlenir
+            envelope['k'] = len(spilled) > 1
+        payloads = [json.dumps(payload) if isinstance(payload, dict) else payload for payload in payloads]
+        cursor.execute(
+            'SELECT pg_notify(c, p) FROM unnest(%s::text[], %s::text[]) AS t(c, p)', [listen_channels, payloads]
+        )
+
+    def _enqueue_shared(self, cursor, channels, body, expires, capacity):
+        """Queues body on each shared channel with room left; returns False if any was full."""
+        cursor.execute(
+            f'SELECT channel_name, count(*) FROM {MESSAGES} '
+            f'WHERE layer = %s AND channel_name = ANY(%s) AND expires_at > now() GROUP BY channel_name',
+            [self.prefix, channels],
+        )
+        counts = dict(cursor.fetchall())
+        open_channels = [channel for channel in channels if counts.get(channel, 0) < capacity]
+        if open_channels:
+            cursor.execute(
+                f'INSERT INTO {MESSAGES} (layer, channel_name, payload, expires_at) '
+                f'SELECT %s, c, %s, to_timestamp(%s) FROM unnest(%s::text[]) AS t(c)',
+                [self.prefix, body, expires, open_channels],
+            )
+            cursor.execute(
+                'SELECT pg_notify(%s, c) FROM unnest(%s::text[]) AS t(c)', [self.shared_channel, open_channels]
+            )
+        return len(open_channels) == len(channels)
+
+
+def _spill(cursor, layer, channel, payload, expires):
+    cursor.execute(
+        f'INSERT INTO {MESSAGES} (layer, channel_name, payload, expires_at) '
+        f'VALUES (%s, %s, %s, to_timestamp(%s)) RETURNING id',
+        [layer, channel, payload, expires],
+    )
+    return cursor.fetchone()[0]
+
+
+def _read_spilled(cursor, message_id, keep, list_id=None):
+    """Returns (body, channel list) of a spilled NOTIFY; the list row is always deleted."""
+    if keep:
+        cursor.execute(f'SELECT payload FROM {MESSAGES} WHERE id = %s', [message_id])
+    else:
+        cursor.execute(f'DELETE FROM {MESSAGES} WHERE id = %s RETURNING payload', [message_id])
+    row = cursor.fetchone()
+    channels = None
+    if list_id is not None:
+        cursor.execute(f'DELETE FROM {MESSAGES} WHERE id = %s RETURNING payload', [list_id])
+        list_row = cursor.fetchone()
+        channels = json.loads(list_row[0]) if list_row else None
+    return (row[0] if row else None), channels
+
+
+def _claim_shared(cursor, layer, channel):
+    cursor.execute(
+        f'DELETE FROM {MESSAGES} WHERE id = ('
+        f'  SELECT id FROM {MESSAGES} WHERE layer = %s AND channel_name = %s AND expires_at > now()'
+        f'  ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED'
+        f') RETURNING payload',
+        [layer, channel],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _group_add(cursor, layer, group, channel, group_expiry):
+    cursor.execute(
+        f'INSERT INTO {GROUPS} (layer, group_name, channel_name, expires_at) '
+        f"VALUES (%s, %s, %s, now() + %s * interval '1 second') "
+        f'ON CONFLICT (layer, group_name, channel_name) DO UPDATE SET expires_at = EXCLUDED.expires_at',
+        [layer, group, channel, group_expiry],
+    )
+
+
+def _group_discard(cursor, layer, group, channel):
+    cursor.execute(
+        f'DELETE FROM {GROUPS} WHERE layer = %s AND group_name = %s AND channel_name = %s', [layer, group, channel]
+    )
+
+
+def _delete_expired(cursor):
+    cursor.execute(f'DELETE FROM {MESSAGES} WHERE expires_at <= now()')
+    cursor.execute(f'DELETE FROM {GROUPS} WHERE expires_at <= now()')
+
+
+def _flush(cursor, layer):
+    # Tablolar diğer takma adlarla ortak; sadece bu katmanın satırları
+    cursor.execute(f'DELETE FROM {MESSAGES} WHERE layer = %s', [layer])
+    cursor.execute(f'DELETE FROM {GROUPS} WHERE layer = %s', [layer])
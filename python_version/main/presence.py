@@ -0,0 +1,238 @@
+"""
+Heartbeat-based presence for server members.
+
+Every WebSocket connection (VoiceChatConsumer) refreshes its entry in the
+per-process PresenceTable on connect and on each heartbeat; an entry that
+misses heartbeats for ttl_seconds expires. A user is online while any of
+their connections is alive. The PresenceService task flushes only the
+changes to ServerMember.is_online with two bulk UPDATEs every
+flush_interval_seconds and pushes {online, offline} diffs to the
+presence_<server_id> group of every affected server.
+
+Each worker only knows its own connections, so a user who closes their last
+connection on one worker can briefly be written offline while still
+connected to another. On its first flush and every resync_every flushes
+each worker re-asserts its online users and stamps last_seen_at (an UPDATE
+that only touches rows that are wrong or getting old). The same flush
+reconciles: rows left is_online=True by a crashed worker, or written before
+presence existed, are not stamped by anyone and go offline once last_seen_at
+is older than stale_after_seconds (keep it well above resync_every *
+flush_interval_seconds).
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ServerMember
+
+logger = logging.getLogger('main')
+
+PRESENCE_DEFAULTS = {
+    'heartbeat_seconds': 30,
+    'ttl_seconds': 90,
+    'flush_interval_seconds': 5,
+    'resync_every': 12,
+    'stale_after_seconds': 300,
+}
+
+
+def get_presence_config():
+    config = dict(PRESENCE_DEFAULTS)
+    config.update(getattr(settings, 'PRESENCE', {}))
+    return config
+
+
+def presence_group(server_id):
+    return f'presence_{server_id}'
+
+
+class PresenceTable:
+    def __init__(self, ttl_seconds):
+        self.ttl = ttl_seconds
+        self._connections = defaultdict(dict)  # user_id -> {channel_name: expires_at}
+        self._changes = {}  # user_id -> online; son flush'tan beri
+        self._lock = threading.Lock()
+
+    def heartbeat(self, user_id, channel_name, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            connections = self._connections[user_id]
+            if not connections:
+                self._set_state(user_id, True)
+            connections[channel_name] = now + self.ttl
+
+    def disconnect(self, user_id, channel_name):
+        with self._lock:
+            connections = self._connections.get(user_id)
+            if connections is None:
+                return
+            connections.pop(channel_name, None)
+            if not connections:
+                del self._connections[user_id]
+                self._set_state(user_id, False)
+
+    def expire(self, now=None):
+        """Drops connections that missed their heartbeats. Returns how many expired."""
+        now = time.monotonic() if now is None else now
+        expired = 0
+        with self._lock:
+            for user_id in list(self._connections):
+                connections = self._connections[user_id]
+                for channel_name, expires_at in list(connections.items()):
+                    if expires_at <= now:
+                        del connections[channel_name]
+                        expired += 1
+                if not connections:
+                    del self._connections[user_id]
+                    self._set_state(user_id, False)
+        return expired
+
+    def _set_state(self, user_id, online):
+        # Flush'tan önce gidip gelen kullanıcı için değişiklik birbirini götürür
+        if self._changes.get(user_id) is (not online):
+            del self._changes[user_id]
+        else:
+            self._changes[user_id] = online
+
+    def drain_changes(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            return changes
+
+    def online_user_ids(self):
+        with self._lock:
+            return list(self._connections)
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._connections
+
+    def __len__(self):
+        with self._lock:
+            return len(self._connections)
+
+
+class PresenceService:
+    def __init__(self, heartbeat_seconds, ttl_seconds, flush_interval_seconds, resync_every, stale_after_seconds):
+        self.heartbeat_interval = heartbeat_seconds
+        self.flush_interval = flush_interval_seconds
+        self.resync_every = resync_every
+        self.stale_after = stale_after_seconds
+        self.table = PresenceTable(ttl_seconds)
+        self._task = None
+        self._flushes = 0
+
+    # --- Consumer tarafı ---
+
+    def connected(self, user_id, channel_name):
+        self.table.heartbeat(user_id, channel_name)
+        self._ensure_task()
+
+    def heartbeat(self, user_id, channel_name):
+        self.table.heartbeat(user_id, channel_name)
+
+    def disconnected(self, user_id, channel_name):
+        self.table.disconnect(user_id, channel_name)
+        self._ensure_task()
+
+    def _ensure_task(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+                if not len(self.table):
+                    # Bağlantı kalmadı ve değişiklikler yazıldı; görev dursun
+                    break
+        except Exception as e:
+            logger.error(f"Presence flush loop stopped: {e}")
+        finally:
+            self._task = None
+
+    async def flush(self):
+        self.table.expire()
+        changes = self.table.drain_changes()
+        # İlk flush'ta da: çökmüş süreçlerden kalan satırlar hemen düzelir
+        resync = self._flushes % self.resync_every == 0
+        self._flushes += 1
+        if not changes and not resync:
+            return
+        diffs = await database_sync_to_async(self._write)(changes, self.table.online_user_ids() if resync else [], resync)
+        if diffs:
+            channel_layer = get_channel_layer()
+            for server_id, diff in diffs.items():
+                await channel_layer.group_send(presence_group(server_id), {"type": "presence.diff", **diff})
+
+    def _write(self, changes, resync_ids, reconcile=False):
+        """Bulk-writes is_online and returns {server_id: {'online': [...], 'offline': [...]}}."""
+        online = [user_id for user_id, state in changes.items() if state]
+        offline = [user_id for user_id, state in changes.items() if not state]
+        seen = set(online) | set(resync_ids)
+        now = timezone.now()
+        stale = []
+        try:
+            if seen:
+                # Yarı eskimiş damgalar da yenilenir ki bir sonraki resync'e kadar eskimesin
+                ServerMember.objects.filter(user_id__in=seen).filter(
+                    Q(is_online=False) | Q(last_seen_at__isnull=True)
+                    | Q(last_seen_at__lt=now - timedelta(seconds=self.stale_after / 2))
+                ).update(is_online=True, last_seen_at=now)
+            if offline:
+                ServerMember.objects.filter(user_id__in=offline, is_online=True).update(is_online=False)
+            if reconcile:
+                stale = list(
+                    ServerMember.objects.filter(is_online=True)
+                    .filter(Q(last_seen_at__isnull=True) | Q(last_seen_at__lt=now - timedelta(seconds=self.stale_after)))
+                    .exclude(user_id__in=seen)
+                    .values_list('id', 'server_id', 'user__username')
+                )
+                if stale:
+                    ServerMember.objects.filter(id__in=[row[0] for row in stale]).update(is_online=False)
+                    logger.info(f"Presence: reset {len(stale)} stale online memberships")
+        except Exception as e:
+            logger.error(f"Error writing presence for {len(changes)} users: {e}")
+            return {}
+
+        diffs = defaultdict(lambda: {'online': [], 'offline': []})
+        if changes:
+            memberships = ServerMember.objects.filter(user_id__in=changes).values_list(
+                'server_id', 'user_id', 'user__username'
+            )
+            for server_id, user_id, username in memberships:
+                diffs[server_id]['online' if changes[user_id] else 'offline'].append(username)
+        for _, server_id, username in stale:
+            diffs[server_id]['offline'].append(username)
+        return dict(diffs)
+
+    def flush_sync(self):
+        """Process exit: this worker's users go offline (other workers re-assert theirs)."""
+        user_ids = self.table.online_user_ids()
+        if user_ids:
+            try:
+                ServerMember.objects.filter(user_id__in=user_ids, is_online=True).update(is_online=False)
+            except Exception as e:
+                logger.error(f"Error clearing presence at exit: {e}")
+
+
+_service = None
+
+
+def get_presence_service():
+    global _service
+    if _service is None:
+        _service = PresenceService(**get_presence_config())
+        atexit.register(_service.flush_sync)
+    return _service
@@ -0,0 +1,125 @@
+"""
+Unread counters per user and text channel.
+
+Every member has a ChannelReadState row for each text channel of their
+server, created with the membership or the channel (rows for channels the
+user never opened start at unread_count=0 and no last read message). Every
+ChatWriter batch bumps unread_count for the other readers of each channel in
+the batch, with one UPDATE per channel; marking the channel read resets it.
+The read mark is (last_read_at, last_read_message_id), the order history
+pages use; ids alone do not follow write order across workers.
+Unread badges for a whole server then cost one indexed query.
+"""
+from collections import defaultdict
+
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ChannelReadState, ChatMessage, ServerMember, TextChannel
+
+
+def _after_read_mark(created_at, message_id):
+    """Rows whose read mark is before (created_at, message_id), the order chat_history pages in."""
+    return (
+        Q(last_read_at__isnull=True)
+        | Q(last_read_at__lt=created_at)
+        | Q(last_read_at=created_at, last_read_message_id__lt=message_id)
+    )
+
+
+def record_new_messages(messages):
+    """
+    Adds freshly stored messages to the readers' counters (authors skip
+    their own). Only messages after a reader's read mark count: ChatWriter
+    hands out ids in per-process blocks, so a batch may be older than a
+    message the reader has already marked read.
+    """
+    by_channel = defaultdict(list)
+    for message in messages:
+        by_channel[message.channel_id].append(message)
+
+    for channel_id, channel_messages in by_channel.items():
+        increment = sum(
+            (
+                Case(
+                    When(_after_read_mark(message.created_at, message.id) & ~Q(user_id=message.user_id), then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                for message in channel_messages
+            ),
+            Value(0),
+        )
+        newest = max(channel_messages, key=lambda message: (message.created_at, message.id))
+        # Mesaj yazılmadan önce zaten okundu işaretlenmiş olabilir
+        readers = ChannelReadState.objects.filter(channel_id=channel_id).filter(_after_read_mark(newest.created_at, newest.id))
+        authors = {message.user_id for message in channel_messages}
+        if len(authors) == 1:
+            # Partinin tek yazarının sayacı değişmez
+            readers = readers.exclude(user_id__in=authors)
+        readers.update(unread_count=F('unread_count') + increment)
+
+
+def _count_unread_after(user, channel, created_at, message_id):
+    return (
+        ChatMessage.objects.filter(channel=channel, created_at__gte=created_at)
+        .exclude(created_at=created_at, id__lte=message_id)
+        .exclude(user=user)
+        .count()
+    )
+
+
+def mark_read(user, channel, message_id=None):
+    """
+    Marks the channel read up to message_id (default: the latest message).
+    Returns the remaining unread count.
+    """
+    messages = ChatMessage.objects.filter(channel=channel)
+    if message_id is None:
+        message_id, read_at = messages.order_by('-created_at', '-id').values_list('id', 'created_at').first() or (None, None)
+        unread = 0
+    else:
+        read_at = messages.filter(id=message_id).values_list('created_at', flat=True).first()
+        if read_at is None:
+            # Yayınlandı ama ChatWriter henüz yazmadı: o ana kadarki her şey okundu
+            read_at, unread = timezone.now(), 0
+        else:
+            unread = _count_unread_after(user, channel, read_at, message_id)
+
+    ChannelReadState.objects.update_or_create(
+        user=user,
+        channel=channel,
+        defaults={'last_read_message_id': message_id, 'last_read_at': read_at, 'unread_count': unread},
+    )
+    return unread
+
+
+def unread_counts(user, server):
+    """{channel_id: unread_count} for the server's channels that have unread messages."""
+    return dict(
+        ChannelReadState.objects
+        .filter(user=user, channel__server=server, unread_count__gt=0)
+        .values_list('channel_id', 'unread_count')
+    )
+
+
+@receiver(post_save, sender=ServerMember)
+def _member_joined(sender, instance, created, **kwargs):
+    if created:
+        channel_ids = TextChannel.all_objects.filter(server_id=instance.server_id).values_list('id', flat=True)
+        ChannelReadState.objects.bulk_create(
+            [ChannelReadState(user_id=instance.user_id, channel_id=channel_id) for channel_id in channel_ids],
+            ignore_conflicts=True,
+        )
+
+
+@receiver(post_save, sender=TextChannel)
+def _channel_created(sender, instance, created, **kwargs):
+    if created:
+        user_ids = ServerMember.objects.filter(server_id=instance.server_id).values_list('user_id', flat=True)
+        ChannelReadState.objects.bulk_create(
+            [ChannelReadState(user_id=user_id, channel_id=instance.id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
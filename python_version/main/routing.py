@@ -1,11 +1,17 @@
 from django.urls import re_path
 from . import consumers # Consumer'ınızı bu dosyaya import edin
+from .multiplex import MultiplexConsumer
 
-websocket_urlpatterns = [
+# Tek başına bağlanılabilen akışlar; ws/mux/ bunları tek bağlantı üzerinden taşır
+stream_urlpatterns = [
     # İstemci (Front-end) bu adrese bağlanır: ws://domain/ws/voice/?channel_slug=oda-adi
     re_path(r'ws/voice/$', consumers.VoiceChatConsumer.as_asgi()),
     re_path(
         r'ws/dice-wars/(?P<game_id>[0-9a-f-]+)/$',
         consumers.GameConsumer_DiceWars.as_asgi()
     ),
-]
\ No newline at end of file
+]
+
+websocket_urlpatterns = stream_urlpatterns + [
+    re_path(r'ws/mux/$', MultiplexConsumer.as_asgi()),
+]
@@ -0,0 +1,354 @@
+"""
+Optional selective forwarding (SFU) mode for large voice channels.
+
+In the default mesh every client uploads its stream to every other client.
+When a VoiceChannel has sfu_enabled and the room reaches sfu_threshold users,
+each client instead keeps one RTCPeerConnection to the server: media goes up
+once and an SFU worker forwards it to everyone else in the room.
+
+The SFU runs on aiortc in a pool of separate worker processes (VOICE_SFU
+['workers']); a room always lives on the same worker. VoiceChatConsumer
+talks to the pool through SFUClient: the client's offer is answered by the
+worker, and whenever new tracks must be forwarded to a peer the worker
+renegotiates by sending that peer a fresh offer (delivered to the consumer
+through its notify callback).
+
+aiortc is not a hard dependency; without it SFU_AVAILABLE is False and
+voice channels stay in mesh mode.
+
+The pool belongs to one Daphne process. With a multi-process channel layer
+(CHANNEL_LAYER=postgres/socket) the members of a room may sit on different
+processes, each with its own pool, and would not hear each other; SFU mode
+is then off and rooms stay in mesh mode.
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+import zlib
+
+from django.conf import settings
+
+try:
+    import aiortc  # noqa: F401
+    SFU_AVAILABLE = True
+except ImportError:
+    SFU_AVAILABLE = False
+
+logger = logging.getLogger('main')
+
+SFU_DEFAULTS = {
+    'workers': 2,
+    'request_timeout_seconds': 10,
+}
+
+
+def get_sfu_config():
+    config = dict(SFU_DEFAULTS)
+    config.update(getattr(settings, 'VOICE_SFU', {}))
+    return config
+
+
+# Odanın bütün üyelerinin aynı süreçte (aynı havuzda) olduğu tek kanal katmanı
+SINGLE_PROCESS_LAYER = 'channels.layers.InMemoryChannelLayer'
+
+_warned_multi_process = False
+
+
+def sfu_supported():
+    """aiortc is installed and every room member connects to this process."""
+    global _warned_multi_process
+    if not SFU_AVAILABLE:
+        return False
+    if getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {}).get('BACKEND') != SINGLE_PROCESS_LAYER:
+        if not _warned_multi_process:
+            _warned_multi_process = True
+            logger.warning("SFU mode is off: the channel layer spans several processes and the SFU pool does not")
+        return False
+    return True
+
+
+def use_sfu(channel, user_count):
+    """Should a room of this VoiceChannel with user_count users forward media through the SFU?"""
+    return channel.sfu_enabled and user_count >= max(channel.sfu_threshold, 1) and sfu_supported()
+
+
+# --- Worker süreci (aiortc burada çalışır) ---
+
+class _Peer:
+    def __init__(self, peer_id, user_id, username, pc):
+        self.peer_id = peer_id
+        self.user_id = user_id
+        self.username = username
+        self.pc = pc
+        self.incoming = []  # bu peer'ın yüklediği track'ler
+        self.forwarded = {}  # track id -> kaynak kullanıcı adı
+        self.negotiating = False
+        self.needs_offer = False
+
+
+class _Worker:
+    def __init__(self, events):
+        from aiortc.contrib.media import MediaRelay
+
+        self.events = events
+        self.relay = MediaRelay()
+        self.rooms = {}  # room -> {peer_id: _Peer}
+        self.locks = {}  # room -> asyncio.Lock; bir odanın komutları sırayla işlenir
+
+    async def handle(self, command, args):
+        lock = self.locks.setdefault(args['room'], asyncio.Lock())
+        async with lock:
+            return await getattr(self, f'cmd_{command}')(**args)
+
+    async def cmd_join(self, room, peer_id, user_id, username, offer):
+        from aiortc import RTCPeerConnection, RTCSessionDescription
+
+        peers = self.rooms.setdefault(room, {})
+        pc = RTCPeerConnection()
+        peer = _Peer(peer_id, user_id, username, pc)
+        peers[peer_id] = peer
+
+        @pc.on('track')
+        def on_track(track):
+            peer.incoming.append(track)
+            # Yeni track odadaki herkese iletilir
+            for other in list(peers.values()):
+                if other is not peer:
+                    self._forward(track, peer, other)
+                    self._schedule_offer(room, other)
+
+        @pc.on('connectionstatechange')
+        async def on_state():
+            if pc.connectionState in ('failed', 'closed'):
+                await self.cmd_leave(room, peer_id)
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=offer['sdp'], type=offer['type']))
+        await pc.setLocalDescription(await pc.createAnswer())
+
+        # Odada zaten yayın yapanların track'leri bu peer'a ayrı bir teklifle gelir
+        for other in peers.values():
+            if other is not peer:
+                for track in other.incoming:
+                    self._forward(track, other, peer)
+        if peer.forwarded:
+            self._schedule_offer(room, peer)
+        return {'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type}
+
+    def _forward(self, track, source, target):
+        relayed = self.relay.subscribe(track)
+        target.pc.addTrack(relayed)
+        target.forwarded[relayed.id] = source.username
+
+    def _schedule_offer(self, room, peer):
+        if peer.negotiating:
+            peer.needs_offer = True
+            return
+        asyncio.ensure_future(self._send_offer(room, peer))
+
+    async def _send_offer(self, room, peer):
+        if peer.pc.signalingState != 'stable' or self.rooms.get(room, {}).get(peer.peer_id) is not peer:
+            return
+        peer.negotiating = True
+        peer.needs_offer = False
+        await peer.pc.setLocalDescription(await peer.pc.createOffer())
+        mids = {
+            transceiver.mid: peer.forwarded[transceiver.sender.track.id]
+            for transceiver in peer.pc.getTransceivers()
+            if transceiver.sender.track is not None and transceiver.sender.track.id in peer.forwarded
+        }
+        self.events.put({
+            'event': 'offer',
+            'room': room,
+            'peer_id': peer.peer_id,
+            'offer': {'sdp': peer.pc.localDescription.sdp, 'type': peer.pc.localDescription.type},
+            'mids': mids,
+        })
+
+    async def cmd_answer(self, room, peer_id, answer):
+        from aiortc import RTCSessionDescription
+
+        peer = self.rooms.get(room, {}).get(peer_id)
+        if peer is None or not peer.negotiating:
+            return False
+        await peer.pc.setRemoteDescription(RTCSessionDescription(sdp=answer['sdp'], type=answer['type']))
+        peer.negotiating = False
+        if peer.needs_offer:
+            await self._send_offer(room, peer)
+        return True
+
+    async def cmd_candidate(self, room, peer_id, candidate):
+        from aiortc.sdp import candidate_from_sdp
+
+        peer = self.rooms.get(room, {}).get(peer_id)
+        if peer is None or not candidate.get('candidate'):
+            return False
+        parsed = candidate_from_sdp(candidate['candidate'].split(':', 1)[1])
+        parsed.sdpMid = candidate.get('sdpMid')
+        parsed.sdpMLineIndex = candidate.get('sdpMLineIndex')
+        await peer.pc.addIceCandidate(parsed)
+        return True
+
+    async def cmd_leave(self, room, peer_id):
+        peers = self.rooms.get(room, {})
+        peer = peers.pop(peer_id, None)
+        if peer is None:
+            return False
+        for track in peer.incoming:
+            track.stop()
+        await peer.pc.close()
+        if not peers:
+            self.rooms.pop(room, None)
+            self.locks.pop(room, None)
+        return True
+
+    async def cmd_stats(self, room):
+        return {
+            peer.username: {'incoming': len(peer.incoming), 'forwarded': len(peer.forwarded)}
+            for peer in self.rooms.get(room, {}).values()
+        }
+
+
+def _worker_main(requests, events):
+    """Entry point of an SFU worker process."""
+    async def run():
+        worker = _Worker(events)
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await loop.run_in_executor(None, requests.get)
+            if request is None:
+                break
+
+            async def handle(request=request):
+                try:
+                    result = await worker.handle(request['command'], request['args'])
+                    events.put({'id': request['id'], 'result': result})
+                except Exception as e:
+                    events.put({'id': request['id'], 'error': f'{type(e).__name__}: {e}'})
+
+            asyncio.ensure_future(handle())
+
+    asyncio.run(run())
+
+
+# --- Django tarafı ---
+
+class SFUError(Exception):
+    pass
+
+
+class SFUClient:
+    """Per-process handle on the SFU worker pool."""
+
+    def __init__(self, workers, request_timeout_seconds):
+        self.worker_count = workers
+        self.timeout = request_timeout_seconds
+        self._workers = []
+        self._ids = itertools.count(1)
+        self._pending = {}  # request id -> (loop, future)
+        self._notify = {}  # peer_id -> (loop, async callable)
+        self._lock = threading.Lock()
+        # _pending ve _notify hem event loop'tan hem olay okuyan thread'lerden kullanılır
+        self._registry_lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._workers:
+                return
+            context = multiprocessing.get_context('spawn')
+            for index in range(self.worker_count):
+                requests, events = context.Queue(), context.Queue()
+                process = context.Process(
+                    target=_worker_main, args=(requests, events), name=f'sfu-worker-{index}', daemon=True
+                )
+                process.start()
+                threading.Thread(target=self._read_events, args=(events,), daemon=True).start()
+                self._workers.append((process, requests))
+
+    def _worker_for(self, room):
+        self._start()
+        # Bir odanın bütün peer'ları aynı worker'da olmalı
+        return self._workers[zlib.crc32(room.encode('utf-8')) % len(self._workers)][1]
+
+    def _read_events(self, events):
+        while True:
+            try:
+                message = events.get()
+            except (EOFError, OSError):
+                return
+            if 'id' in message:
+                with self._registry_lock:
+                    loop, future = self._pending.pop(message['id'], (None, None))
+                if future is not None:
+                    loop.call_soon_threadsafe(self._resolve, future, message)
+            elif message.get('event') == 'offer':
+                with self._registry_lock:
+                    loop, notify = self._notify.get(message['peer_id'], (None, None))
+                if notify is not None:
+                    asyncio.run_coroutine_threadsafe(notify(message), loop)
+
+    @staticmethod
+    def _resolve(future, message):
+        if future.done():
+            return
+        if 'error' in message:
+            future.set_exception(SFUError(message['error']))
+        else:
+            future.set_result(message['result'])
+
+    async def _call(self, room, command, **args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._registry_lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = (loop, future)
+        self._worker_for(room).put({'id': request_id, 'command': command, 'args': dict(args, room=room)})
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            with self._registry_lock:
+                self._pending.pop(request_id, None)
+
+    async def join(self, room, peer_id, user_id, username, offer, notify):
+        """
+        Answers the client's offer. notify(event) is awaited on the caller's
+        loop whenever the SFU sends this peer a renegotiation offer
+        (event: {'offer': {...}, 'mids': {mid: username}}).
+        """
+        with self._registry_lock:
+            self._notify[peer_id] = (asyncio.get_running_loop(), notify)
+        return await self._call(room, 'join', peer_id=peer_id, user_id=user_id, username=username, offer=offer)
+
+    async def answer(self, room, peer_id, answer):
+        return await self._call(room, 'answer', peer_id=peer_id, answer=answer)
+
+    async def candidate(self, room, peer_id, candidate):
+        return await self._call(room, 'candidate', peer_id=peer_id, candidate=candidate)
+
+    async def leave(self, room, peer_id):
+        with self._registry_lock:
+            self._notify.pop(peer_id, None)
+        return await self._call(room, 'leave', peer_id=peer_id)
+
+    async def stats(self, room):
+        return await self._call(room, 'stats')
+
+    def shutdown(self):
+        for process, requests in self._workers:
+            try:
+                requests.put(None)
+            except (OSError, ValueError):
+                pass
+            process.join(timeout=2)
+        self._workers = []
+
+
+_client = None
+
+
+def get_sfu_client():
+    global _client
+    if _client is None:
+        _client = SFUClient(**get_sfu_config())
+    return _client
@@ -0,0 +1,298 @@
+"""
+Channel layer for several Daphne processes on one host, over UNIX domain
+sockets; no broker to run.
+
+    CHANNEL_LAYERS = {"default": {
+        "BACKEND": "main.socket_layer.UnixSocketChannelLayer",
+        "CONFIG": {"socket_dir": "/run/nbcsw2/channels"},
+    }}
+
+- Every layer instance (one per process) listens on <socket_dir>/<id>.sock.
+  Peers are the other sockets in that directory, rescanned every
+  discovery_interval seconds; a socket nobody accepts on is removed.
+- Process-specific channel names carry the owner's id, so send() is one
+  frame to the owning process (channels of this process skip the socket).
+- Memberships are kept by the process owning the channel; group_add for a
+  channel of another process is forwarded to it.
+- group_send delivers to local members and writes one frame per peer, and
+  each peer delivers to its own members. Members share the encoded
+  payload; each receive() decodes its own copy.
+- Shared channel names (no "!") stay inside their process.
+- expiry, group_expiry and capacity behave as in InMemoryChannelLayer,
+  except that a full channel in another process drops the message instead
+  of raising ChannelFull in the sender.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import struct
+import tempfile
+import time
+from collections import defaultdict
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .layer_codec import channel_owner, decode_message, encode_message, new_layer_id, specific_channel_name
+
+logger = logging.getLogger('main')
+
+# Çerçeve: gövde uzunluğu, tür, son geçerlilik (unix zamanı), ad uzunluğu; ardından ad + gövde
+HEADER = struct.Struct('!IBdH')
+SEND, GROUP_SEND, GROUP_ADD, GROUP_DISCARD = range(1, 5)
+
+
+def _frame(kind, name, expires, body):
+    name = name.encode('utf-8')
+    return HEADER.pack(len(name) + len(body), kind, expires, len(name)) + name + body
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 socket_dir=None, discovery_interval=1, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.socket_dir = socket_dir or os.path.join(tempfile.gettempdir(), 'nbcsw2-channels')
+        self.discovery_interval = discovery_interval
+        self.client_id = new_layer_id()
+        self.socket_path = self._socket_path(self.client_id)
+        self.dropped = 0
+        self._queues = {}  # bu süreçteki kanal -> asyncio.Queue of (expires, encoded message)
+        self._groups = defaultdict(dict)  # grup -> {bu süreçteki kanal: üyeliğin bitişi}
+        self._peers = set()
+        self._connections = {}  # peer id -> Task[(reader, writer)]
+        self._clients = set()  # bize bağlanan eşlerin writer'ları
+        self._scanned_at = 0
+        self._loop = None
+        self._ready = None
+        self._server = None
+        atexit.register(self._remove_socket)
+
+    def _socket_path(self, layer_id):
+        return os.path.join(self.socket_dir, f'{layer_id}.sock')
+
+    # --- Sunucu tarafı ---
+
+    async def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # İlk kullanım ya da yeni event loop: yerel durum sıfırlanır
+            self._shutdown()
+            self._queues = {}
+            self._groups = defaultdict(dict)
+            self._loop = loop
+            self._ready = loop.create_task(self._start())
+        try:
+            await asyncio.shield(self._ready)
+        except Exception:
+            self._loop = None
+            raise
+
+    async def _start(self):
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        self._remove_socket()
+        self._server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+
+    async def _serve(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while True:
+                length, kind, expires, name_length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                data = await reader.readexactly(length)
+                self._handle(kind, data[:name_length].decode('utf-8'), expires, data[name_length:])
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Eş gitti ya da loop kapanıyor; bağlantının işi bitti
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _handle(self, kind, name, expires, body):
+        if kind == SEND:
+            self._deliver(name, expires, body)
+        elif kind == GROUP_SEND:
+            self._deliver_group(name, expires, body)
+        elif kind == GROUP_ADD:
+            self._groups[name][body.decode('utf-8')] = time.time() + self.group_expiry
+        elif kind == GROUP_DISCARD:
+            self._discard_local(name, body.decode('utf-8'))
+
+    def _deliver(self, channel, expires, body):
+        queue = self._queues.get(channel)
+        if queue is None:
+            # Kanalın consumer'ı gitmiş
+            return
+        if queue.full():
+            self.dropped += 1
+            return
+        queue.put_nowait((expires, body))
+
+    def _deliver_group(self, group, expires, body):
+        members = self._groups.get(group)
+        if not members:
+            return
+        now = time.time()
+        for channel, until in list(members.items()):
+            if until < now:
+                del members[channel]
+            else:
+                self._deliver(channel, expires, body)
+        if not members:
+            del self._groups[group]
+
+    def _discard_local(self, group, channel):
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self._groups[group]
+
+    # --- Eşler ---
+
+    def _scan_peers(self):
+        now = time.monotonic()
+        if now - self._scanned_at < self.discovery_interval:
+            return
+        self._scanned_at = now
+        try:
+            names = os.listdir(self.socket_dir)
+        except FileNotFoundError:
+            names = []
+        self._peers = {name[:-5] for name in names if name.endswith('.sock')} - {self.client_id}
+
+    async def _send_frame(self, peer, frame):
+        """Writes frame to peer; returns False if the peer is gone."""
+        connection = self._connections.get(peer)
+        if connection is None:
+            connection = self._connections[peer] = self._loop.create_task(
+                asyncio.open_unix_connection(self._socket_path(peer))
+            )
+        try:
+            reader, writer = await connection
+            writer.write(frame)
+            await writer.drain()
+            return True
+        except OSError as e:
+            self._connections.pop(peer, None)
+            self._peers.discard(peer)
+            if isinstance(e, ConnectionRefusedError):
+                # Süreç ölmüş, soket dosyası kalmış
+                try:
+                    os.unlink(self._socket_path(peer))
+                except OSError:
+                    pass
+            return False
+
+    # --- Kanal katmanı API'si ---
+
+    async def new_channel(self, prefix='specific'):
+        await self._ensure_started()
+        channel = specific_channel_name(prefix, self.client_id)
+        self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._ensure_started()
+        expires = time.time() + self.expiry
+        body = encode_message(message).encode('utf-8')
+        owner = channel_owner(channel)
+        if owner is None or owner == self.client_id:
+            queue = self._queues.get(channel)
+            if queue is None and owner is None:
+                queue = self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+            if queue is not None and queue.full():
+                raise ChannelFull(channel)
+            self._deliver(channel, expires, body)
+        else:
+            await self._send_frame(owner, _frame(SEND, channel, expires, body))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self._ensure_started()
+        queue = self._queues.get(channel)
+        if queue is None:
+            queue = self._queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        try:
+            while True:
+                expires, body = await queue.get()
+                if expires >= time.time():
+                    return decode_message(body)
+        except asyncio.CancelledError:
+            # Consumer kapandı; boş kuyruğu bırak
+            if queue.empty() and self._queues.get(channel) is queue:
+                del self._queues[channel]
+            raise
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._ensure_started()
+        owner = channel_owner(channel)
+        if owner is None or owner == self.client_id:
+            self._groups[group][channel] = time.time() + self.group_expiry
+        else:
+            await self._send_frame(owner, _frame(GROUP_ADD, group, 0, channel.encode('utf-8')))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._ensure_started()
+        owner = channel_owner(channel)
+        if owner is None or owner == self.client_id:
+            self._discard_local(group, channel)
+        else:
+            await self._send_frame(owner, _frame(GROUP_DISCARD, group, 0, channel.encode('utf-8')))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._ensure_started()
+        expires = time.time() + self.expiry
+        body = encode_message(message).encode('utf-8')
+        self._deliver_group(group, expires, body)
+        self._scan_peers()
+        if self._peers:
+            frame = _frame(GROUP_SEND, group, expires, body)
+            await asyncio.gather(*(self._send_frame(peer, frame) for peer in list(self._peers)))
+
+    async def flush(self):
+        """Clears this process's buffers and memberships."""
+        self._queues = {}
+        self._groups = defaultdict(dict)
+
+    async def close(self):
+        self._shutdown()
+        self._loop = None
+
+    def _shutdown(self):
+        writers = list(self._clients)
+        for connection in self._connections.values():
+            if connection.done() and not connection.cancelled() and connection.exception() is None:
+                writers.append(connection.result()[1])
+            else:
+                connection.cancel()
+        self._connections = {}
+        self._clients = set()
+        try:
+            for writer in writers:
+                writer.close()
+            if self._server is not None:
+                self._server.close()
+        except RuntimeError:
+            # Eski event loop zaten kapanmış; soketler onunla gitti
+            pass
+        self._server = None
+        self._remove_socket()
+
+    def _remove_socket(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
@@ -5,4 +5,10 @@ register = template.Library()
 @register.filter(name='add_class')
 def add_class(value, arg):
     """Bootstrap sınıfını forma ekler."""
-    return value.as_widget(attrs={'class': arg})
\ No newline at end of file
+    return value.as_widget(attrs={'class': arg})
+
+
+@register.filter(name='get_item')
+def get_item(mapping, key):
+    """Sözlükten anahtarla değer okur: {{ unread_counts|get_item:channel.id }}"""
+    return mapping.get(key) if mapping else None
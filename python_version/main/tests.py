@@ -1,3 +1,1427 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import channel_access, chat_export, chat_history, chat_partitions, chat_writer, ephemeral, maintenance, presence, read_state, sfu
+from .chat_render import render_message
+from .chat_ring import ChatRing, chat_ring
+from .layer_codec import channel_owner, decode_message, encode_message, new_layer_id, specific_channel_name
+from . import dice_wars as dw
+from .models import ChannelLayerGroup, ChannelReadState, ChatMessage, CustomUser, GameArchive, GameSession, MiniGame, Server, ServerMember, StaleGameSession, TextChannel, VoiceChannel
+from .pg_layer import PostgresChannelLayer
+from .routing import websocket_urlpatterns
+from .socket_layer import UnixSocketChannelLayer
+from .voice_roster import VoiceRoster, make_entry
+
+
+class DiceWarsRulesTests(SimpleTestCase):
+    def test_first_round_places_three_on_empty_cell(self):
+        board = {}
+        self.assertIsNone(dw.place_piece(board, 1, 2, 'ada', is_first_round=True))
+        self.assertEqual(board, {'1': {'2': {'owner': 'ada', 'count': 3}}})
+
+    def test_later_rounds_only_raise_own_cells(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 1}, '1': {'owner': 'bob', 'count': 1}}}
+        self.assertEqual(dw.place_piece(board, 1, 1, 'ada', is_first_round=False), 'not_first_round')
+        self.assertEqual(dw.place_piece(board, 0, 1, 'ada', is_first_round=False), 'opponent_cell')
+        self.assertIsNone(dw.place_piece(board, 0, 0, 'ada', is_first_round=False))
+        self.assertEqual(board['0']['0']['count'], 2)
+
+    def test_corner_explosion_captures_neighbours(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 4}, '1': {'owner': 'bob', 'count': 2}}}
+        rounds = list(dw.resolve_explosions(board, 3, 'ada'))
+        self.assertEqual(rounds, [[(0, 0)]])
+        self.assertIsNone(board['0']['0'])
+        self.assertEqual(board['0']['1'], {'owner': 'ada', 'count': 3})
+        self.assertEqual(board['1']['0'], {'owner': 'ada', 'count': 1})
+
+    def test_chain_reaction_runs_in_rounds(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 4}, '1': {'owner': 'bob', 'count': 3}}}
+        rounds = list(dw.resolve_explosions(board, 3, 'ada'))
+        self.assertEqual(rounds, [[(0, 0)], [(0, 1)]])
+        self.assertEqual(dw.find_critical_cells(board), [])
+        self.assertEqual(board['0']['0'], {'owner': 'ada', 'count': 1})
+
+    def test_count_pieces_counts_owned_cells(self):
+        board = {
+            '0': {'0': {'owner': 'ada', 'count': 3}, '1': None},
+            '1': {'0': {'owner': 'ada', 'count': 1}, '1': {'owner': 'bob', 'count': 2}},
+        }
+        self.assertEqual(dw.count_pieces(board), {'ada': 2, 'bob': 1})
+        self.assertEqual(dw.count_pieces(None), {})
+
+    def test_replay_yields_move_and_explosion_frames(self):
+        moves = [['ada', 0, 0], ['bob', 2, 2], ['ada', 0, 0]]
+        frames = list(dw.replay_moves(moves, 3))
+        self.assertEqual([(frame['type'], frame['seq']) for frame in frames],
+                         [('move', 1), ('move', 2), ('move', 3), ('explosion', 3)])
+        self.assertEqual(frames[0]['board'], {'0': {'0': {'owner': 'ada', 'count': 3}}})
+        self.assertEqual(frames[3]['exploded_cells'], [[0, 0]])
+        self.assertIsNone(frames[3]['board']['0']['0'])
+        # Kareler anlık görüntü: sonraki hamleler öncekileri değiştirmez
+        self.assertEqual(frames[2]['board']['0']['0'], {'owner': 'ada', 'count': 4})
+
+
+class DiceWarsPreviewTests(SimpleTestCase):
+    def setUp(self):
+        dw._preview_cache.clear()
+
+    def test_preview_does_not_touch_the_board(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 3}}}
+        preview = dw.preview_move(board, 3, 0, 0, 'ada', is_first_round=False)
+        self.assertEqual(board, {'0': {'0': {'owner': 'ada', 'count': 3}}})
+        self.assertTrue(preview['valid'])
+        self.assertEqual(preview['frames'], [[[0, 0]]])
+        self.assertEqual(preview['board']['0']['1'], {'owner': 'ada', 'count': 1})
+
+    def test_invalid_move_reports_error(self):
+        board = {'0': {'0': {'owner': 'bob', 'count': 1}}}
+        self.assertEqual(
+            dw.preview_move(board, 3, 0, 0, 'ada', is_first_round=False),
+            {'valid': False, 'error': 'opponent_cell'},
+        )
+
+    def test_same_board_and_move_hit_the_cache(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 3}}}
+        first = dw.preview_move(board, 3, 0, 0, 'ada', is_first_round=False)
+        again = dw.preview_move(dw.copy_board(board), 3, 0, 0, 'ada', is_first_round=False)
+        self.assertIs(first, again)
+        other = dw.preview_move(board, 3, 0, 0, 'bob', is_first_round=False)
+        self.assertFalse(other['valid'])
+
+
+class GameSessionCasTests(TestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user(username='ada', password='x')
+        game_type = MiniGame.objects.create(name='Dice Wars')
+        self.game = GameSession.objects.create(game_type=game_type, host=self.host)
+
+    def test_save_bumps_version(self):
+        version = self.game.version
+        self.game.board_state = {'0': {'0': {'owner': 'ada', 'count': 3}}}
+        self.game.save_if_unchanged(['board_state'])
+        self.assertEqual(self.game.version, version + 1)
+        stored = GameSession.objects.get(pk=self.game.pk)
+        self.assertEqual(stored.version, version + 1)
+        self.assertEqual(stored.board_state, self.game.board_state)
+
+    def test_concurrent_writer_loses(self):
+        first = GameSession.objects.get(pk=self.game.pk)
+        second = GameSession.objects.get(pk=self.game.pk)
+        first.move_count = 1
+        first.save_if_unchanged(['move_count'])
+        second.move_count = 5
+        with self.assertRaises(StaleGameSession):
+            second.save_if_unchanged(['move_count'])
+        self.assertEqual(GameSession.objects.get(pk=self.game.pk).move_count, 1)
+
+    def test_plain_save_from_a_stale_copy_is_refused(self):
+        first = GameSession.objects.get(pk=self.game.pk)
+        second = GameSession.objects.get(pk=self.game.pk)
+        first.status = 'in_progress'
+        first.save()
+        second.move_count = 5
+        with self.assertRaises(StaleGameSession):
+            second.save()
+        with self.assertRaises(StaleGameSession):
+            second.save(update_fields=['move_count'])
+        stored = GameSession.objects.get(pk=self.game.pk)
+        self.assertEqual((stored.status, stored.move_count, stored.version), ('in_progress', 0, first.version))
+
+
+class GameSessionReaperTests(TestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user(username='ada', password='x')
+        self.game_type = MiniGame.objects.create(name='Dice Wars')
+        self.now = timezone.now()
+
+    def _session(self, status, idle_minutes):
+        game = GameSession.objects.create(game_type=self.game_type, host=self.host, status=status, current_turn=self.host)
+        # auto_now kaydı değiştirmesin diye update ile geriye alınır
+        GameSession.objects.filter(pk=game.pk).update(last_activity_at=self.now - timedelta(minutes=idle_minutes))
+        return game
+
+    def test_stale_sessions_are_reclaimed_in_batches(self):
+        stale_waiting = [self._session('waiting', 31) for _ in range(3)]
+        fresh_waiting = self._session('waiting', 5)
+        stale_game = self._session('in_progress', 121)
+        live_game = self._session('in_progress', 60)
+
+        stats = maintenance.reap_stale_game_sessions(now=self.now, batch_size=2)
+
+        self.assertEqual(stats, {'waiting_deleted': 3, 'in_progress_closed': 1})
+        self.assertFalse(GameSession.objects.filter(pk__in=[game.pk for game in stale_waiting]).exists())
+        self.assertTrue(GameSession.objects.filter(pk=fresh_waiting.pk).exists())
+        closed = GameSession.objects.get(pk=stale_game.pk)
+        self.assertEqual((closed.status, closed.current_turn, closed.finished_at), ('finished', None, self.now))
+        self.assertEqual(closed.version, stale_game.version + 1)
+        self.assertEqual(GameSession.objects.get(pk=live_game.pk).status, 'in_progress')
+
+    def test_second_run_finds_nothing(self):
+        self._session('waiting', 31)
+        maintenance.reap_stale_game_sessions(now=self.now)
+        self.assertEqual(maintenance.reap_stale_game_sessions(now=self.now), {'waiting_deleted': 0, 'in_progress_closed': 0})
+
+
+class GameArchiveTests(TestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.game_type = MiniGame.objects.create(name='Dice Wars')
+        self.now = timezone.now()
+
+    def _finished(self, days_ago, **fields):
+        game = GameSession.objects.create(game_type=self.game_type, host=self.ada, status='finished', **fields)
+        game.players.add(self.ada, self.bob)
+        GameSession.objects.filter(pk=game.pk).update(last_activity_at=self.now - timedelta(days=days_ago))
+        return game
+
+    def test_old_finished_games_move_to_the_archive(self):
+        board = {'0': {'0': {'owner': 'ada', 'count': 3}}}
+        moves = [['ada', 0, 0], ['bob', 2, 2], ['ada', 0, 0]]
+        old = self._finished(8, winner=self.ada, board_state=board, move_log=moves, move_count=3)
+        other_old = self._finished(9)
+        recent = self._finished(1)
+        playing = GameSession.objects.create(game_type=self.game_type, host=self.ada, status='in_progress')
+        GameSession.objects.filter(pk=playing.pk).update(last_activity_at=self.now - timedelta(days=30))
+
+        self.assertEqual(maintenance.archive_finished_games(now=self.now, batch_size=1), 2)
+
+        self.assertEqual(set(GameSession.objects.values_list('pk', flat=True)), {recent.pk, playing.pk})
+        self.assertEqual(GameArchive.objects.filter(pk=other_old.pk).count(), 1)
+        archive = GameArchive.objects.get(pk=old.pk)
+        self.assertEqual(archive.board_state, board)
+        self.assertEqual(archive.move_log, moves)
+        self.assertCountEqual(archive.player_usernames, ['ada', 'bob'])
+        self.assertEqual((archive.winner, archive.move_count), (self.ada, 3))
+        self.assertLess(len(archive.moves), len(json.dumps(moves)))
+        self.assertEqual(maintenance.archive_finished_games(now=self.now), 0)
+
+    def test_archived_game_room_is_read_only(self):
+        game = self._finished(8, board_state={'1': {'1': {'owner': 'bob', 'count': 1}}})
+        maintenance.archive_finished_games(now=self.now)
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('game_room', args=[game.game_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context['game'], GameArchive)
+        self.assertFalse(response.context['is_spectator'])
+
+
+class GameConsumerActivityTests(TransactionTestCase):
+    def setUp(self):
+        self.host = CustomUser.objects.create_user(username='ada', password='x')
+        game_type = MiniGame.objects.create(name='Dice Wars')
+        self.game = GameSession.objects.create(game_type=game_type, host=self.host)
+
+    @database_sync_to_async
+    def _age(self, minutes):
+        GameSession.objects.filter(pk=self.game.pk).update(last_activity_at=timezone.now() - timedelta(minutes=minutes))
+
+    @database_sync_to_async
+    def _reap(self):
+        return maintenance.reap_stale_game_sessions()['waiting_deleted']
+
+    # TTL 0.3 sn: bağlı consumer damgayı 0.1 sn'de bir tazeler
+    @override_settings(GAME_SESSION_REAPER={'waiting_ttl_minutes': 0.005, 'in_progress_ttl_minutes': 0.005})
+    async def test_connected_table_is_kept_alive(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/dice-wars/{self.game.game_id}/')
+        communicator.scope['user'] = self.host
+        connected, _code = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        try:
+            await self._age(60)
+            await asyncio.sleep(0.25)
+            self.assertEqual(await self._reap(), 0)
+        finally:
+            await communicator.disconnect()
+        await self._age(60)
+        self.assertEqual(await self._reap(), 1)
+
+
+class ChatHistoryCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='ada', password='x')
+        server = Server.objects.create(name='Test', slug='test', owner=cls.user)
+        cls.channel = TextChannel.objects.create(server=server, name='general', slug='general')
+        start = timezone.now() - timedelta(hours=1)
+        # Aynı zaman damgalı mesajlar: sıralamayı id ayırmalı
+        times = [start, start, start, start + timedelta(seconds=1), start + timedelta(seconds=2)]
+        cls.messages = [
+            ChatMessage.objects.create(channel=cls.channel, user=cls.user, content=f'm{i}', created_at=moment)
+            for i, moment in enumerate(times)
+        ]
+
+    def test_cursor_round_trip(self):
+        message = self.messages[0]
+        cursor = chat_history.encode_cursor(message.created_at, message.id)
+        self.assertEqual(chat_history.decode_cursor(cursor), (message.created_at, message.id))
+        self.assertEqual(
+            chat_history.decode_cursor(chat_history.encode_cursor(message.created_at.isoformat(), message.id)),
+            (message.created_at, message.id),
+        )
+
+    def test_malformed_cursor_raises_value_error(self):
+        for cursor in ('', 'not-base64!', chat_history.encode_cursor('yesterday', 1)):
+            with self.assertRaises(ValueError):
+                chat_history.decode_cursor(cursor)
+
+    def test_pages_walk_back_without_gaps_or_duplicates(self):
+        page = chat_history.fetch_page(self.channel, limit=2)
+        seen = [m.content for m in page['messages']]
+        self.assertEqual(seen, ['m3', 'm4'])
+        while page['has_more_before']:
+            first = page['messages'][0]
+            page = chat_history.fetch_page(
+                self.channel, limit=2, before=chat_history.encode_cursor(first.created_at, first.id)
+            )
+            seen = [m.content for m in page['messages']] + seen
+        self.assertEqual(seen, ['m0', 'm1', 'm2', 'm3', 'm4'])
+
+    def test_after_cursor_and_around(self):
+        anchor = self.messages[1]
+        page = chat_history.fetch_page(self.channel, limit=10, after=chat_history.encode_cursor(anchor.created_at, anchor.id))
+        self.assertEqual([m.content for m in page['messages']], ['m2', 'm3', 'm4'])
+        self.assertFalse(page['has_more_after'])
+        page = chat_history.fetch_page(self.channel, limit=3, around=self.messages[2].id)
+        self.assertEqual([m.content for m in page['messages']], ['m1', 'm2', 'm3'])
+        self.assertTrue(page['has_more_before'])
+        self.assertTrue(page['has_more_after'])
+
+    def test_fetch_after_id(self):
+        messages, has_more = chat_history.fetch_after_id(self.channel, self.messages[2].id)
+        self.assertEqual([m.content for m in messages], ['m3', 'm4'])
+        self.assertFalse(has_more)
+        self.assertIsNone(chat_history.fetch_after_id(self.channel, 10 ** 12))
+
+
+class ChatExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = CustomUser.objects.create_user(username='ada', password='x')
+        cls.bob = CustomUser.objects.create_user(username='bob', password='x')
+        cls.staff = CustomUser.objects.create_user(username='mod', password='x', is_staff=True)
+        server = Server.objects.create(name='A', slug='a', owner=cls.ada)
+        general = TextChannel.objects.create(server=server, name='general', slug='general')
+        other = TextChannel.objects.create(server=server, name='other', slug='other')
+        day = datetime(2031, 3, 10, 12, tzinfo=dt_timezone.utc)
+        for channel, user, content, moment in (
+            (general, cls.ada, 'first, with "quotes"', day),
+            (general, cls.bob, 'second', day + timedelta(hours=1)),
+            (other, cls.ada, 'elsewhere', day + timedelta(hours=2)),
+            (general, cls.ada, 'next day', day + timedelta(days=1)),
+        ):
+            ChatMessage.objects.create(channel=channel, user=user, content=content, created_at=moment)
+
+    def _export(self, export_format='ndjson', compress=False, **params):
+        queryset = chat_export.export_queryset_from_params(**params)
+        return b''.join(chat_export.export_chunks(queryset, export_format, compress=compress, chunk_size=2))
+
+    def test_filters_and_ndjson_lines(self):
+        body = self._export(server='a', channel='general', until='2031-03-10')
+        records = [json.loads(line) for line in body.splitlines()]
+        # until tek başına tarih: o gün dahil
+        self.assertEqual([r['content'] for r in records], ['first, with "quotes"', 'second'])
+        self.assertEqual((records[1]['username'], records[1]['channel']), ('bob', 'general'))
+        body = self._export(server='a', user='ada', since='2031-03-10T13:00:00+00:00')
+        self.assertEqual([json.loads(line)['content'] for line in body.splitlines()], ['elsewhere', 'next day'])
+
+    def test_gzipped_csv(self):
+        body = gzip.decompress(self._export('csv', compress=True, server='a'))
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8'))))
+        self.assertEqual(rows[0], list(chat_export.EXPORT_FIELDS))
+        self.assertEqual([row[5] for row in rows[1:]], ['first, with "quotes"', 'second', 'elsewhere', 'next day'])
+
+    def test_bad_filters_are_reported(self):
+        for params in ({'server': 'missing'}, {'channel': 'general'}, {'server': 'a', 'channel': 'missing'},
+                       {'since': 'yesterday'}):
+            with self.assertRaises(ValueError):
+                chat_export.export_queryset_from_params(**params)
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('export_chat_messages')
+        self.client.force_login(self.ada)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, {'server': 'missing'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+    async def test_endpoint_streams_the_export(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('export_chat_messages'), {'server': 'a', 'channel': 'other'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="chat-a-other.ndjson"')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)['content'] for line in body.splitlines()], ['elsewhere'])
+
+
+class ChatWriterRetryTests(TransactionTestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        server = Server.objects.create(name='A', slug='a', owner=self.ada)
+        self.channel = TextChannel.objects.create(server=server, name='general', slug='general')
+        # Arka plan döngüsü beklemede kalır (testin sonunda iptal edilir); yazımları test tetikler
+        self.writer = chat_writer.ChatWriter(
+            flush_interval_ms=60000, batch_size=100, max_pending=100, id_block_size=10,
+            max_attempts=3, retry_base_delay_ms=1,
+        )
+        self.real_bulk_create = ChatMessage.objects.bulk_create
+        self.failures = 0
+
+    def _flaky_bulk_create(self, objs, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError('database is down')
+        return self.real_bulk_create(objs, *args, **kwargs)
+
+    def _stop(self):
+        if self.writer._task is not None:
+            self.writer._task.cancel()
+
+    async def _submit(self, *contents):
+        return [await self.writer.submit(self.channel, self.ada, content) for content in contents]
+
+    async def test_failed_batch_is_retried_in_order(self):
+        self.failures = 1
+        retried = chat_writer.writer_metrics['retried']
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', self._flaky_bulk_create):
+            first, second = await self._submit('one', 'two')
+            try:
+                with self.assertLogs('main', 'ERROR'):
+                    await self.writer.flush()
+                self.assertEqual(chat_writer.writer_metrics['retried'] - retried, 2)
+                # Bekleyen mesajlar yeni gelenlerin önünde kalır
+                third, = await self._submit('three')
+                self.assertEqual([m.id for m in self.writer._pending], [first.id, second.id, third.id])
+                await self.writer.flush()
+            finally:
+                self._stop()
+        stored = await database_sync_to_async(list)(ChatMessage.objects.order_by('id').values_list('content', flat=True))
+        self.assertEqual(stored, ['one', 'two', 'three'])
+        self.assertEqual(self.writer._failures, 0)
+
+    async def test_batch_is_dropped_after_max_attempts(self):
+        self.failures = 3
+        dropped = chat_writer.writer_metrics['dropped']
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', self._flaky_bulk_create):
+            await self._submit('lost')
+            try:
+                with self.assertLogs('main', 'ERROR') as logs:
+                    for _ in range(3):
+                        await self.writer.flush()
+            finally:
+                self._stop()
+        self.assertIn('after 3 failed writes', logs.output[-1])
+        self.assertEqual(chat_writer.writer_metrics['dropped'] - dropped, 1)
+        self.assertEqual(self.writer._pending, [])
+        self.assertFalse(await database_sync_to_async(ChatMessage.objects.exists)())
+
+    def test_exit_flush_retries_too(self):
+        self.failures = 1
+        message = ChatMessage(channel=self.channel, user=self.ada, content='bye', created_at=timezone.now())
+        self.writer._pending = [message]
+        with mock.patch.object(ChatMessage.objects, 'bulk_create', self._flaky_bulk_create):
+            with self.assertLogs('main', 'ERROR'):
+                self.writer.flush_sync()
+        self.assertEqual(list(ChatMessage.objects.values_list('content', flat=True)), ['bye'])
+
+
+class ChatPartitionTests(TestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.keeper = Server.objects.create(name='Keeper', slug='keeper', owner=self.ada)
+        self.short = Server.objects.create(name='Short', slug='short', owner=self.ada, message_retention_days=10)
+        self.keeper_channel = TextChannel.objects.create(server=self.keeper, name='general', slug='general')
+        self.short_channel = TextChannel.objects.create(server=self.short, name='general', slug='general')
+
+    def _partitions(self):
+        with connection.cursor() as cursor:
+            return {name for name, _lower, _upper in chat_partitions.list_partitions(cursor)}
+
+    def test_upcoming_months_are_created_once(self):
+        now = datetime(2031, 11, 20, 12, tzinfo=dt_timezone.utc)
+        created = chat_partitions.ensure_partitions(now=now, months_ahead=2)
+        self.assertEqual(created, ['main_chatmessage_p2031_11', 'main_chatmessage_p2031_12', 'main_chatmessage_p2032_01'])
+        self.assertTrue(set(created) <= self._partitions())
+        self.assertEqual(chat_partitions.ensure_partitions(now=now, months_ahead=2), [])
+
+    @override_settings(CHAT_PARTITIONS={'retention_days': 30})
+    def test_retention_drops_old_months_and_trims_shorter_servers(self):
+        chat_partitions.ensure_partitions(now=datetime(2031, 1, 15, tzinfo=dt_timezone.utc), months_ahead=5)
+        now = datetime(2031, 6, 15, tzinfo=dt_timezone.utc)
+
+        def message(channel, day):
+            return ChatMessage.objects.create(channel=channel, user=self.ada, content='x', created_at=day)
+
+        message(self.keeper_channel, datetime(2031, 2, 3, tzinfo=dt_timezone.utc))
+        kept = message(self.keeper_channel, datetime(2031, 5, 20, tzinfo=dt_timezone.utc))
+        message(self.short_channel, datetime(2031, 6, 1, tzinfo=dt_timezone.utc))
+        recent = message(self.short_channel, datetime(2031, 6, 10, tzinfo=dt_timezone.utc))
+        with connection.cursor() as cursor:
+            # Test tek transaction: bekleyen ertelenmiş FK kontrolleri varken partition düşürülemez
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+        stats = chat_partitions.apply_retention(now=now, batch_size=1)
+
+        # 30 gün: 16 Mayıs'tan önce biten aylar tamamen düşer
+        self.assertTrue({'main_chatmessage_p2031_02', 'main_chatmessage_p2031_04'} <= set(stats['dropped']))
+        self.assertNotIn('main_chatmessage_p2031_05', stats['dropped'])
+        self.assertTrue({'main_chatmessage_p2031_05', 'main_chatmessage_p2031_06'} <= self._partitions())
+        self.assertEqual(stats['deleted'], 1)
+        self.assertEqual(set(ChatMessage.objects.values_list('id', flat=True)), {kept.id, recent.id})
+
+    def test_servers_keeping_messages_forever_block_partition_drops(self):
+        policies, longest = chat_partitions.retention_policies()
+        self.assertEqual(policies, {self.short.id: 10})
+        self.assertIsNone(longest)
+
+
+class ChatRenderTests(SimpleTestCase):
+    def test_html_is_escaped(self):
+        rendered = render_message('<script>alert("x")</script> & **<b>**')
+        self.assertEqual(rendered['html'], '&lt;script&gt;alert("x")&lt;/script&gt; &amp; <strong>&lt;b&gt;</strong>')
+
+    def test_mentions_keep_trailing_punctuation(self):
+        rendered = render_message('@bob. hi @bob and mail ada@example.com')
+        self.assertEqual(
+            rendered['html'],
+            '<span class="mention" data-username="bob">@bob</span>. hi '
+            '<span class="mention" data-username="bob">@bob</span> and mail ada@example.com',
+        )
+        self.assertEqual(rendered['mentions'], ['bob'])
+
+    def test_links_are_not_formatted_inside(self):
+        rendered = render_message('see https://example.com/a_b*c*?x=1&y=2.')
+        self.assertEqual(rendered['links'], ['https://example.com/a_b*c*?x=1&y=2'])
+        self.assertIn('<a href="https://example.com/a_b*c*?x=1&amp;y=2" target="_blank"', rendered['html'])
+        self.assertTrue(rendered['html'].endswith('</a>.'))
+        self.assertNotIn('<em>', rendered['html'])
+
+    def test_code_is_left_alone(self):
+        rendered = render_message('`**not bold** @bob` **bold**\nline')
+        self.assertEqual(rendered['html'], '<code>**not bold** @bob</code> <strong>bold</strong><br>line')
+        self.assertEqual(rendered['mentions'], [])
+
+    def test_non_string_content(self):
+        self.assertEqual(render_message(None), {'html': '', 'mentions': [], 'links': []})
+
+
+def _ring_message(message_id, second, channel_id=1):
+    return {'id': message_id, 'channel_id': channel_id, 'timestamp': f'2026-01-01T00:00:{second:02d}+00:00'}
+
+
+class ChatMessagesApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = CustomUser.objects.create_user(username='ada', password='x')
+        cls.bob = CustomUser.objects.create_user(username='bob', password='x')
+        private = Server.objects.create(name='A', slug='a', owner=cls.ada, is_private=True)
+        public = Server.objects.create(name='B', slug='b', owner=cls.bob)
+        cls.private_channel = TextChannel.objects.create(server=private, name='general', slug='general')
+        cls.public_channel = TextChannel.objects.create(server=public, name='general', slug='general')
+        ChatMessage.objects.create(channel=cls.private_channel, user=cls.ada, content='secret')
+        ChatMessage.objects.create(channel=cls.public_channel, user=cls.bob, content='hello')
+
+    def setUp(self):
+        # channel_access önbelleği testler arasında taşınmasın
+        caches['default'].clear()
+
+    def _get(self, user, **params):
+        self.client.force_login(user)
+        return self.client.get(reverse('chat_messages_api', args=['general']), params)
+
+    def test_server_slug_picks_the_channel(self):
+        response = self._get(self.bob, server_slug='b', limit=100)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['content'] for m in response.json()['messages']], ['hello'])
+
+    def test_private_channel_is_forbidden_to_non_members(self):
+        self.assertEqual(self._get(self.bob, server_slug='a').status_code, 403)
+        self.assertEqual(self._get(self.bob, server_slug='a', limit=100).status_code, 403)
+        self.assertEqual(self._get(self.ada, server_slug='a').status_code, 200)
+
+    def test_ambiguous_or_unknown_slug_is_not_found(self):
+        with self.assertLogs('main', 'WARNING'):
+            self.assertEqual(self._get(self.bob).status_code, 404)
+        self.assertEqual(self._get(self.bob, server_slug='nope').status_code, 404)
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.server = Server.objects.create(name='Test', slug='test', owner=self.ada)
+        ServerMember.objects.create(server=self.server, user=self.ada)
+        ServerMember.objects.create(server=self.server, user=self.bob)
+        self.channel = TextChannel.objects.create(server=self.server, name='general', slug='general')
+        self.start = timezone.now() - timedelta(minutes=5)
+
+    def _write(self, user, seconds, message_id):
+        # ChatWriter gibi: id önceden ayrılmış, sayaçlar yazımdan sonra
+        message = ChatMessage.objects.create(
+            id=message_id, channel=self.channel, user=user, content='m', created_at=self.start + timedelta(seconds=seconds)
+        )
+        read_state.record_new_messages([message])
+        return message
+
+    def _unread(self, user):
+        return read_state.unread_counts(user, self.server).get(self.channel.id, 0)
+
+    def test_new_channel_and_member_get_read_states(self):
+        self.assertEqual(ChannelReadState.objects.filter(channel=self.channel).count(), 2)
+
+    def test_authors_skip_their_own_messages(self):
+        self._write(self.ada, 1, 900001)
+        self._write(self.ada, 2, 900002)
+        self._write(self.bob, 3, 900003)
+        self.assertEqual((self._unread(self.ada), self._unread(self.bob)), (1, 2))
+        self.assertEqual(read_state.mark_read(self.bob, self.channel), 0)
+        self.assertEqual(self._unread(self.bob), 0)
+
+    def test_mark_read_counts_what_follows(self):
+        first = self._write(self.ada, 1, 900001)
+        self._write(self.ada, 1, 900002)
+        self._write(self.bob, 2, 900003)
+        self._write(self.ada, 3, 900004)
+        self.assertEqual(read_state.mark_read(self.bob, self.channel, first.id), 2)
+
+    def test_read_mark_follows_time_not_id(self):
+        # İki worker'ın id blokları: sonra yazılan mesajın id'si daha küçük olabilir
+        read = self._write(self.ada, 1, 900500)
+        read_state.mark_read(self.bob, self.channel, read.id)
+        self._write(self.ada, 0, 900001)
+        self.assertEqual(self._unread(self.bob), 0)
+        self._write(self.ada, 2, 900002)
+        self.assertEqual(self._unread(self.bob), 1)
+
+    def test_batch_counts_only_messages_after_the_mark(self):
+        read = self._write(self.ada, 2, 900500)
+        read_state.mark_read(self.bob, self.channel, read.id)
+        batch = [
+            ChatMessage.objects.create(id=900001 + n, channel=self.channel, user=self.ada, content='m',
+                                       created_at=self.start + timedelta(seconds=seconds))
+            for n, seconds in enumerate((1, 3, 4))
+        ]
+        read_state.record_new_messages(batch)
+        self.assertEqual(self._unread(self.bob), 2)
+
+
+class MessageSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = CustomUser.objects.create_user(username='ada', password='x')
+        cls.bob = CustomUser.objects.create_user(username='bob', password='x')
+        server = Server.objects.create(name='Test', slug='test', owner=cls.ada)
+        cls.public = TextChannel.objects.create(server=server, name='general', slug='general')
+        cls.private = TextChannel.objects.create(server=server, name='staff', slug='staff', is_private=True)
+        other = Server.objects.create(name='Other', slug='other', owner=cls.bob)
+        elsewhere = TextChannel.objects.create(server=other, name='general', slug='general')
+        ChatMessage.objects.create(channel=cls.public, user=cls.ada, content='The dogs were running home')
+        ChatMessage.objects.create(channel=cls.private, user=cls.ada, content='Staff dogs meeting')
+        ChatMessage.objects.create(channel=elsewhere, user=cls.bob, content='Other dogs')
+        ChatMessage.objects.create(channel=cls.public, user=cls.ada, content='Köpekler koşuyor', language='tr')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def _search(self, user, **params):
+        self.client.force_login(user)
+        return self.client.get(reverse('search_messages', args=['test']), params)
+
+    def test_trigger_fills_the_vector_and_stems(self):
+        response = self._search(self.ada, q='run')
+        self.assertEqual([r['content'] for r in response.json()['results']], ['The dogs were running home'])
+
+    def test_results_stay_in_the_server_and_visible_channels(self):
+        self.assertEqual(
+            sorted(r['content'] for r in self._search(self.ada, q='dogs').json()['results']),
+            ['Staff dogs meeting', 'The dogs were running home'],
+        )
+        # Üye olmayan: özel kanal görünmez
+        self.assertEqual(
+            [r['content'] for r in self._search(self.bob, q='dogs').json()['results']],
+            ['The dogs were running home'],
+        )
+        self.assertEqual(self._search(self.bob, q='dogs', channel='staff').status_code, 404)
+
+    def test_message_language_picks_the_stemmer(self):
+        response = self._search(self.ada, q='köpek')
+        self.assertEqual([r['content'] for r in response.json()['results']], ['Köpekler koşuyor'])
+
+
+class ChatRingTests(SimpleTestCase):
+    def test_unsubscribed_channel_is_not_cached(self):
+        ring = ChatRing(size=3)
+        ring.record(1, _ring_message(1, 1))
+        self.assertIsNone(ring.cached(1))
+        loaded = ([_ring_message(1, 1)], False)
+        self.assertEqual(ring.recent(1, lambda: loaded), loaded)
+        self.assertIsNone(ring.cached(1))
+
+    def test_load_merges_messages_broadcast_meanwhile(self):
+        ring = ChatRing(size=3)
+        ring.subscribe(1)
+        ring.record(1, _ring_message(3, 3))
+        messages, has_more = ring.recent(1, lambda: ([_ring_message(1, 1), _ring_message(2, 2)], True))
+        self.assertEqual([m['id'] for m in messages], [1, 2, 3])
+        self.assertTrue(has_more)
+        self.assertEqual(ring.cached(1), (messages, True))
+
+    def test_records_dedupe_sort_and_trim(self):
+        ring = ChatRing(size=3)
+        ring.subscribe(1)
+        ring.recent(1, lambda: ([], False))
+        for message_id, second in ((1, 1), (3, 3), (3, 3), (2, 2), (4, 4)):
+            ring.record(1, _ring_message(message_id, second))
+        messages, has_more = ring.cached(1)
+        self.assertEqual([m['id'] for m in messages], [2, 3, 4])
+        self.assertTrue(has_more)
+        self.assertEqual([m['id'] for m in ring.messages_after(1, 2)], [3, 4])
+        self.assertIsNone(ring.messages_after(1, 1))
+
+    def test_other_channels_messages_are_ignored(self):
+        ring = ChatRing(size=3)
+        ring.subscribe(1)
+        ring.recent(1, lambda: ([], False))
+        ring.record(1, _ring_message(1, 1, channel_id=2))
+        self.assertEqual(ring.cached(1), ([], False))
+
+    def test_last_unsubscribe_drops_the_ring(self):
+        ring = ChatRing(size=3)
+        ring.subscribe(1)
+        ring.subscribe(1)
+        ring.recent(1, lambda: ([_ring_message(1, 1)], False))
+        ring.unsubscribe(1)
+        self.assertIsNotNone(ring.cached(1))
+        ring.unsubscribe(1)
+        self.assertIsNone(ring.cached(1))
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.server = Server.objects.create(name='Test', slug='test', owner=self.ada)
+        self.member = ServerMember.objects.create(server=self.server, user=self.ada)
+
+    def _service(self):
+        return presence.PresenceService(
+            heartbeat_seconds=30, ttl_seconds=90, flush_interval_seconds=5, resync_every=12, stale_after_seconds=300
+        )
+
+    def test_connection_without_heartbeats_expires(self):
+        table = presence.PresenceTable(ttl_seconds=90)
+        table.heartbeat(self.ada.id, 'a', now=0)
+        table.heartbeat(self.ada.id, 'b', now=0)
+        table.heartbeat(self.ada.id, 'a', now=60)
+        self.assertEqual(table.expire(now=100), 1)
+        self.assertTrue(table.is_online(self.ada.id))
+        self.assertEqual(table.expire(now=150), 1)
+        self.assertFalse(table.is_online(self.ada.id))
+        # Çevrimiçi ve çevrimdışı arasında flush olmadı: yazılacak değişiklik yok
+        self.assertEqual(table.drain_changes(), {})
+
+    def test_changes_are_written_as_diffs(self):
+        service = self._service()
+        diffs = service._write({self.ada.id: True}, [])
+        self.assertEqual(diffs, {self.server.id: {'online': ['ada'], 'offline': []}})
+        self.member.refresh_from_db()
+        self.assertTrue(self.member.is_online)
+        self.assertIsNotNone(self.member.last_seen_at)
+        diffs = service._write({self.ada.id: False}, [])
+        self.assertEqual(diffs, {self.server.id: {'online': [], 'offline': ['ada']}})
+        self.member.refresh_from_db()
+        self.assertFalse(self.member.is_online)
+
+    def test_reconcile_resets_rows_nobody_stamps(self):
+        ServerMember.objects.filter(pk=self.member.pk).update(
+            is_online=True, last_seen_at=timezone.now() - timedelta(seconds=301)
+        )
+        with self.assertLogs('main', 'INFO'):
+            diffs = self._service()._write({}, [], reconcile=True)
+        self.assertEqual(diffs, {self.server.id: {'online': [], 'offline': ['ada']}})
+        self.assertFalse(ServerMember.objects.get(pk=self.member.pk).is_online)
+
+    def test_room_page_sends_heartbeats(self):
+        channel = VoiceChannel.objects.create(server=self.server, name='lounge', slug='lounge')
+        self.client.force_login(self.ada)
+        response = self.client.get(reverse('odasayfasi', args=[channel.slug]))
+        self.assertContains(response, "signal_type: 'heartbeat'")
+        self.assertContains(response, 'const PRESENCE_HEARTBEAT_MS = 30 * 1000;')
+
+
+class VoiceRosterAdmissionTests(SimpleTestCase):
+    def setUp(self):
+        self.roster = VoiceRoster()
+
+    def _join(self, user_id, channel_name, limit=2):
+        return self.roster.admit('voice_room', make_entry(user_id, f'user{user_id}', channel_name, local=True), limit)
+
+    def test_limit_counts_distinct_users(self):
+        self.assertEqual(self._join(1, 'c1'), (True, []))
+        admitted, others = self._join(2, 'c2')
+        self.assertTrue(admitted)
+        self.assertEqual([member['user_id'] for member in others], ['1'])
+        # Aynı kullanıcının ikinci bağlantısı sınıra takılmaz
+        self.assertTrue(self._join(1, 'c1b')[0])
+        self.assertFalse(self._join(3, 'c3')[0])
+        self.assertTrue(self._join(3, 'c3', limit=0)[0])
+
+    def test_leaving_frees_a_seat(self):
+        self._join(1, 'c1')
+        self._join(2, 'c2')
+        self.roster.discard('voice_room', 'c2')
+        self.assertTrue(self._join(3, 'c3')[0])
+
+    def test_remote_members_count_and_room_drops_without_local_members(self):
+        self.roster.seed('voice_room', [make_entry(9, 'remote', 'r9')])
+        self.assertTrue(self._join(1, 'c1')[0])
+        self.assertFalse(self._join(2, 'c2')[0])
+        self.roster.discard('voice_room', 'c1')
+        self.assertEqual(self.roster.snapshot('voice_room'), [])
+
+    def test_rejected_first_join_does_not_keep_the_room(self):
+        self.roster.seed('voice_room', [make_entry(8, 'r8', 'r8'), make_entry(9, 'r9', 'r9')])
+        self.assertFalse(self._join(1, 'c1')[0])
+        self.assertEqual(self.roster.snapshot('voice_room'), [])
+        self.assertFalse(self.roster.has_local('voice_room'))
+
+    def test_mirror_only_updates_kept_rooms(self):
+        self.roster.mirror('voice_room', make_entry(9, 'remote', 'r9'))
+        self.assertEqual(self.roster.snapshot('voice_room'), [])
+        self._join(1, 'c1')
+        self.roster.mirror('voice_room', make_entry(9, 'remote', 'r9', muted=True))
+        snapshot = {entry['user_id']: entry for entry in self.roster.snapshot('voice_room')}
+        self.assertTrue(snapshot['9']['muted'])
+        self.assertFalse(snapshot['9']['local'])
+
+
+class SFUClientTests(SimpleTestCase):
+    def test_sfu_needs_a_single_process_layer(self):
+        channel = VoiceChannel(sfu_enabled=True, sfu_threshold=3)
+        with mock.patch.object(sfu, 'SFU_AVAILABLE', True), mock.patch.object(sfu, '_warned_multi_process', False):
+            self.assertTrue(sfu.use_sfu(channel, 3))
+            self.assertFalse(sfu.use_sfu(channel, 2))
+            layers = {'default': {'BACKEND': 'main.pg_layer.PostgresChannelLayer'}}
+            with self.settings(CHANNEL_LAYERS=layers), self.assertLogs('main', 'WARNING'):
+                self.assertFalse(sfu.use_sfu(channel, 3))
+        self.assertFalse(sfu.use_sfu(VoiceChannel(sfu_enabled=False), 10))
+
+    async def test_worker_replies_reach_the_waiting_request(self):
+        client = sfu.SFUClient(workers=1, request_timeout_seconds=2)
+        requests, events = queue.Queue(), queue.Queue()
+        # Worker süreci yerine aynı sözleşmeyle cevap veren bir thread
+        client._workers = [(None, requests)]
+
+        def worker():
+            while True:
+                request = requests.get()
+                if request is None:
+                    break
+                if request['command'] == 'stats':
+                    events.put({'id': request['id'], 'result': {'room': request['args']['room']}})
+                else:
+                    events.put({'id': request['id'], 'error': 'RuntimeError: boom'})
+
+        threading.Thread(target=worker, daemon=True).start()
+        threading.Thread(target=client._read_events, args=(events,), daemon=True).start()
+        try:
+            results = await asyncio.gather(*(client.stats(f'voice_{n}') for n in range(20)))
+            self.assertEqual(results, [{'room': f'voice_{n}'} for n in range(20)])
+            with self.assertRaises(sfu.SFUError):
+                await client.candidate('voice_1', 'peer', {})
+            self.assertEqual(client._pending, {})
+        finally:
+            requests.put(None)
+
+
+class EphemeralHubTests(SimpleTestCase):
+    def _hub(self, **config):
+        settings = {'layer': 'ephemeral', 'flush_interval_ms': 10, 'typing_ttl_seconds': 0.2,
+                    'speaking_ttl_seconds': 0.2, 'queue_size': 2}
+        settings.update(config)
+        return ephemeral.EphemeralHub(**settings)
+
+    async def _next(self, queue):
+        return await asyncio.wait_for(queue.get(), 2)
+
+    async def test_updates_coalesce_and_skip_the_sender(self):
+        hub = self._hub()
+        own = await hub.subscribe('room', 1, 'a')
+        other = await hub.subscribe('room', 2, 'b')
+        try:
+            for _ in range(5):
+                hub.publish('room', 1, 'ada', 'a', 'typing', True)
+            frame = await self._next(other)
+            self.assertEqual([(e['username'], e['kind'], e['active']) for e in frame['events']], [('ada', 'typing', True)])
+            # Yenilenmeyen gösterge ttl sonunda kapanır
+            frame = await self._next(other)
+            self.assertEqual([(e['username'], e['active']) for e in frame['events']], [('ada', False)])
+            self.assertTrue(own.empty())
+        finally:
+            await hub.unsubscribe('room', 'a')
+            await hub.unsubscribe('room', 'b')
+        self.assertEqual(hub._tasks, [])
+
+    async def test_unsubscribe_closes_open_indicators(self):
+        hub = self._hub(typing_ttl_seconds=60)
+        await hub.subscribe('room', 1, 'a')
+        other = await hub.subscribe('room', 2, 'b')
+        try:
+            hub.publish('room', 1, 'ada', 'a', 'typing', True)
+            await self._next(other)
+            await hub.unsubscribe('room', 'a')
+            frame = await self._next(other)
+            self.assertEqual([(e['username'], e['active']) for e in frame['events']], [('ada', False)])
+        finally:
+            await hub.unsubscribe('room', 'b')
+
+    def test_slow_reader_keeps_the_newest_frames(self):
+        subscriber = ephemeral._Subscriber('2', 2)
+        for n in range(4):
+            subscriber.offer({'n': n})
+        self.assertEqual([subscriber.queue.get_nowait()['n'] for _ in range(2)], [2, 3])
+
+    async def test_loops_keep_running_after_an_error(self):
+        hub = self._hub(typing_ttl_seconds=60)
+        await hub.subscribe('room', 1, 'a')
+        other = await hub.subscribe('room', 2, 'b')
+        real_flush_room = hub.flush_room
+        calls = []
+
+        async def failing_once(room):
+            calls.append(room)
+            if len(calls) == 1:
+                raise RuntimeError('layer down')
+            await real_flush_room(room)
+
+        try:
+            with mock.patch.object(ephemeral, 'RESTART_DELAY_SECONDS', 0), \
+                    mock.patch.object(hub, 'flush_room', failing_once), \
+                    self.assertLogs('main', 'ERROR'):
+                hub.publish('room', 1, 'ada', 'a', 'typing', True)
+                # İlk flush hata verdi; döngü devam eder ve bekleyen olayı sonraki turda gönderir
+                frame = await self._next(other)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual([e['kind'] for e in frame['events']], ['typing'])
+            self.assertFalse(any(task.done() for task in hub._tasks))
+        finally:
+            await hub.unsubscribe('room', 'a')
+            await hub.unsubscribe('room', 'b')
+
+
+class PendingDeletionTests(TestCase):
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.server = Server.objects.create(name='Test', slug='test', owner=self.ada)
+        self.channel = TextChannel.objects.create(server=self.server, name='general', slug='general')
+        other = Server.objects.create(name='Other', slug='other', owner=self.bob)
+        self.other_channel = TextChannel.objects.create(server=other, name='general', slug='general')
+        ServerMember.objects.create(server=self.server, user=self.bob)
+        ServerMember.objects.create(server=other, user=self.ada)
+        for i in range(5):
+            ChatMessage.objects.create(channel=self.channel, user=self.bob, content=f'm{i}')
+        for i in range(3):
+            ChatMessage.objects.create(channel=self.other_channel, user=self.ada, content=f'o{i}')
+        ChatMessage.objects.create(channel=self.other_channel, user=self.bob, content='stays')
+        self.reports = {}
+
+    def _report(self, label, count):
+        self.reports.setdefault(label, []).append(count)
+
+    def test_request_deletion_releases_names_and_hides_rows(self):
+        self.server.request_deletion()
+        self.assertEqual(self.server.slug, f'test~deleted~{self.server.pk}')
+        self.assertFalse(Server.objects.filter(pk=self.server.pk).exists())
+        self.assertFalse(TextChannel.objects.filter(pk=self.channel.pk).exists())
+        self.assertTrue(TextChannel.all_objects.filter(pk=self.channel.pk).exists())
+        # Ad ve slug temizlikten önce tekrar kullanılabilir
+        Server.objects.create(name='Test', slug='test', owner=self.bob)
+
+    def test_server_is_purged_in_batches(self):
+        self.server.request_deletion()
+        stats = maintenance.process_pending_deletions(batch_size=2, report=self._report)
+        self.assertEqual(stats, {'servers': 1, 'text_channels': 0, 'users': 0})
+        self.assertEqual(self.reports[f'{self.channel} messages'], [2, 4, 5])
+        self.assertFalse(Server.all_objects.filter(pk=self.server.pk).exists())
+        self.assertFalse(TextChannel.all_objects.filter(pk=self.channel.pk).exists())
+        self.assertFalse(ServerMember.objects.filter(user=self.bob, server_id=self.server.pk).exists())
+        self.assertEqual(ChatMessage.objects.filter(channel=self.other_channel).count(), 4)
+
+    def test_user_is_purged_with_owned_servers(self):
+        self.ada.request_deletion()
+        stats = maintenance.process_pending_deletions(batch_size=2, report=self._report)
+        self.assertEqual(stats, {'servers': 0, 'text_channels': 0, 'users': 1})
+        self.assertIn([2, 3], self.reports.values())
+        self.assertFalse(CustomUser.all_objects.filter(pk=self.ada.pk).exists())
+        self.assertFalse(Server.all_objects.filter(pk=self.server.pk).exists())
+        self.assertEqual(list(ChatMessage.objects.filter(channel=self.other_channel).values_list('content', flat=True)), ['stays'])
+        self.assertEqual(ServerMember.objects.filter(user=self.ada.pk).count(), 0)
+        self.assertTrue(CustomUser.objects.create_user(username='ada', password='x').pk)
+
+    def test_nothing_pending(self):
+        self.assertEqual(maintenance.process_pending_deletions(report=self._report), {'servers': 0, 'text_channels': 0, 'users': 0})
+        self.assertEqual(self.reports, {})
+
+
+class ChannelAccessTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.server = Server.objects.create(name='A', slug='a', owner=self.ada, is_private=True)
+        self.channel = TextChannel.objects.create(server=self.server, name='general', slug='general')
+
+    def test_private_server_admits_owner_and_members(self):
+        self.assertEqual(channel_access.resolve('a', 'text', 'general', self.ada.id), (self.channel, True))
+        self.assertEqual(channel_access.resolve('a', 'text', 'general', self.bob.id), (self.channel, False))
+        self.assertEqual(channel_access.resolve('a', 'voice', 'general', self.ada.id), (None, False))
+        self.assertEqual(channel_access.resolve('nope', 'text', 'general', self.ada.id), (None, False))
+
+    def test_membership_changes_invalidate_the_cache(self):
+        channel_access.resolve('a', 'text', 'general', self.bob.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            member = ServerMember.objects.create(server=self.server, user=self.bob)
+        self.assertTrue(channel_access.resolve('a', 'text', 'general', self.bob.id)[1])
+        # Üye silmek sinyal göndermez; silen kod invalidate() çağırır
+        with self.captureOnCommitCallbacks(execute=True):
+            member.delete()
+            channel_access.invalidate('a')
+        self.assertFalse(channel_access.resolve('a', 'text', 'general', self.bob.id)[1])
+
+    def test_warm_lookup_costs_no_queries(self):
+        channel_access.resolve('a', 'text', 'general', self.ada.id)
+        with self.assertNumQueries(0):
+            channel_access.resolve('a', 'text', 'general', self.ada.id)
+
+    def test_per_process_cache_is_refused_with_a_multi_process_layer(self):
+        layers = {'default': {'BACKEND': 'main.pg_layer.PostgresChannelLayer'}}
+        with self.settings(CHANNEL_LAYERS=layers, CHANNEL_ACCESS={'cache': 'default'}):
+            with self.assertRaises(ImproperlyConfigured):
+                channel_access.check_cache_is_shared()
+        shared = dict(settings.CACHES, shared={
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'main_shared_cache',
+        })
+        with self.settings(CHANNEL_LAYERS=layers, CACHES=shared, CHANNEL_ACCESS={'cache': 'shared'}):
+            channel_access.check_cache_is_shared()
+
+
+def reset_process_singletons(test):
+    # Süreç başına tekiller ilk kullandıkları event loop'a bağlanır; her test kendi loop'unda
+    for module, name in ((chat_writer, '_writer'), (ephemeral, '_hub'), (presence, '_service')):
+        patcher = mock.patch.object(module, name, None)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class VoiceChatConsumerTests(TransactionTestCase):
+    """Consumers query from worker threads, so the rows must be committed."""
+
+    def setUp(self):
+        reset_process_singletons(self)
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.server_a = Server.objects.create(name='A', slug='a', owner=self.ada, is_private=True)
+        self.server_b = Server.objects.create(name='B', slug='b', owner=self.bob)
+        self.channel_a = TextChannel.objects.create(server=self.server_a, name='general', slug='general')
+        self.channel_b = TextChannel.objects.create(server=self.server_b, name='general', slug='general')
+
+    async def _connect(self, user, server_slug, channel_slug='general', channel_type='text', query=''):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/voice/?server_slug={server_slug}&channel_slug={channel_slug}&channel_type={channel_type}{query}',
+        )
+        communicator.scope['user'] = user
+        connected, _code = await communicator.connect()
+        return communicator, connected
+
+    async def test_private_server_of_another_owner_is_refused(self):
+        with self.assertLogs('main', 'WARNING'):
+            communicator, connected = await self._connect(self.bob, 'a')
+        self.assertFalse(connected)
+        await communicator.disconnect()
+
+    async def test_same_slug_on_two_servers_are_separate_rooms(self):
+        ada, connected = await self._connect(self.ada, 'a')
+        self.assertTrue(connected)
+        bob, connected = await self._connect(self.bob, 'b')
+        self.assertTrue(connected)
+        try:
+            self.assertEqual((await ada.receive_json_from())['type'], 'chat_history')
+            self.assertEqual((await bob.receive_json_from())['type'], 'chat_history')
+            await ada.send_json_to({'signal_type': 'typing', 'data': {'active': True}})
+            await ada.send_json_to({'signal_type': 'chat_message', 'data': 'only for a'})
+            frame = await ada.receive_json_from()
+            self.assertEqual((frame['type'], frame['message']), ('chat_message', 'only for a'))
+            self.assertTrue(await bob.receive_nothing(0.5))
+        finally:
+            await ada.disconnect()
+            await bob.disconnect()
+            await chat_writer.get_chat_writer().flush()
+
+    async def test_reconnect_catches_up_after_the_last_seen_message(self):
+        start = timezone.now() - timedelta(minutes=5)
+        create = database_sync_to_async(ChatMessage.objects.create)
+        seen, *missed = [
+            await create(channel=self.channel_b, user=self.bob, content=f'm{i}', created_at=start + timedelta(seconds=i))
+            for i in range(4)
+        ]
+
+        bob, connected = await self._connect(self.bob, 'b', query=f'&last_message_id={seen.id}')
+        self.assertTrue(connected)
+        frame = await bob.receive_json_from()
+        await bob.disconnect()
+        self.assertEqual(frame['type'], 'chat_catchup')
+        self.assertFalse(frame['too_far_behind'])
+        self.assertEqual([m['id'] for m in frame['messages']], [m.id for m in missed])
+
+        # Çok geride kalan (ya da bilinmeyen id) istemci baştan geçmişi alır
+        with mock.patch('main.consumers.CATCHUP_LIMIT', 2):
+            bob, connected = await self._connect(self.bob, 'b', query=f'&last_message_id={seen.id}')
+            frames = [await bob.receive_json_from(), await bob.receive_json_from()]
+            await bob.disconnect()
+        self.assertEqual([(f['type'], f.get('too_far_behind')) for f in frames],
+                         [('chat_catchup', True), ('chat_history', None)])
+        self.assertEqual([m['content'] for m in frames[1]['messages']], ['m0', 'm1', 'm2', 'm3'])
+
+    @override_settings(VOICE_SIGNALING={'ice_batch_window_ms': 60000, 'ice_batch_max': 3})
+    async def test_ice_candidates_are_batched_and_flushed_before_sdp(self):
+        await database_sync_to_async(VoiceChannel.objects.create)(server=self.server_b, name='voice', slug='voice')
+        bob, connected = await self._connect(self.bob, 'b', 'voice', 'voice', '&signal_batching=1')
+        self.assertTrue(connected)
+        # Eski istemci: toplu çerçeveyi anlamaz, adaylar tek tek gelir
+        ada, connected = await self._connect(self.ada, 'b', 'voice', 'voice')
+        self.assertTrue(connected)
+        try:
+            ada_channel = (await self._joined(bob, 'ada'))['channel_name']
+
+            def candidate(n):
+                return {'signal_type': 'ice_candidate', 'recipient_id': str(self.ada.id),
+                        'recipient_channel': ada_channel, 'data': {'candidate': n}}
+
+            # ice_batch_max dolunca pencere beklenmez
+            for n in range(3):
+                await bob.send_json_to(candidate(n))
+            frames = [await self._receive_until(ada, 'webrtc_signal') for _ in range(3)]
+            self.assertEqual([(f['signal_type'], f['data']) for f in frames],
+                             [('ice_candidate', {'candidate': n}) for n in range(3)])
+            self.assertEqual(frames[0]['sender_channel'], frames[2]['sender_channel'])
+
+            # Bekleyen adaylar SDP'den önce gider
+            await bob.send_json_to(candidate(3))
+            await bob.send_json_to({'signal_type': 'offer', 'recipient_id': str(self.ada.id),
+                                    'recipient_channel': ada_channel, 'data': {'type': 'offer'}})
+            frames = [await self._receive_until(ada, 'webrtc_signal') for _ in range(2)]
+            self.assertEqual([f['signal_type'] for f in frames], ['ice_candidate', 'offer'])
+        finally:
+            await bob.disconnect()
+            await ada.disconnect()
+
+    async def _receive_until(self, communicator, frame_type, event=None):
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == frame_type and (event is None or frame.get('event') == event):
+                return frame
+
+    async def _joined(self, communicator, username):
+        while True:
+            frame = await self._receive_until(communicator, 'system_notification', 'member_joined')
+            if frame['username'] == username:
+                return frame
+
+    async def test_signals_reach_the_tab_they_are_addressed_to(self):
+        await database_sync_to_async(VoiceChannel.objects.create)(server=self.server_b, name='voice', slug='voice')
+        tabs = []
+        try:
+            for _ in range(2):
+                tab, connected = await self._connect(self.bob, 'b', 'voice', 'voice', '&signal_batching=1')
+                self.assertTrue(connected)
+                tabs.append(tab)
+            ada, connected = await self._connect(self.ada, 'b', 'voice', 'voice', '&signal_batching=1')
+            self.assertTrue(connected)
+            tabs.append(ada)
+            first, second = tabs[:2]
+            ada_channel = (await self._joined(first, 'ada'))['channel_name']
+            self.assertEqual((await self._joined(second, 'ada'))['channel_name'], ada_channel)
+
+            # İkinci sekme teklif eder; cevap sadece o sekmeye döner
+            await second.send_json_to({
+                'signal_type': 'offer', 'recipient_id': str(self.ada.id),
+                'recipient_channel': ada_channel, 'data': {'type': 'offer'},
+            })
+            offer = await self._receive_until(ada, 'webrtc_signal')
+            self.assertEqual(offer['sender_id'], str(self.bob.id))
+            await ada.send_json_to({
+                'signal_type': 'answer', 'recipient_id': offer['sender_id'],
+                'recipient_channel': offer['sender_channel'], 'data': {'type': 'answer'},
+            })
+            answer = await self._receive_until(second, 'webrtc_signal')
+            self.assertEqual((answer['signal_type'], answer['recipient_channel']), ('answer', offer['sender_channel']))
+
+            # Aday akışı ilk sekmeye; pencere içindekiler tek çerçevede
+            await first.send_json_to({
+                'signal_type': 'offer', 'recipient_id': str(self.ada.id),
+                'recipient_channel': ada_channel, 'data': {'type': 'offer'},
+            })
+            first_channel = (await self._receive_until(ada, 'webrtc_signal'))['sender_channel']
+            self.assertNotEqual(first_channel, offer['sender_channel'])
+            for candidate in ('c1', 'c2'):
+                await ada.send_json_to({
+                    'signal_type': 'ice_candidate', 'recipient_id': str(self.bob.id),
+                    'recipient_channel': first_channel, 'data': {'candidate': candidate},
+                })
+            batch = await self._receive_until(first, 'webrtc_signal')
+            self.assertEqual(batch['signal_type'], 'ice_candidates')
+            self.assertEqual([c['candidate'] for c in batch['data']], ['c1', 'c2'])
+            while not await second.receive_nothing(0.3):
+                self.assertNotEqual((await second.receive_json_from())['type'], 'webrtc_signal')
+        finally:
+            for tab in tabs:
+                await tab.disconnect()
+
+
+class MultiplexConsumerTests(TransactionTestCase):
+    def setUp(self):
+        reset_process_singletons(self)
+        self.ada = CustomUser.objects.create_user(username='ada', password='x')
+        self.bob = CustomUser.objects.create_user(username='bob', password='x')
+        self.private = Server.objects.create(name='A', slug='a', owner=self.ada, is_private=True)
+        server = Server.objects.create(name='B', slug='b', owner=self.bob)
+        TextChannel.objects.create(server=self.private, name='general', slug='general')
+        self.channel = TextChannel.objects.create(server=server, name='general', slug='general')
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/mux/')
+        communicator.scope['user'] = user
+        connected, _code = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _subscribe(self, mux, stream, server_slug='b'):
+        await mux.send_json_to({
+            'action': 'subscribe', 'stream': stream,
+            'path': f'/ws/voice/?server_slug={server_slug}&channel_slug=general&channel_type=text',
+        })
+
+    async def _frame(self, mux, stream):
+        """Next frame of stream; other streams' frames are skipped."""
+        while True:
+            frame = await mux.receive_json_from()
+            if frame['stream'] == stream:
+                return json.loads(frame['text']) if 'text' in frame else frame
+
+    async def _released(self):
+        # close çerçevesi iç consumer'ın disconnect'i bitmeden gider
+        for _ in range(100):
+            if self.channel.id not in chat_ring._subscribers:
+                return True
+            await asyncio.sleep(0.02)
+        return False
+
+    async def test_stream_lifecycle(self):
+        mux = await self._connect(self.bob)
+        try:
+            await self._subscribe(mux, 'chat')
+            self.assertEqual(await self._frame(mux, 'chat'), {'stream': 'chat', 'event': 'accept'})
+            self.assertEqual((await self._frame(mux, 'chat'))['type'], 'chat_history')
+            self.assertIn(self.channel.id, chat_ring._subscribers)
+
+            await mux.send_json_to({'stream': 'chat', 'text': json.dumps({'signal_type': 'chat_message', 'data': 'hi'})})
+            frame = await self._frame(mux, 'chat')
+            self.assertEqual((frame['type'], frame['message']), ('chat_message', 'hi'))
+
+            # Kapatılan akışın consumer'ı disconnect'ini bitirir
+            await mux.send_json_to({'action': 'unsubscribe', 'stream': 'chat'})
+            self.assertEqual(await self._frame(mux, 'chat'), {'stream': 'chat', 'event': 'close', 'code': 1000})
+            self.assertTrue(await self._released())
+            await mux.send_json_to({'stream': 'chat', 'text': json.dumps({'signal_type': 'chat_message', 'data': 'x'})})
+            self.assertTrue(await mux.receive_nothing(0.3))
+
+            await self._subscribe(mux, 'again')
+            self.assertEqual((await self._frame(mux, 'again'))['event'], 'accept')
+            self.assertEqual((await self._frame(mux, 'again'))['type'], 'chat_history')
+        finally:
+            await mux.disconnect()
+            await chat_writer.get_chat_writer().flush()
+        # Dış bağlantı kapanınca iç akışlar da disconnect'ini bitirir
+        self.assertNotIn(self.channel.id, chat_ring._subscribers)
+
+    @override_settings(WEBSOCKET_MULTIPLEX={'max_streams': 1})
+    async def test_refused_and_extra_streams_close_alone(self):
+        mux = await self._connect(self.bob)
+        try:
+            await self._subscribe(mux, 'chat')
+            self.assertEqual((await self._frame(mux, 'chat'))['event'], 'accept')
+            self.assertEqual((await self._frame(mux, 'chat'))['type'], 'chat_history')
+            await self._subscribe(mux, 'second')
+            self.assertEqual(await self._frame(mux, 'second'), {'stream': 'second', 'event': 'close', 'code': 4008})
+            await mux.send_json_to({'action': 'unsubscribe', 'stream': 'chat'})
+            self.assertEqual((await self._frame(mux, 'chat'))['event'], 'close')
+
+            await mux.send_json_to({'action': 'subscribe', 'stream': 'nowhere', 'path': '/ws/nowhere/'})
+            self.assertEqual(await self._frame(mux, 'nowhere'), {'stream': 'nowhere', 'event': 'close', 'code': 4004})
+            with self.assertLogs('main', 'WARNING'):
+                await self._subscribe(mux, 'private', server_slug='a')
+                frame = await self._frame(mux, 'private')
+            self.assertEqual(frame['event'], 'close')
+        finally:
+            await mux.disconnect()
+
+
+class LayerCodecTests(SimpleTestCase):
+    def test_bytes_round_trip(self):
+        message = {'type': 'websocket.send', 'bytes': b'\x00\xffdata', 'nested': {'raw': bytearray(b'ab')}, 'text': 'ğ'}
+        decoded = decode_message(encode_message(message))
+        self.assertEqual(decoded, {'type': 'websocket.send', 'bytes': b'\x00\xffdata', 'nested': {'raw': b'ab'}, 'text': 'ğ'})
+
+    def test_unserializable_value_is_rejected(self):
+        with self.assertRaises(TypeError):
+            encode_message({'type': 'x', 'value': object()})
+
+    def test_channel_owner(self):
+        layer_id = new_layer_id()
+        channel = specific_channel_name('specific.', layer_id)
+        self.assertTrue(channel.startswith(f'specific.{layer_id}!'))
+        self.assertEqual(channel_owner(channel), layer_id)
+        self.assertIsNone(channel_owner('shared.channel'))
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.socket_dir, True)
+
+    def _layer(self):
+        return UnixSocketChannelLayer(socket_dir=self.socket_dir, discovery_interval=0)
+
+    async def test_send_and_group_send_between_processes(self):
+        first, second = self._layer(), self._layer()
+        try:
+            local = await first.new_channel()
+            remote = await second.new_channel()
+            await first.send(remote, {'type': 'test.message', 'bytes': b'\x01'})
+            self.assertEqual(await asyncio.wait_for(second.receive(remote), 2), {'type': 'test.message', 'bytes': b'\x01'})
+
+            # Başka sürecin kanalı için group_add sahibine iletilir
+            await first.group_add('room', local)
+            await first.group_add('room', remote)
+            await first.group_send('room', {'type': 'test.message', 'n': 1})
+            self.assertEqual(await asyncio.wait_for(first.receive(local), 2), {'type': 'test.message', 'n': 1})
+            self.assertEqual(await asyncio.wait_for(second.receive(remote), 2), {'type': 'test.message', 'n': 1})
+
+            await first.group_discard('room', remote)
+            await first.group_send('room', {'type': 'test.message', 'n': 2})
+            self.assertEqual(await asyncio.wait_for(first.receive(local), 2), {'type': 'test.message', 'n': 2})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(second.receive(remote), 0.2)
+        finally:
+            await first.close()
+            await second.close()
+
+    async def test_dead_peer_socket_is_removed(self):
+        layer, gone = self._layer(), self._layer()
+        try:
+            await gone.new_channel()
+            await gone.close()
+            # Süreç öldü ama soket dosyası kaldı
+            open(gone.socket_path, 'w').close()
+            await layer.group_send('room', {'type': 'test.message'})
+            self.assertFalse(os.path.exists(gone.socket_path))
+            self.assertEqual(layer._peers, set())
+        finally:
+            await layer.close()
+
+
+class PostgresChannelLayerTests(TransactionTestCase):
+    """The layer uses its own connections, so the rows must be committed."""
+
+    def _layers(self):
+        return PostgresChannelLayer(cleanup_interval=3600), PostgresChannelLayer(cleanup_interval=3600)
+
+    async def _close(self, *layers):
+        for layer in layers:
+            await layer.close()
+
+    async def test_send_to_other_process(self):
+        sender, receiver = self._layers()
+        try:
+            channel = await receiver.new_channel()
+            await sender.send(channel, {'type': 'test.message', 'text': 'hi'})
+            message = await asyncio.wait_for(receiver.receive(channel), 5)
+            self.assertEqual(message, {'type': 'test.message', 'text': 'hi'})
+        finally:
+            await self._close(sender, receiver)
+
+    async def test_big_group_and_body_are_spilled(self):
+        sender, receiver = self._layers()
+        try:
+            channels = [await receiver.new_channel() for _ in range(1000)]
+            for channel in channels:
+                await receiver.group_add('big', channel)
+            await sender.group_send('big', {'type': 'test.message', 'blob': 'x' * 20000})
+            for channel in (channels[0], channels[-1]):
+                message = await asyncio.wait_for(receiver.receive(channel), 5)
+                self.assertEqual(len(message['blob']), 20000)
+        finally:
+            await self._close(sender, receiver)
+
+    async def test_listener_error_keeps_delivering(self):
+        sender, receiver = self._layers()
+        try:
+            channel = await receiver.new_channel()
+            pending = asyncio.ensure_future(receiver.receive(channel))
+            await asyncio.sleep(0)
+            backend_pid = receiver._listener.get_backend_pid()
+            with self.assertLogs('main', 'ERROR'):
+                await sender._query(lambda cursor: cursor.execute('SELECT pg_terminate_backend(%s)', [backend_pid]))
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if receiver._listener is not None and receiver._listener.get_backend_pid() != backend_pid:
+                        break
+                else:
+                    self.fail('listener did not reconnect')
+            self.assertFalse(pending.done())
+            await sender.send(channel, {'type': 'test.message', 'n': 1})
+            self.assertEqual(await asyncio.wait_for(pending, 5), {'type': 'test.message', 'n': 1})
+        finally:
+            await self._close(sender, receiver)
+
+    async def test_flush_keeps_the_other_alias_rows(self):
+        default = PostgresChannelLayer(cleanup_interval=3600)
+        ephemeral = PostgresChannelLayer(cleanup_interval=3600, prefix='ephemeral_layer')
+        try:
+            channel = await default.new_channel()
+            other = await ephemeral.new_channel()
+            await default.group_add('room', channel)
+            await ephemeral.group_add('room', other)
+            await default.send('worker.jobs', {'type': 'test.message', 'n': 1})
+            await ephemeral.send('worker.jobs', {'type': 'test.message', 'n': 2})
+
+            await ephemeral.flush()
+            await default.group_send('room', {'type': 'test.message', 'n': 3})
+            self.assertEqual(await asyncio.wait_for(default.receive(channel), 5), {'type': 'test.message', 'n': 3})
+            self.assertEqual(await asyncio.wait_for(default.receive('worker.jobs'), 5), {'type': 'test.message', 'n': 1})
+            rows = await database_sync_to_async(ChannelLayerGroup.objects.filter(layer='ephemeral_layer').count)()
+            self.assertEqual(rows, 0)
+        finally:
+            await self._close(default, ephemeral)
@@ -11,8 +11,11 @@ urlpatterns = [
     path('server/<slug:server_slug>/create-text-channel/', views.create_text_channel, name='create_text_channel'),
     path('server/<slug:server_slug>/create-voice-channel/', views.create_voice_channel, name='create_voice_channel'),
     path('server/<slug:server_slug>/channel/<slug:channel_slug>/', views.channel_view, name='channel_view'),
+    path('server/<slug:server_slug>/search/', views.search_messages, name='search_messages'),
     path('oda/<slug:slug>/', views.voice_channel_view, name='odasayfasi'),  # Legacy support
+    path('api/chat/export/', views.export_chat_messages, name='export_chat_messages'),
     path('api/chat/<slug:slug>/messages/', views.chat_messages_api, name='chat_messages_api'),
+    path('api/chat/<slug:slug>/read/', views.mark_channel_read, name='mark_channel_read'),
     path('settings/', views.settings_view, name='settings'),
 
     path('game-lobby/', views.all_games_lobby, name='all_games_lobby'),
@@ -26,6 +29,8 @@ urlpatterns = [
     path('game/play/<uuid:game_id>/', views.game_room, name='game_room'),
     path('game/rematch/<uuid:game_id>/', views.rematch_request, name='rematch_request'),
     path('game/delete/<uuid:game_id>/', views.delete_game, name='delete_game'),
+    path('game/replay/<uuid:game_id>/', views.game_replay, name='game_replay'),
+    path('<slug:game_slug>/replays/export/', views.export_game_replays, name='export_game_replays'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
     path('<slug:game_slug>/leaderboard/', views.game_leaderboard, name='game_leaderboard'),
 ]
\ No newline at end of file
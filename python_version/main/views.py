@@ -1,23 +1,33 @@
+import heapq
 import json
+import uuid
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.contrib import messages
 from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db.models import Count, Q, Case, When, FloatField, F
 from django.db import models
 from django.shortcuts import redirect, get_object_or_404, render
 from django.utils.translation import gettext_lazy as _
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.urls import reverse
 
-from .models import CustomUser, Server, ServerRole, ServerMember, TextChannel, VoiceChannel, GameSession, MiniGame, ChatMessage
+from .models import CustomUser, Server, ServerRole, ServerMember, TextChannel, VoiceChannel, GameSession, GameArchive, MiniGame, ChatMessage
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.conf import settings as django_settings
 
+from . import channel_access, chat_export, chat_history, chat_ring, chat_search, dice_wars, read_state
+from .presence import get_presence_config
+from .streaming import (
+    CSV_CONTENT_TYPE, GZIP_CONTENT_TYPE, NDJSON_CONTENT_TYPE, ndjson_lines, ranged_streaming_response,
+    streaming_response
+)
+
 
 def index(request):
     """Landing page - shows servers if logged in"""
@@ -68,8 +78,7 @@ def join_server(request):
             if server.owner == request.user and not server.members.filter(user=request.user).exists():
                 ServerMember.objects.get_or_create(
                     server=server,
-                    user=request.user,
-                    defaults={'is_online': True}
+                    user=request.user
                 )
                 messages.success(request, _("Successfully joined {server_name}!").format(server_name=server.name))
                 return redirect('server_view', slug=server.slug)
@@ -88,8 +97,7 @@ def join_server(request):
             # Create ServerMember
             ServerMember.objects.get_or_create(
                 server=server,
-                user=request.user,
-                defaults={'is_online': True}
+                user=request.user
             )
             
             messages.success(request, _("Successfully joined {server_name}!").format(server_name=server.name))
@@ -117,8 +125,7 @@ def server_view(request, slug):
     if server.owner == request.user and not server.members.filter(user=request.user).exists():
         ServerMember.objects.get_or_create(
             server=server,
-            user=request.user,
-            defaults={'is_online': True}
+            user=request.user
         )
         is_member = True
     
@@ -150,6 +157,8 @@ def server_view(request, slug):
         'user_roles': user_roles,
         'text_channels': server.text_channels.all(),
         'voice_channels': server.voice_channels.all(),
+        'unread_counts': read_state.unread_counts(request.user, server),
+        'presence_heartbeat_seconds': get_presence_config()['heartbeat_seconds'],
         'members': server.members.select_related('user').all(),
         'coturn_config': coturn_config,  # For template display
         'coturn_config_json': coturn_config_json,  # For JavaScript
@@ -169,9 +178,8 @@ def channel_view(request, server_slug, channel_slug):
         messages.error(request, _("You don't have access to this server."))
         return redirect('index')
     
-    # Get recent messages
-    recent_messages = ChatMessage.objects.filter(channel=channel).select_related('user').order_by('-created_at')[:50]
-    recent_messages = list(reversed(recent_messages))
+    # Get recent messages (ring buffer'dan; soğuksa tek sorgu)
+    recent_messages = chat_ring.recent_messages(channel)[0]
     
     context = {
         'server': server,
@@ -188,9 +196,9 @@ def voice_channel_view(request, slug):
 
     channel = get_object_or_404(VoiceChannel, slug=slug)
     
-    # Get recent chat messages (last 50)
-    recent_messages = ChatMessage.objects.filter(channel=channel).select_related('user').order_by('-created_at')[:50]
-    recent_messages = list(reversed(recent_messages))  # Reverse to show oldest first
+    # Sesli kanal sohbeti kaydedilmiyor (ChatMessage sadece TextChannel'a bağlı),
+    # bu yüzden gösterilecek geçmiş yok
+    recent_messages = []
     
     # Get online and all members (from the server if it exists)
     if channel.server:
@@ -209,39 +217,135 @@ def voice_channel_view(request, slug):
         'recent_messages': recent_messages,
         'online_members': online_members,
         'all_members': all_members,
+        'presence_heartbeat_seconds': get_presence_config()['heartbeat_seconds'],
     }
     return render(request, 'oda.html', context)
 
 
 @login_required
 def chat_messages_api(request, slug):
-    """API endpoint to fetch chat messages for a channel (TextChannel or VoiceChannel)"""
-    # Try TextChannel first, then VoiceChannel
-    channel = None
+    """
+    API endpoint to fetch chat messages for a channel (TextChannel or VoiceChannel).
+    Keyset paginated: ?before=<cursor>, ?after=<cursor> or ?around=<message id>,
+    plus ?limit (capped at MAX_PAGE_SIZE). ?server_slug picks the server (and
+    ?channel_type the kind, text first otherwise), as in mark_channel_read.
+    """
+    channel, allowed = channel_access.lookup(
+        request.GET.get('server_slug'), request.GET.get('channel_type'), slug, request.user.id
+    )
+    if channel is None:
+        return JsonResponse({'error': 'Channel not found'}, status=404)
+    if not allowed:
+        return JsonResponse({'error': _("You don't have access to this channel.")}, status=403)
+
+    if isinstance(channel, VoiceChannel):
+        # Sesli kanallardaki sohbet kaydedilmiyor
+        return JsonResponse({
+            'messages': [], 'has_more_before': False, 'has_more_after': False,
+            'before_cursor': None, 'after_cursor': None,
+        })
+
+    limit = chat_history.parse_page_size(request.GET.get('limit'))
+    before, after, around = request.GET.get('before'), request.GET.get('after'), request.GET.get('around')
+
+    if not (before or after or around) and limit <= chat_ring.RING_SIZE:
+        # Son sayfa: ring buffer'dan
+        messages_data, has_more_before = chat_ring.recent_messages(channel)
+        page_data = messages_data[-limit:]
+        before_cursor, after_cursor = chat_history.page_cursors(page_data)
+        return JsonResponse({
+            'messages': page_data,
+            'has_more_before': has_more_before or len(messages_data) > limit,
+            'has_more_after': False,
+            'before_cursor': before_cursor,
+            'after_cursor': after_cursor,
+        })
+
     try:
-        channel = TextChannel.objects.get(slug=slug)
-    except TextChannel.DoesNotExist:
-        try:
-            channel = VoiceChannel.objects.get(slug=slug)
-        except VoiceChannel.DoesNotExist:
-            return JsonResponse({'error': 'Channel not found'}, status=404)
-    
-    limit = int(request.GET.get('limit', 50))
-    
-    messages = ChatMessage.objects.filter(channel=channel).select_related('user').order_by('-created_at')[:limit]
-    
-    messages_data = [
-        {
-            'id': msg.id,
-            'author': msg.user.username,
-            'content': msg.content,
-            'timestamp': msg.created_at.isoformat(),
-            'created_at': msg.created_at.strftime('%I:%M %p'),
-        }
-        for msg in reversed(messages)
-    ]
-    
-    return JsonResponse({'messages': messages_data})
+        page = chat_history.fetch_page(
+            channel,
+            limit=limit,
+            before=before,
+            after=after,
+            around=around,
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ChatMessage.DoesNotExist:
+        return JsonResponse({'error': 'Message not found'}, status=404)
+
+    messages_data = [chat_history.serialize_message(msg) for msg in page['messages']]
+    before_cursor, after_cursor = chat_history.page_cursors(messages_data)
+    return JsonResponse({
+        'messages': messages_data,
+        'has_more_before': page['has_more_before'],
+        'has_more_after': page['has_more_after'],
+        'before_cursor': before_cursor,
+        'after_cursor': after_cursor,
+    })
+
+@login_required
+def mark_channel_read(request, slug):
+    """
+    POST: marks a text channel read up to message_id (default: latest
+    message). server_slug picks the server; the channel slug alone is only
+    accepted while it is unique.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': _('Invalid request method.')}, status=405)
+
+    channel, allowed = channel_access.lookup(request.POST.get('server_slug'), 'text', slug, request.user.id)
+    if channel is None:
+        return JsonResponse({'error': _('Channel not found.')}, status=404)
+    if not allowed:
+        return JsonResponse({'error': _("You don't have access to this channel.")}, status=403)
+    message_id = request.POST.get('message_id', '')
+    unread = read_state.mark_read(request.user, channel, int(message_id) if message_id.isdigit() else None)
+    return JsonResponse({'unread_count': unread})
+
+
+@login_required
+def search_messages(request, server_slug):
+    """
+    Full-text message search within a server (optionally ?channel=<slug>),
+    limited to the channels the user may join. ?q is a web-search style
+    query; results are best match first and paged with ?cursor=<next_cursor>.
+    """
+    server = get_object_or_404(Server, slug=server_slug)
+    if server.is_private and not channel_access.is_member(server, request.user.id):
+        return JsonResponse({'error': "You don't have access to this server."}, status=403)
+
+    text = request.GET.get('q', '').strip()
+    if not text:
+        return JsonResponse({'results': [], 'next_cursor': None})
+
+    channels = channel_access.visible_channels(TextChannel, server, request.user.id)
+    channel_slug = request.GET.get('channel')
+    if channel_slug:
+        channels = channels.filter(slug=channel_slug)
+        if not channels.exists():
+            raise Http404
+
+    limit = chat_history.parse_page_size(request.GET.get('limit'), default=chat_search.DEFAULT_RESULTS)
+    try:
+        results, next_cursor = chat_search.search_messages(
+            text,
+            request.LANGUAGE_CODE,
+            channels=channels,
+            limit=min(limit, chat_search.MAX_RESULTS),
+            cursor=request.GET.get('cursor'),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'results': [
+            dict(chat_history.serialize_message(msg), channel=msg.channel.slug, rank=msg.rank)
+            for msg in results
+        ],
+        'next_cursor': next_cursor,
+    })
+
 
 @login_required
 def settings_view(request):
@@ -466,8 +570,13 @@ def create_game(request, game_slug):
 # 5. OYUN ODASI (DEĞİŞTİ)
 @login_required
 def game_room(request, game_id):
-    game = get_object_or_404(GameSession.objects.select_related('game_type', 'host', 'current_turn', 'winner'),
-                             game_id=game_id)
+    game = GameSession.objects.select_related('game_type', 'host', 'current_turn', 'winner').filter(
+        game_id=game_id
+    ).first()
+    if game is None:
+        # Bitmiş ve arşive taşınmış oyunlar salt okunur gösterilir
+        return archived_game_room(request, game_id)
+
     is_player = game.players.filter(id=request.user.id).exists()
     is_spectator = not is_player
 
@@ -477,6 +586,7 @@ def game_room(request, game_id):
     eliminated_players = game.eliminated_players if game.eliminated_players else []
     return render(request, 'game_room.html', {
         'game': game,
+        'player_usernames': [p.username for p in game.players.all()],
         'is_spectator': is_spectator,
         'game_id_json': str(game_id),
         'username_json': request.user.username,
@@ -487,24 +597,54 @@ def game_room(request, game_id):
     })
 
 
+def archived_game_room(request, game_id):
+    """Final state of an archived game, rendered with the normal game room template."""
+    archive = get_object_or_404(
+        GameArchive.objects.select_related('game_type', 'host', 'winner'),
+        game_id=game_id
+    )
+    return render(request, 'game_room.html', {
+        'game': archive,
+        'player_usernames': archive.player_usernames,
+        'is_spectator': not archive.has_player(request.user),
+        'game_id_json': str(game_id),
+        'username_json': request.user.username,
+        'initial_board_state_json': json.dumps(archive.board_state),
+        'board_size_json': archive.board_size,
+        'eliminated_players_json': json.dumps([]),
+        'winner_json': archive.winner.username if archive.winner else None,
+    })
+
+
 @login_required
 def rematch_request(request, game_id):
     if request.method != 'POST':
         return JsonResponse({'error': _('Invalid request method.')}, status=405)
 
-    game = get_object_or_404(
-        GameSession.objects.select_related('game_type', 'host').prefetch_related('players'),
+    game = GameSession.objects.select_related('game_type', 'host').prefetch_related('players').filter(
         game_id=game_id
-    )
-
-    if game.status != 'finished':
-        return JsonResponse({'error': _('Game has not finished yet.')}, status=400)
-
-    if not game.players.filter(id=request.user.id).exists():
-        return JsonResponse({'error': _('You are not part of this game.')}, status=403)
+    ).first()
+
+    if game is not None:
+        if game.status != 'finished':
+            return JsonResponse({'error': _('Game has not finished yet.')}, status=400)
+        if not game.players.filter(id=request.user.id).exists():
+            return JsonResponse({'error': _('You are not part of this game.')}, status=403)
+        game_type = game.game_type
+        invited_players = [player.username for player in game.players.all() if player != request.user]
+    else:
+        # Oyun arşive taşınmış olabilir
+        try:
+            game = GameArchive.objects.select_related('game_type').get(game_id=game_id)
+        except GameArchive.DoesNotExist:
+            raise Http404
+        if not game.has_player(request.user):
+            return JsonResponse({'error': _('You are not part of this game.')}, status=403)
+        game_type = game.game_type
+        invited_players = [p['username'] for p in game.players if p['id'] != request.user.id]
 
     existing_waiting = GameSession.objects.filter(
-        game_type=game.game_type,
+        game_type=game_type,
         host=request.user,
         status='waiting'
     ).order_by('-created_at').first()
@@ -515,17 +655,15 @@ def rematch_request(request, game_id):
             'redirect_url': reverse('game_room', args=[existing_waiting.game_id])
         })
 
-    invited_players = [player.username for player in game.players.all() if player != request.user]
-
     new_game = GameSession.objects.create(
-        game_type=game.game_type,
+        game_type=game_type,
         host=request.user,
         status='waiting',
         board_state={},
         board_size=game.board_size,
         is_private=True,
         invited_players=invited_players,
-        rematch_parent=game
+        rematch_parent=game if isinstance(game, GameSession) else None
     )
     new_game.players.add(request.user)
 
@@ -632,6 +770,130 @@ def delete_game(request, game_id):
     return redirect('game_specific_lobby', game_slug=game_slug)
 
 
+def _replay_header(game):
+    if isinstance(game, GameArchive):
+        player_usernames = game.player_usernames
+    else:
+        player_usernames = [p.username for p in game.players.all()]
+    return {
+        'type': 'game',
+        'game_id': str(game.game_id),
+        'game_type': game.game_type.slug if game.game_type else None,
+        'board_size': game.board_size,
+        'players': player_usernames,
+        'winner': game.winner.username if game.winner else None,
+        'move_count': game.move_count,
+        'created_at': game.created_at,
+        'finished_at': game.finished_at,
+    }
+
+
+def _replay_records(game, include_frames=True, header=None):
+    """Header line followed by the moves (and frames) regenerated with the Dice Wars rules."""
+    yield header or _replay_header(game)
+    for frame in dice_wars.replay_moves(game.move_log or [], game.board_size):
+        if include_frames or frame['type'] == 'move':
+            yield frame
+
+
+@login_required
+def game_replay(request, game_id):
+    """Bitmiş bir oyunun hamle ve karelerini NDJSON olarak akıtır (Range destekli)."""
+    game = GameSession.objects.select_related('game_type', 'winner').prefetch_related('players').filter(
+        game_id=game_id
+    ).first()
+    if game is None:
+        game = get_object_or_404(GameArchive.objects.select_related('game_type', 'winner'), game_id=game_id)
+    elif game.status != 'finished':
+        return JsonResponse({'error': _('Game has not finished yet.')}, status=400)
+
+    include_frames = request.GET.get('frames', '1') != '0'
+    # Oyun bir kez yüklenir; her geçiş sadece saf kurallarla yeniden üretilir
+    header = _replay_header(game)
+
+    def make_chunks():
+        return ndjson_lines(_replay_records(game, include_frames=include_frames, header=header))
+
+    return ranged_streaming_response(
+        request, make_chunks, NDJSON_CONTENT_TYPE, filename=f"replay-{game_id}.ndjson"
+    )
+
+
+@staff_member_required
+def export_game_replays(request, game_slug):
+    """
+    Bir MiniGame'in bütün bitmiş oyunlarını NDJSON olarak akıtır.
+    Hot (GameSession) ve arşiv (GameArchive) tabloları sunucu tarafı imleçle
+    game_id sırasında okunup birleştirilir; yarıda kalan bir indirme
+    ?after=<son game_id> ile devam ettirilebilir.
+    """
+    game_type = get_object_or_404(MiniGame, slug=game_slug)
+    include_frames = request.GET.get('frames', '1') != '0'
+
+    hot = GameSession.objects.filter(game_type=game_type, status='finished')
+    archived = GameArchive.objects.filter(game_type=game_type)
+    after = request.GET.get('after')
+    if after:
+        try:
+            after = uuid.UUID(after)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        hot = hot.filter(game_id__gt=after)
+        archived = archived.filter(game_id__gt=after)
+
+    def records():
+        games = heapq.merge(
+            hot.select_related('game_type', 'winner').prefetch_related('players')
+               .order_by('game_id').iterator(chunk_size=500),
+            archived.select_related('game_type', 'winner').order_by('game_id').iterator(chunk_size=500),
+            key=lambda g: g.game_id,
+        )
+        for game in games:
+            game_id = str(game.game_id)
+            for record in _replay_records(game, include_frames=include_frames):
+                record['game_id'] = game_id
+                yield record
+
+    return streaming_response(
+        ndjson_lines(records()), NDJSON_CONTENT_TYPE, filename=f"{game_slug}-replays.ndjson"
+    )
+
+
+@staff_member_required
+def export_chat_messages(request):
+    """
+    Sohbet geçmişini NDJSON veya CSV olarak akıtır (moderasyon / veri talepleri).
+    Filtreler: ?server=&channel=&user=&since=&until=; ?format=csv, ?gzip=1.
+    """
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in chat_export.EXPORT_FORMATS:
+        return JsonResponse({'error': 'Invalid format'}, status=400)
+    try:
+        queryset = chat_export.export_queryset_from_params(
+            server=request.GET.get('server'),
+            channel=request.GET.get('channel'),
+            user=request.GET.get('user'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    compress = request.GET.get('gzip') == '1'
+    filename = '-'.join(
+        request.GET[key] for key in ('server', 'channel', 'user') if request.GET.get(key)
+    ) or 'all'
+    filename = f"chat-{filename}.{export_format}"
+    content_type = NDJSON_CONTENT_TYPE if export_format == 'ndjson' else CSV_CONTENT_TYPE
+    if compress:
+        filename += '.gz'
+        content_type = GZIP_CONTENT_TYPE
+
+    return streaming_response(
+        chat_export.export_chunks(queryset, export_format, compress=compress), content_type, filename=filename
+    )
+
+
 @login_required
 def leaderboard(request):
     """
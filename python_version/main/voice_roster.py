@@ -0,0 +1,108 @@
+"""
+Who is in each voice room, with their mic/camera state.
+
+The process-wide roster is authoritative for connections handled by this
+process (admit-or-reject against VoiceChannel.user_limit happens under one
+lock). Members connected to other workers are mirrored from the room's
+channel layer events (member.joined / member.left / state changes), which
+every local consumer of the room receives. A room is only kept while this
+process has a local member in it; a process that has none first asks the
+room for its roster over the layer (VoiceChatConsumer.sync_roster).
+"""
+import threading
+
+from django.utils import timezone
+
+
+def make_entry(user_id, username, channel_name, muted=False, camera_enabled=False, joined_at=None, local=False):
+    return {
+        'user_id': str(user_id),
+        'username': username,
+        'channel_name': channel_name,
+        'muted': muted,
+        'camera_enabled': camera_enabled,
+        'joined_at': joined_at or timezone.now().isoformat(),
+        'local': local,
+    }
+
+
+def public_entry(entry):
+    """Roster entry as sent to clients (no channel names)."""
+    return {key: entry[key] for key in ('user_id', 'username', 'muted', 'camera_enabled', 'joined_at')}
+
+
+class VoiceRoster:
+    def __init__(self):
+        self._rooms = {}  # room -> {channel_name: entry}
+        self._modes = {}  # room -> 'sfu' (yoksa mesh)
+        self._lock = threading.Lock()
+
+    def has_local(self, room):
+        with self._lock:
+            return any(entry['local'] for entry in self._rooms.get(room, {}).values())
+
+    def admit(self, room, entry, limit):
+        """
+        Adds entry unless the room already holds `limit` distinct users
+        (0 = unlimited; a user opening a second connection is always let in).
+        Returns (admitted, members already in the room).
+        """
+        with self._lock:
+            members = self._rooms.setdefault(room, {})
+            others = [member for member in members.values() if member['channel_name'] != entry['channel_name']]
+            user_ids = {member['user_id'] for member in others}
+            if limit and entry['user_id'] not in user_ids and len(user_ids) >= limit:
+                if not any(member['local'] for member in others):
+                    del self._rooms[room]
+                    self._modes.pop(room, None)
+                return False, others
+            members[entry['channel_name']] = entry
+            return True, others
+
+    def seed(self, room, entries):
+        """Fills a room this process does not keep yet with members reported by other workers."""
+        with self._lock:
+            members = self._rooms.setdefault(room, {})
+            for entry in entries:
+                members.setdefault(entry['channel_name'], dict(entry, local=False))
+
+    def mirror(self, room, entry):
+        """Adds/refreshes a member seen through the layer; ignored unless the room is kept here."""
+        with self._lock:
+            members = self._rooms.get(room)
+            if members is not None and not members.get(entry['channel_name'], {}).get('local'):
+                members[entry['channel_name']] = dict(entry, local=False)
+
+    def update(self, room, channel_name, **state):
+        with self._lock:
+            entry = self._rooms.get(room, {}).get(channel_name)
+            if entry is not None:
+                entry.update(state)
+
+    def discard(self, room, channel_name):
+        with self._lock:
+            members = self._rooms.get(room)
+            if members is None:
+                return
+            members.pop(channel_name, None)
+            if not any(entry['local'] for entry in members.values()):
+                # Yerel üye kalmadı; uzak üyelerin olaylarını artık görmüyoruz
+                del self._rooms[room]
+                self._modes.pop(room, None)
+
+    def mode(self, room):
+        """'mesh' (peer to peer) or 'sfu'; a room stays on the SFU until it empties."""
+        with self._lock:
+            return self._modes.get(room, 'mesh')
+
+    def set_mode(self, room, mode):
+        with self._lock:
+            if room in self._rooms:
+                self._modes[room] = mode
+
+    def snapshot(self, room):
+        with self._lock:
+            return [dict(entry) for entry in self._rooms.get(room, {}).values()]
+
+
+voice_roster = VoiceRoster()
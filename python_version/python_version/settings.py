@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'django.contrib.postgres',
     "daphne",
     'django.contrib.staticfiles',
     "main",
@@ -168,8 +170,57 @@ ASGI_APPLICATION = 'python_version.asgi.application' # <-- Proje adınızdaki as
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
+    },
+    # Yazıyor/konuşuyor göstergeleri: ayrı kapasite, kısa ömür; dolunca çerçeve düşer
+    "ephemeral": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 20, "expiry": 5},
+    },
+}
+# Birden çok Daphne süreci/sunucusu: CHANNEL_LAYER=postgres (LISTEN/NOTIFY, bkz. main/pg_layer.py)
+# Tek makinede birden çok süreç: CHANNEL_LAYER=socket (UNIX soketleri, bkz. main/socket_layer.py)
+if os.getenv('CHANNEL_LAYER') == 'postgres':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "main.pg_layer.PostgresChannelLayer",
+            "CONFIG": {"expiry": 60, "group_expiry": 86400, "capacity": 100},
+        },
+        "ephemeral": {
+            "BACKEND": "main.pg_layer.PostgresChannelLayer",
+            "CONFIG": {"expiry": 5, "capacity": 20, "prefix": "ephemeral_layer"},
+        },
     }
+elif os.getenv('CHANNEL_LAYER') == 'socket':
+    CHANNEL_SOCKET_DIR = os.getenv('CHANNEL_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'nbcsw2-channels'))
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "main.socket_layer.UnixSocketChannelLayer",
+            "CONFIG": {"expiry": 60, "group_expiry": 86400, "capacity": 100, "socket_dir": CHANNEL_SOCKET_DIR},
+        },
+        "ephemeral": {
+            "BACKEND": "main.socket_layer.UnixSocketChannelLayer",
+            "CONFIG": {"expiry": 5, "capacity": 20, "socket_dir": os.path.join(CHANNEL_SOCKET_DIR, 'ephemeral')},
+        },
+    }
+
+# Süreçler arası paylaşılan önbellek (channel_access yetki önbelleği); tek süreçte LocMemCache yeter
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
 }
+if os.getenv('CHANNEL_LAYER') == 'postgres':
+    # Tablo bir kez oluşturulur: python manage.py createcachetable
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "main_shared_cache",
+    }
+elif os.getenv('CHANNEL_LAYER') == 'socket':
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(CHANNEL_SOCKET_DIR, 'cache'),
+    }
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -194,3 +245,84 @@ COTURN_CONFIG = {
         {'urls': ['stun:stun.ekiga.net:3478']},
     ]
 }
+
+# Terk edilmiş GameSession temizleyicisi (python manage.py reap_game_sessions)
+GAME_SESSION_REAPER = {
+    'waiting_ttl_minutes': 30,       # Bu süre boyunca kimsenin bağlı olmadığı bekleyen masalar silinir
+    'in_progress_ttl_minutes': 120,  # Bu süre boyunca hamle yapılmayan oyunlar kapatılır
+    'batch_size': 200,
+    'interval_seconds': 60,
+}
+
+# Bitmiş oyunların arşivlenmesi (python manage.py archive_games)
+GAME_ARCHIVE = {
+    'after_days': 7,  # Bu kadar gün önce biten oyunlar GameArchive tablosuna taşınır
+    'batch_size': 200,
+}
+
+# Sohbet mesajları için toplu (write-behind) yazım
+CHAT_WRITER = {
+    'flush_interval_ms': 5,   # Tampondaki mesajlar en geç bu kadar sonra yazılır
+    'batch_size': 100,        # Bu kadar mesaj birikince beklemeden yazılır
+    'max_pending': 5000,      # Kuyruk sınırı; dolunca gönderen yazımı bekler
+    'id_block_size': 100,     # Sequence'tan tek seferde ayrılan id sayısı
+    'max_attempts': 6,        # Yazılamayan parti bu kadar denemeden sonra atılır
+    'retry_base_delay_ms': 200,  # Yeniden deneme beklemesi, her denemede iki katına çıkar
+}
+
+# WebRTC sinyalleşmesi: trickle ICE adaylarını alıcı başına toplu gönder
+VOICE_SIGNALING = {
+    'ice_batch_window_ms': 20,  # Bu pencerede gelen adaylar tek mesajda gider
+    'ice_batch_max': 20,        # Bu kadar aday birikince beklemeden gönderilir
+    'roster_sync_timeout_ms': 150,  # Odada yerel üye yokken diğer worker'lardan kadro bekleme süresi
+}
+
+# Büyük sesli odalar için sunucu tarafı SFU (aiortc kurulu olmalı; VoiceChannel.sfu_enabled)
+VOICE_SFU = {
+    'workers': 2,                    # Medya ileten ayrı süreç sayısı
+    'request_timeout_seconds': 10,
+}
+
+# Çevrimiçi durumu: WebSocket heartbeat'leri bellekte tutulur, ServerMember.is_online toplu yazılır
+PRESENCE = {
+    'heartbeat_seconds': 30,       # İstemcinin heartbeat aralığı
+    'ttl_seconds': 90,             # Bu kadar heartbeat gelmeyen bağlantı düşer
+    'flush_interval_seconds': 5,   # Değişiklikler bu aralıkla yazılır ve yayınlanır
+    'resync_every': 12,            # Her N flush'ta bu süreçteki çevrimiçi kullanıcılar yeniden yazılır
+    'stale_after_seconds': 300,    # Bu kadar damgalanmayan çevrimiçi satır (çökmüş süreç) çevrimdışı yapılır
+}
+
+# Geçici göstergeler (yazıyor/konuşuyor): asla kaydedilmez, CHANNEL_LAYERS['ephemeral'] üzerinden yayılır
+EPHEMERAL_EVENTS = {
+    'layer': 'ephemeral',
+    'flush_interval_ms': 250,    # Oda başına en fazla bu aralıkla bir çerçeve
+    'typing_ttl_seconds': 6,     # Yenilenmeyen gösterge bu sürede kapanır
+    'speaking_ttl_seconds': 2,
+    'queue_size': 16,            # Bağlantı başına bekleyen çerçeve; dolunca en eskisi düşer
+}
+
+# WebSocket bağlanırken kanal çözümü ve üyelik kontrolü (main/channel_access.py)
+# Birden çok süreçte silme/güncelleme hepsine ulaşmalı: paylaşılan önbellek şart (yoksa uygulama başlamaz)
+CHANNEL_ACCESS = {
+    'cache': 'shared' if 'shared' in CACHES else 'default',
+    'timeout': 300,              # Saniye; sinyal göndermeyen toplu güncellemelerde de en fazla bu kadar eski kalır
+}
+
+# Tek WebSocket üzerinden çoklanan akışlar (ws/mux/)
+WEBSOCKET_MULTIPLEX = {
+    'max_streams': 16,           # Bağlantı başına açık akış; fazlası 4008 ile kapanır
+}
+
+# Aylık ChatMessage partition'ları ve saklama süresi (python manage.py manage_chat_partitions)
+CHAT_PARTITIONS = {
+    'months_ahead': 2,            # Şimdiden hazırlanacak gelecek ay sayısı
+    'retention_days': None,       # Server.message_retention_days boşsa; None = süresiz sakla
+    'delete_batch_size': 5000,    # Daha kısa süreli sunucular için DELETE başına satır
+    'detach': False,              # True: süresi dolan partition silinmez, ayrılır
+}
+
+# Sunucu/kanal/kullanıcı silme: önce işaretlenir, process_deletions komutu parça parça siler
+PENDING_DELETIONS = {
+    'batch_size': 1000,        # Transaction başına silinen satır
+    'interval_seconds': 30,    # --loop modunda turlar arası bekleme
+}